@@ -0,0 +1,236 @@
+"""
+Classifier backends
+All backends score one window of audio and return the best of the desired
+classes, so BCD can switch between them
+"""
+
+import logging
+import zipfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TaskLibraryBackend:
+    """tflite_support Task library AudioClassifier, only sees the top max_results categories"""
+
+    def __init__(self, model_path, desired_classes, cpu_threads=4, max_results=5):
+        """
+        Initialize the Task library classifier
+
+        Args:
+            model_path (str): Path to the YAMNet tflite model
+            desired_classes (list): Category names reported by score()
+            cpu_threads (int): Threads used by the classifier
+            max_results (int): Number of top categories returned per inference
+        """
+        from tflite_support.task import audio
+        from tflite_support.task import core
+        from tflite_support.task import processor
+
+        self._desired_classes = set(desired_classes)
+        base_options = core.BaseOptions(file_name=model_path, use_coral=False, num_threads=cpu_threads)
+        classification_options = processor.ClassificationOptions(max_results=max_results)
+        options = audio.AudioClassifierOptions(base_options=base_options, classification_options=classification_options)
+        self._classifier = audio.AudioClassifier.create_from_options(options)
+        self._tensor_audio = self._classifier.create_input_tensor_audio()
+
+    def set_desired_classes(self, desired_classes):
+        """Report other categories from the next window on, without reloading the model"""
+        self._desired_classes = set(desired_classes)
+
+    @property
+    def sample_rate(self):
+        return self._tensor_audio.format.sample_rate
+
+    @property
+    def input_length(self):
+        return len(self._tensor_audio.buffer)
+
+    @staticmethod
+    def align(end):
+        """Any window end will do"""
+        return end
+
+    def score(self, window, position=None):
+        """
+        Classify one window
+
+        Returns:
+            tuple: (category_name, score) of the best desired class, (None, 0.0) if none made the top results
+        """
+        self._tensor_audio.load_from_array(window.reshape(-1, 1))
+        result = self._classifier.classify(self._tensor_audio)
+
+        best = (None, 0.0)
+        for category in result.classifications[0].categories:
+            if category.category_name in self._desired_classes and category.score > best[1]:
+                best = (category.category_name, category.score)
+        return best
+
+
+class InterpreterBackend:
+    """tflite_runtime Interpreter reading the full score vector, desired classes resolved once"""
+
+    def __init__(self, model_path, desired_classes, cpu_threads=4, sample_rate=16000, labels_path=None):
+        """
+        Initialize the interpreter
+
+        Args:
+            model_path (str): Path to the YAMNet tflite model
+            desired_classes (list): Category names reported by score()
+            cpu_threads (int): Threads used by the interpreter
+            sample_rate (int): Sample rate the model expects
+            labels_path (str): Label file, one name per line (default: the one packed in the model metadata)
+        """
+        from tflite_runtime.interpreter import Interpreter
+
+        self._sample_rate = sample_rate
+        self._interpreter = Interpreter(model_path=model_path, num_threads=cpu_threads)
+        self._interpreter.allocate_tensors()
+        input_details = self._interpreter.get_input_details()[0]
+        output_details = self._interpreter.get_output_details()[0]
+        self._input_length = int(np.prod(input_details['shape']))
+        # Functions returning numpy views on the interpreter's own tensors
+        self._input = self._interpreter.tensor(input_details['index'])
+        self._output = self._interpreter.tensor(output_details['index'])
+
+        self._labels = self._load_labels(model_path, labels_path)
+        self.set_desired_classes(desired_classes)
+
+    def set_desired_classes(self, desired_classes):
+        """
+        Score other classes from the next window on, without reloading the model
+
+        Raises:
+            ValueError: if a class is not in the model labels, the current ones are kept
+        """
+        missing = [name for name in desired_classes if name not in self._labels]
+        if missing:
+            raise ValueError(f"Classes not found in the model labels: {missing}")
+        self._class_names = list(desired_classes)
+        self._class_indices = np.array([self._labels.index(name) for name in desired_classes])
+        logger.info(f"Interpreter backend scoring label indices {self._class_indices.tolist()}")
+
+    @staticmethod
+    def _load_labels(model_path, labels_path):
+        """Read the label list from a file or from the files packed in the model metadata"""
+        if labels_path:
+            with open(labels_path) as f:
+                return [line.strip() for line in f if line.strip()]
+        with zipfile.ZipFile(model_path) as packed:
+            names = [name for name in packed.namelist() if name.endswith('.txt')]
+            if not names:
+                raise ValueError(f"No label file packed in {model_path}")
+            return [line.strip() for line in packed.read(names[0]).decode().splitlines() if line.strip()]
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    @property
+    def input_length(self):
+        return self._input_length
+
+    @staticmethod
+    def align(end):
+        """Any window end will do"""
+        return end
+
+    def score(self, window, position=None):
+        """
+        Classify one window
+
+        Args:
+            window (numpy.ndarray): input_length float32 samples
+            position (int): Absolute sample index of the end of the window (unused)
+
+        Returns:
+            tuple: (category_name, score) of the best desired class
+        """
+        # The views on the tensors must be released before invoke()
+        self._input().reshape(-1)[:] = window
+        self._interpreter.invoke()
+        scores = self._output().reshape(-1)[self._class_indices]
+        best = int(np.argmax(scores))
+        return self._class_names[best], float(scores[best])
+
+
+class PatchInterpreterBackend(InterpreterBackend):
+    """
+    YAMNet exported without its waveform frontend, fed with log-mel patches
+    from the streaming frontend so overlapping windows share their frames
+    """
+
+    def __init__(self, model_path, desired_classes, cpu_threads=4, labels_path=None):
+        """
+        Initialize the interpreter and the streaming frontend
+
+        Args:
+            model_path (str): Path to the YAMNet patch model, input [1, 96, 64] log-mel
+            desired_classes (list): Category names reported by score()
+            cpu_threads (int): Threads used by the interpreter
+            labels_path (str): Label file, one name per line (default: the one packed in the model metadata)
+        """
+        from melfrontend import MEL_BANDS, PATCH_FRAMES, SAMPLE_RATE, StreamingLogMel
+
+        super().__init__(model_path, desired_classes, cpu_threads=cpu_threads, sample_rate=SAMPLE_RATE,
+                         labels_path=labels_path)
+        if self._input_length != PATCH_FRAMES * MEL_BANDS:
+            raise ValueError(f"{model_path} does not take {PATCH_FRAMES}x{MEL_BANDS} log-mel patches")
+        self._patch_shape = (PATCH_FRAMES, MEL_BANDS)
+        self._frontend = StreamingLogMel()
+
+    @property
+    def input_length(self):
+        """Samples of audio covered by one patch"""
+        return self._frontend.window_length
+
+    @property
+    def frontend(self):
+        return self._frontend
+
+    def align(self, end):
+        """Move a window end onto the frame grid, so the frames of the previous window can be reused"""
+        return self._frontend.align(end)
+
+    def score(self, window, position=None):
+        """
+        Classify one window
+
+        Args:
+            window (numpy.ndarray): input_length float32 samples
+            position (int): Absolute sample index of the end of the window, aligned with align();
+                without it the whole patch is computed
+
+        Returns:
+            tuple: (category_name, score) of the best desired class
+        """
+        # The views on the tensors must be released before invoke()
+        if position is None:
+            self._input().reshape(self._patch_shape)[:] = self._frontend.patch(window)
+        else:
+            self._frontend.patch_at(window, position, out=self._input().reshape(self._patch_shape))
+        self._interpreter.invoke()
+        scores = self._output().reshape(-1)[self._class_indices]
+        best = int(np.argmax(scores))
+        return self._class_names[best], float(scores[best])
+
+
+def create_backend(name, model_path, desired_classes, cpu_threads=4):
+    """
+    Create a classifier backend
+
+    Args:
+        name (str): 'interpreter', 'task' or 'patch' (interpreter on log-mel patches)
+        model_path (str): Path to the YAMNet tflite model
+        desired_classes (list): Category names reported by score()
+        cpu_threads (int): Threads used for inference
+    """
+    if name == 'interpreter':
+        return InterpreterBackend(model_path, desired_classes, cpu_threads=cpu_threads)
+    if name == 'patch':
+        return PatchInterpreterBackend(model_path, desired_classes, cpu_threads=cpu_threads)
+    if name == 'task':
+        return TaskLibraryBackend(model_path, desired_classes, cpu_threads=cpu_threads)
+    raise ValueError(f"Unknown classifier backend: {name}")
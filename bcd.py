@@ -4,168 +4,435 @@ Sends baby cry detection messages
 """
 
 import time
-from tflite_support.task import audio
-from tflite_support.task import core
-from tflite_support.task import processor
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import asyncio
-import websockets
-import json
 import logging
+import sys
+from backends import create_backend
+from governor import InferenceGovernor, SystemSource
+from capture import AudioCapture
+from client import ClientConnection, run_roles
+from config import Config, ConfigError, defaults, identity
+from listen import LiveStream
+from logsetup import dump_recent_logs, setup_logging
+from metrics import BCD_PORT, REGISTRY
+from recorder import ClipRecorder
+from scheduler import AdaptiveScheduler
+from startup import StartupProfiler, sd_notify
+from vad import ActivityGate
 
-import sounddevice as sd
-sd.default.device = 0
-sd.default.channels = 2
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+CLIP_DIR = "/home/rpi/lullgo/clips"
+
 
 class BCD:
-    def __init__(self, server_url, client_name="rpi-nurse.bcd"):
+    def __init__(self, server_url, client_name="rpi-nurse.bcd", room=None, model_path=None, overlap_factor=None,
+                 cpu_threads=None, use_gate=True, backend=None, adaptive=True, profiler=None, connection=None,
+                 metrics=None, clip_dir=None, capture=None, live=True, govern=True, governor_source=None,
+                 settings=None):
         """
         Initialize the WebSocket client
 
         Args:
             server_url (str): WebSocket server URL (e.g., ws://192.168.1.100:8765)
             client_name (str): Name of this client
+            room (str): Room announced with every message (default: the client name up to its first dot)
+            model_path (str): Path to the YAMNet tflite model (default: the configured one)
+            overlap_factor (float): Overlap between consecutive inference windows when not adaptive (default: the
+                configured one)
+            cpu_threads (int): Threads used by the classifier (default: the configured number)
+            use_gate (bool): Skip the model on windows without acoustic activity
+            backend (str): Classifier backend, 'interpreter' (tflite_runtime), 'task' (tflite_support) or
+                'patch' (tflite_runtime on a model taking log-mel patches, see melfrontend.py) (default: the
+                configured one)
+            adaptive (bool): Raise the overlap only while the desired classes are scoring
+            profiler (StartupProfiler): Records the startup phases, if given
+            connection (ClientConnection): Connection shared with other roles (default: a dedicated one)
+            metrics (Registry): Registry of the detection metrics (default: the process registry)
+            clip_dir (str): Directory where the audio around detections is recorded (None disables it)
+            capture (AudioCapture): Audio source at the model's sample rate (default: the I2S mic)
+            live (bool): Offer live listen-in on the connection
+            govern (bool): Step the classifier threads and the inference rate down when the SoC is hot or busy
+            governor_source (SystemSource): Temperature and CPU readings of the governor (default: sysfs and procfs)
+            settings (dict): bcd section of the configuration (default: the defaults of config.py), the
+                arguments above that are given take precedence over it, also when it is reloaded
         """
         # Initialize websocket parameters
-        self._server_url = server_url
         self._client_name = client_name
-        self._connection = None
+        self._room = room or client_name.split('.', 1)[0]
+        self._connection = connection if connection is not None else ClientConnection(server_url)
+        self._connection.add_state_listener(self._on_connection_state)
         self._is_running = False
-        self._reconnect_interval = 5
-        self._send_interval = 2
-        self._last_bcd = time.time()
-        # Initialize bcd parameters
-        self._model_path = "/home/rpi/lullgo/models/yamnet.tflite"
-        self._max_nof_results = 5
-        self._overlap_factor = 0.5  # allowed range: ]0, 1[
-        self._score_threshold = 0.3  # allowed range: [0, 1]
-        self._cpu_threads = 4
-        self._desired_classes = ["Screaming", "Baby laughter", "Crying, sobbing", "Baby cry, infant cry"]
+        self._profiler = profiler
+        # Initialize bcd parameters, validated by config.py
+        overrides = {'model_path': model_path, 'overlap_factor': overlap_factor, 'cpu_threads': cpu_threads,
+                     'backend': backend}
+        self._overrides = {key: value for key, value in overrides.items() if value is not None}
+        self._settings = settings = dict(settings if settings is not None else defaults('bcd'), **self._overrides)
+        self._send_interval = settings['send_interval']
+        self._model_path = settings['model_path']
+        self._overlap_factor = settings['overlap_factor']
+        self._quiet_overlap = settings['quiet_overlap']
+        self._active_overlap = settings['active_overlap']
+        self._rate_cooldown = settings['rate_cooldown']  # seconds
+        self._score_threshold = settings['score_threshold']
+        self._cpu_threads = settings['cpu_threads']
+        self._desired_classes = list(settings['desired_classes'])
+        # Created on first use, inside the running event loop
+        self._reconfigure_lock = None
         # Initialize the audio classification model
-        self._base_options = core.BaseOptions(file_name=self._model_path, use_coral=False, num_threads=self._cpu_threads)
-        self._classification_options = processor.ClassificationOptions(max_results=self._max_nof_results, score_threshold=self._score_threshold)
-        self._options = audio.AudioClassifierOptions(base_options=self._base_options, classification_options=self._classification_options)
-        self._classifier = audio.AudioClassifier.create_from_options(self._options)
-        # Initialize the audio recorder and a tensor to store the audio input
-        self._audio_record = self._classifier.create_audio_record()
-        self._tensor_audio = self._classifier.create_input_tensor_audio()
-
-    async def _send_bcd_msg(self):
-        """Send baby cry detection message to server"""
-        tmp = time.time()
-        if (tmp - self._last_bcd) < self._send_interval:
-            # do not send bcd message yet
-            return True
-        self._last_bcd = tmp
+        self._backend_name = settings['backend']
+        self._backend = create_backend(self._backend_name, self._model_path, self._desired_classes,
+                                       cpu_threads=self._cpu_threads)
+        # Initialize the audio capture, the ring buffer also holds the pre/post-roll of the clips
+        self._ring_seconds = 10.0
+        self._owns_capture = capture is None
+        self._capture = capture if capture is not None else AudioCapture(device=settings['audio_device'],
+                                                                         output_rate=self.sample_rate,
+                                                                         ring_seconds=self._ring_seconds)
+        self._recorder = ClipRecorder(clip_dir, self._capture.ring, self.sample_rate,
+                                      self.input_length) if clip_dir else None
+        # The recent debug records are dumped once per alert episode, which ends after this long without a detection
+        self._dump_quiet = 30.0  # seconds
+        self._last_detection = float('-inf')
+        # Live listen-in, streamed from the same ring buffer on the parent's request
+        self._live = LiveStream(self._connection, self._capture) if live else None
+        # classify runs on a dedicated thread so the event loop stays responsive
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bcd-classify")
+        self._hop_ready = None
+        # Cheap pre-filter in front of the model
+        self._vad_margin_db = 6.0
+        self._vad_hangover = 2  # windows
+        self._gate = ActivityGate(sample_rate=self.sample_rate, margin_db=self._vad_margin_db,
+                                  hangover=self._vad_hangover) if use_gate else None
+        # Inference rate follows the recent scores of the desired classes
+        self._adaptive = adaptive
+        self._scheduler = self._create_scheduler()
+        # Threads and rate cap follow the SoC temperature and the load of the other processes,
+        # the lowest rate still covers every sample
+        self._governor_interval = 5  # seconds
+        self._governor = InferenceGovernor(governor_source or SystemSource(), max_threads=self._cpu_threads,
+                                           min_rate=self.sample_rate / self.input_length,
+                                           metrics=metrics) if govern else None
+        # Metrics, read by the endpoint at scrape time where a counter already exists
+        metrics = metrics if metrics is not None else REGISTRY
+        self._classify_latency = metrics.histogram('lullgo_bcd_classify_seconds', "Time to run the model on one window")
+        self._windows = metrics.counter('lullgo_bcd_windows_total', "Windows processed")
+        self._hops_skipped = metrics.counter('lullgo_bcd_hops_skipped_total',
+                                             "Hops not classified because the previous inference was still running")
+        self._detections = metrics.counter('lullgo_bcd_detections_total', "Windows scoring above the threshold")
+        metrics.counter('lullgo_bcd_windows_gated_total', "Windows skipped by the activity gate",
+                        fn=lambda: self.gate_stats['gated'])
+        metrics.counter('lullgo_capture_overflows_total', "Audio input overflows reported by the capture callback",
+                        fn=lambda: self._capture.overflows)
+        metrics.gauge('lullgo_bcd_inference_rate', "Inferences per second of audio", fn=lambda: self.inference_rate)
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def sample_rate(self):
+        """Sample rate expected by the model"""
+        return self._backend.sample_rate
+
+    @property
+    def input_length(self):
+        """Number of samples in one model window"""
+        return self._backend.input_length
+
+    @property
+    def hop_length(self):
+        """Number of new samples between two consecutive inferences at the current rate"""
+        return self._scheduler.hop_length
+
+    @property
+    def inference_rate(self):
+        """Current number of inferences per second of audio"""
+        return self._scheduler.inference_rate
+
+    @property
+    def gate_stats(self):
+        """Number of windows skipped by the activity gate and windows passed to the model"""
+        if self._gate is None:
+            return {'gated': 0, 'classified': 0}
+        return {'gated': self._gate.gated, 'classified': self._gate.classified}
+
+    def align_window(self, end):
+        """Latest window end at or before end that suits the backend (a patch backend reuses earlier frames)"""
+        return self._backend.align(end)
+
+    def classify_window(self, window, position):
+        """
+        Run the classifier on one window of audio, unless the activity gate rejects it
 
+        Args:
+            window (numpy.ndarray): float32 mono samples at sample_rate, input_length long
+            position (int): Absolute sample index of the end of the window
+
+        Returns:
+            list: (category_name, score) of the best desired class if it reached the score threshold
+        """
+        self._windows.inc()
+        if self._gate is not None and not self._gate.is_active(window):
+            category_name, score = None, 0.0
+        else:
+            start = time.perf_counter()
+            category_name, score = self._backend.score(window, position)
+            self._classify_latency.observe(time.perf_counter() - start)
+
+        if self._scheduler.update(score, position):
+            self._capture.set_hop_length(self.hop_length)
+        if score < self._score_threshold:
+            return []
+        self._detections.inc()
+        return [(category_name, score)]
+
+    def _queue_bcd_msg(self, trace=None):
+        """
+        Queue a baby cry detection message for the server
+
+        Detections within _send_interval of a queued or sent message are merged
+        into it. Messages queued while disconnected are sent once the connection
+        is back, with their original timestamp.
+
+        Args:
+            trace (dict): Monotonic 'captured' and 'classified' times of the detection, if known
+        """
         bcd_message = {
             'type': 'bcd',
             'client_name': self._client_name,
+            'room': self._room,
             'timestamp': datetime.now().isoformat(),
+            'trace_id': uuid.uuid4().hex[:16],
+            'trace': dict(trace or {}),
         }
+        if self._connection.enqueue(bcd_message, coalesce_key='bcd', coalesce_window=self._send_interval):
+            logger.info(f"BCD message {bcd_message['trace_id']} queued at {datetime.now().strftime('%H:%M:%S')}"
+                        f"{'' if self._connection.connected else ' while disconnected'}")
+            return True
+        return False
 
+    def _create_scheduler(self):
+        overlaps = (self._quiet_overlap, self._active_overlap) if self._adaptive else (self._overlap_factor,) * 2
+        return AdaptiveScheduler(self.input_length, self.sample_rate, self._score_threshold,
+                                 quiet_overlap=overlaps[0], active_overlap=overlaps[1], cooldown=self._rate_cooldown)
+
+    def apply_config(self, settings):
+        """Apply the bcd section of a reloaded configuration (see Config.add_listener)"""
+        asyncio.ensure_future(self._reconfigure(dict(settings, **self._overrides)))
+
+    async def _reconfigure(self, settings):
+        """
+        Switch to new settings without a gap in monitoring
+
+        A new classifier is built next to the running one only when the model,
+        the backend or the threads changed, and the input stream is reopened
+        only when the audio device changed. The settings are then swapped all
+        at once on the classify thread, between two inferences; if the new
+        classifier cannot be built or the classes are not in its labels, none
+        of them is applied.
+        """
+        if self._reconfigure_lock is None:
+            self._reconfigure_lock = asyncio.Lock()
+        async with self._reconfigure_lock:
+            changed = sorted(key for key, value in settings.items() if value != self._settings.get(key))
+            if not changed:
+                return
+            loop = asyncio.get_running_loop()
+            classifier = None
+            if {'model_path', 'backend', 'cpu_threads'} & set(changed):
+                threads = settings['cpu_threads']
+                if self._governor is not None:
+                    threads = self._governor.threads_with(threads)
+                start = time.perf_counter()
+                try:
+                    backend = await loop.run_in_executor(None, partial(
+                        create_backend, settings['backend'], settings['model_path'], settings['desired_classes'],
+                        cpu_threads=threads))
+                except Exception as e:
+                    logger.error(f"bcd settings not applied, cannot build the classifier: {e}")
+                    return
+                if (backend.sample_rate, backend.input_length) != (self.sample_rate, self.input_length):
+                    logger.error(f"bcd settings not applied, the new model takes {backend.input_length} samples at "
+                                 f"{backend.sample_rate} Hz instead of {self.input_length} at {self.sample_rate} Hz, "
+                                 f"restart the detector to use it")
+                    return
+                classifier = (backend, threads)
+                logger.info(f"Classifier built in {time.perf_counter() - start:.2f} s")
+            try:
+                await loop.run_in_executor(self._executor, self._swap_settings, settings, changed, classifier)
+            except ValueError as e:
+                logger.error(f"bcd settings not applied: {e}")
+                return
+            if 'audio_device' in changed and self._owns_capture:
+                await loop.run_in_executor(None, self._capture.set_device, settings['audio_device'])
+            logger.info(f"bcd settings applied: {', '.join(changed)}")
+
+    def _swap_settings(self, settings, changed, classifier):
+        """Switch to new settings between two inferences (runs on the classify thread)"""
+        if classifier is not None:
+            self._backend, self._cpu_threads = classifier
+            self._backend_name = settings['backend']
+            self._model_path = settings['model_path']
+        elif 'desired_classes' in changed:
+            # Raises before anything changed if a class is unknown
+            self._backend.set_desired_classes(settings['desired_classes'])
+        self._desired_classes = list(settings['desired_classes'])
+        self._send_interval = settings['send_interval']
+        self._score_threshold = settings['score_threshold']
+        self._overlap_factor = settings['overlap_factor']
+        self._quiet_overlap = settings['quiet_overlap']
+        self._active_overlap = settings['active_overlap']
+        self._rate_cooldown = settings['rate_cooldown']
+        if self._governor is not None:
+            self._governor.set_max_threads(settings['cpu_threads'])
+        if {'score_threshold', 'overlap_factor', 'quiet_overlap', 'active_overlap', 'rate_cooldown'} & set(changed):
+            self._scheduler = self._create_scheduler()
+            self._scheduler.set_max_rate(self._governor.max_rate if self._governor is not None else None)
+            self._capture.set_hop_length(self.hop_length)
+        self._settings = settings
+
+    def _rebuild_backend(self, threads):
+        """Replace the classifier with one using another number of threads (runs on the classify thread)"""
+        start = time.perf_counter()
         try:
-            await self._connection.send(json.dumps(bcd_message))
-            logger.info(f"BCD message sent to server at {datetime.now().strftime('%H:%M:%S')}")
-            return True
+            backend = create_backend(self._backend_name, self._model_path, self._desired_classes, cpu_threads=threads)
         except Exception as e:
-            logger.error(f"Failed to send BCD message: {e}")
-            return False
-
-    async def _bcd_main(self):
-        """Continuously run inference on audio data acquired from the device."""
+            logger.error(f"Failed to rebuild the classifier with {threads} threads: {e}")
+            return
+        self._backend = backend
+        self._cpu_threads = threads
+        logger.info(f"Classifier rebuilt with {threads} threads in {time.perf_counter() - start:.2f} s")
 
-        # We'll try to run inference every interval_between_inference seconds.
-        # This is usually half of the model's input length to create an overlap
-        # between incoming audio segments to improve classification accuracy.
-        input_length_in_second = float(len(self._tensor_audio.buffer)) / self._tensor_audio.format.sample_rate
-        interval_between_inference = input_length_in_second * (1 - self._overlap_factor)
-        pause_time = interval_between_inference * 0.1
-        last_inference_time = time.time()
-
-        # Start audio recording in the background.
-        self._audio_record.start_recording()
-
-        while self._is_running:
-            # Wait until at least interval_between_inference seconds has passed since
-            # the last inference.
-            now = time.time()
-            diff = now - last_inference_time
-            if diff < interval_between_inference:
-                await asyncio.sleep(pause_time)
+    async def _govern(self):
+        """Apply the governor's decisions between two inferences"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._governor_interval)
+            decision = self._governor.update()
+            if decision is None:
                 continue
-            last_inference_time = now
+            if decision['threads'] != self._cpu_threads:
+                # On the classify thread, so no inference runs on the old interpreter meanwhile
+                await loop.run_in_executor(self._executor, self._rebuild_backend, decision['threads'])
+            if self._scheduler.set_max_rate(decision['max_rate']):
+                self._capture.set_hop_length(self.hop_length)
 
-            # Load the input audio and run classify.
-            self._tensor_audio.load_from_audio_record(self.audio_record)
-            result = self._classifier.classify(self.tensor_audio)
+    def _mark_startup(self, phase):
+        if self._profiler is not None:
+            self._profiler.mark(phase)
 
-            # print(result)
-            classification = result.classifications[0]
-            result_list = [(category.category_name, category.score) for category in classification.categories]
+    def _on_connection_state(self, connected):
+        if connected:
+            self._mark_startup("first connect")
+            if self._live is not None:
+                # Tell the server which room can be listened to through this connection
+                asyncio.ensure_future(self._connection.send({
+                    'type': 'hello',
+                    'client_name': self._client_name,
+                    'room': self._room,
+                    'capabilities': ['listen'],
+                }))
 
-            for res in result_list:
-                if res[0] in self._desired_classes:
-                    # print(f"{res[0]}: {res[1]}")
-                    # print("==========================================")
-                    self._is_running = await self._send_bcd_msg()
+    async def _bcd_main(self):
+        """Continuously run inference on audio data acquired from the device."""
 
-        # Free up resources
-        self._audio_record.stop()
+        # Inference runs every time the capture side has delivered a new hop of
+        # samples. The hop is usually half of the model's input length to create
+        # an overlap between incoming audio segments to improve classification accuracy.
+        loop = asyncio.get_running_loop()
+        self._hop_ready = asyncio.Event()
+        self._capture.set_hop_listener(self.hop_length, lambda _: loop.call_soon_threadsafe(self._hop_ready.set))
 
-    async def _connect(self):
-        """Connect to the WebSocket server"""
-        logger.info(f"Connecting to server at {self._server_url}")
+        # Start audio capture in the background.
+        if self._recorder is not None:
+            self._recorder.start()
+        self._capture.start()
+        self._mark_startup("audio device open")
+        governor = asyncio.create_task(self._govern()) if self._governor is not None else None
 
         try:
-            self._connection = await websockets.connect(self._server_url)
-            logger.info(f"Connected to server successfully")
+            first_inference = True
+            last_position = None
+            while self._is_running:
+                await self._hop_ready.wait()
+                self._hop_ready.clear()
 
-            # Start detection loop
-            self._is_running = True
-            bcd_task = asyncio.create_task(self._bcd_main())
-
-            await asyncio.sleep(1)
-            # Wait for task to complete
-            await asyncio.gather(bcd_task)
+                # Classify the latest window straight from the ring buffer, off the event loop.
+                # The backend may move the window end back a little to reuse the features of the previous window.
+                position = self.align_window(self._capture.ring.write_index)
+                captured = self._capture.time_of(position)
+                if last_position is not None and position - last_position >= 2 * self.hop_length:
+                    self._hops_skipped.inc((position - last_position) // self.hop_length - 1)
+                last_position = position
+                if self._recorder is not None:
+                    self._recorder.poll(position)
+                window = self._capture.ring.read(position - self.input_length, position)
+                matches = await loop.run_in_executor(self._executor, self.classify_window, window, position)
+                classified = time.monotonic()
+                if first_inference:
+                    # The baby is monitored from here on, with or without a server connection
+                    first_inference = False
+                    self._mark_startup("first inference")
+                    sd_notify("READY=1")
+                if matches:
+                    if classified - self._last_detection >= self._dump_quiet:
+                        dump_recent_logs(f"detection of {matches[0][0]} ({matches[0][1]:.2f})")
+                    self._last_detection = classified
+                    if self._recorder is not None:
+                        self._recorder.trigger(position, *matches[0])
+                    # One message per detected window, however many desired classes matched in it
+                    self._queue_bcd_msg({'captured': captured, 'classified': classified})
+        finally:
+            # Free up resources
+            if governor is not None:
+                governor.cancel()
+            self._capture.stop()
+            if self._recorder is not None:
+                self._recorder.stop()
+            logger.info(f"Activity gate: {self.gate_stats}, inference rate: {self.inference_rate:.2f}/s")
 
-        except ConnectionRefusedError:
-            logger.error(f"Connection refused. Is the server running at {self._server_url}?")
-        except Exception as e:
-            logger.error(f"Connection error: {e}")
+    async def run(self):
+        """Run detection; capture and inference do not wait for the server connection"""
+        self._is_running = True
+        try:
+            await self._bcd_main()
         finally:
             self._is_running = False
-            if self._connection:
-                await self._connection.close()
 
-    async def run_with_reconnect(self):
-        """Run client with automatic reconnection"""
-        while True:
-            try:
-                await self._connect()
-            except Exception as e:
-                logger.error(f"Client error: {e}")
-
-            logger.info(f"Attempting to reconnect in {self._reconnect_interval} seconds...")
-            await asyncio.sleep(self._reconnect_interval)
+    async def run_with_reconnect(self, metrics_port=BCD_PORT, config=None):
+        """Run detection on its own connection with automatic reconnection, reloading config if given"""
+        await run_roles(self._connection, [self] + ([config] if config is not None else []), metrics_port=metrics_port)
 
 
 def main():
     """Main function to run the client"""
-    client = BCD(server_url="ws://parent.local:8765")
+    setup_logging("bcd")
+    profiler = StartupProfiler("bcd")
+    profiler.mark("imports")
+    try:
+        config = Config()
+    except ConfigError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+    client_name, room = identity(config.section('client'), 'bcd')
+    client = BCD(server_url=config.section('client')['server_url'], client_name=client_name, room=room,
+                 profiler=profiler, clip_dir=CLIP_DIR, settings=config.section('bcd'))
+    profiler.mark("model load")
+    config.add_listener('bcd', client.apply_config)
+    config.add_listener('client', client.connection.apply_config)
 
     try:
-        asyncio.run(client.run_with_reconnect())
+        asyncio.run(client.run_with_reconnect(config=config))
     except Exception as e:
         logger.error(f"Client error: {e}")
+        # Let systemd restart the detector
+        sys.exit(1)
 
 
 if __name__ == '__main__':
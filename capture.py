@@ -0,0 +1,295 @@
+"""
+Audio capture
+Streams the I2S mic at 48 kHz, decimates to 16 kHz mono and keeps the
+result in a preallocated ring buffer for the classifier
+"""
+
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def lowpass_taps(num_taps, cutoff, kaiser_beta=None):
+    """
+    Windowed-sinc low-pass FIR, the taps scipy.signal.firwin gives, without importing scipy at startup
+
+    Args:
+        num_taps (int): Filter length
+        cutoff (float): Cutoff frequency relative to Nyquist
+        kaiser_beta (float): Beta of a Kaiser window (default: a Hamming window, as firwin)
+
+    Returns:
+        numpy.ndarray: float64 taps scaled to unit gain at DC
+    """
+    m = np.arange(num_taps) - (num_taps - 1) / 2
+    window = np.hamming(num_taps) if kaiser_beta is None else np.kaiser(num_taps, kaiser_beta)
+    taps = cutoff * np.sinc(cutoff * m) * window
+    return taps / taps.sum()
+
+
+class RingBuffer:
+    """Preallocated single-producer ring buffer of float32 samples.
+
+    Every sample is stored twice (at i and i + capacity), so any span of up to
+    `capacity` samples is a contiguous view and can be read without copying.
+    Positions are absolute sample indices since the buffer was created.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initialize the ring buffer
+
+        Args:
+            capacity (int): Number of samples kept
+        """
+        self._capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=np.float32)
+        self._write_index = 0
+        # (write index, monotonic time its sample reached the ADC) of the latest block, set by the writer
+        self.last_block = None
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def write_index(self):
+        """Total number of samples written so far"""
+        return self._write_index
+
+    def write(self, samples):
+        """Append samples (called from the audio thread only)"""
+        n = len(samples)
+        if n > self._capacity:
+            self._write_index += n - self._capacity
+            samples = samples[-self._capacity:]
+            n = self._capacity
+        pos = self._write_index % self._capacity
+        first = min(n, self._capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        self._data[pos + self._capacity:pos + self._capacity + first] = samples[:first]
+        rest = n - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[self._capacity:self._capacity + rest] = samples[first:]
+        # Publish the samples only once they are in place
+        self._write_index += n
+
+    def read(self, start, stop):
+        """
+        Return a view of the samples in [start, stop)
+
+        The view stays valid until the writer has advanced by another
+        capacity - (stop - start) samples. Samples before the first write
+        read as zeros.
+        """
+        n = stop - start
+        if n > self._capacity or stop > self._write_index or start < self._write_index - self._capacity:
+            raise ValueError(f"Samples [{start}, {stop}) are not in the ring buffer")
+        pos = start % self._capacity
+        return self._data[pos:pos + n]
+
+    def latest(self, n):
+        """Return a view of the last n samples"""
+        stop = self._write_index
+        return self.read(stop - n, stop)
+
+
+class PolyphaseDecimator:
+    """Streaming FIR low-pass + decimation that keeps its state between blocks.
+
+    Only the output samples that survive decimation are computed, as one
+    matrix-vector product of a strided (outputs, taps) view of the input with
+    the reversed taps, and all work buffers are preallocated, so processing a
+    block does not allocate.
+    """
+
+    def __init__(self, factor=3, num_taps=63, max_block=1024):
+        """
+        Initialize the decimator
+
+        Args:
+            factor (int): Integer decimation factor (48 kHz -> 16 kHz is 3)
+            num_taps (int): FIR length, rounded up to a multiple of factor
+            max_block (int): Largest input block expected per call
+        """
+        num_taps = -(-num_taps // factor) * factor
+        taps = lowpass_taps(num_taps, 0.9 / factor, kaiser_beta=8.0).astype(np.float32)
+        self._factor = factor
+        self._taps = taps
+        self._reversed = np.ascontiguousarray(taps[::-1])
+        self._history = num_taps - 1
+        self._phase = 0
+        self._allocate(max_block)
+
+    def _allocate(self, max_block):
+        self._work = np.zeros(self._history + max_block, dtype=np.float32)
+        self._out = np.zeros(max_block // self._factor + 1, dtype=np.float32)
+
+    def process(self, block):
+        """
+        Filter and decimate one block of input samples
+
+        Returns:
+            numpy.ndarray: view of an internal buffer, valid until the next call
+        """
+        n = len(block)
+        h = self._history
+        if h + n > len(self._work):
+            logger.warning(f"Decimator input block grew to {n} samples, reallocating")
+            self._allocate(n)
+
+        work = self._work[:h + n]
+        work[h:] = block
+        count = len(range(self._phase, n, self._factor))
+        out = self._out[:count]
+        if count:
+            # Row i is the input under the taps for output i, a view with overlapping rows
+            stride = work.strides[0]
+            windows = np.lib.stride_tricks.as_strided(work[self._phase:], shape=(count, h + 1),
+                                                      strides=(self._factor * stride, stride), writeable=False)
+            # einsum reads the view in place, np.dot would copy it to a contiguous matrix first
+            np.einsum('ij,j->i', windows, self._reversed, out=out)
+
+        # Keep the tail as history for the next block
+        work[:h] = work[n:n + h]
+        self._phase = (self._phase - n) % self._factor
+        return out
+
+
+class AudioCapture:
+    """Owns the sounddevice input stream and feeds the decimated samples into a ring buffer"""
+
+    def __init__(self, device=0, channels=2, channel=0, input_rate=48000, output_rate=16000,
+                 block_size=1536, ring_seconds=4.0, ring=None):
+        """
+        Initialize the audio capture
+
+        Args:
+            device (int): sounddevice input device
+            channels (int): Channels opened on the device (INMP441 needs 2)
+            channel (int): Channel carrying the mic signal
+            input_rate (int): Device sample rate
+            output_rate (int): Sample rate delivered to the ring buffer
+            block_size (int): Frames per audio callback
+            ring_seconds (float): Seconds of audio kept in the ring buffer
+            ring (RingBuffer): Ring buffer to write to instead of a new one (e.g. a SharedRingBuffer)
+        """
+        if input_rate % output_rate:
+            raise ValueError(f"Input rate {input_rate} is not a multiple of {output_rate}")
+        self._device = device
+        self._channels = channels
+        self._channel = channel
+        self._input_rate = input_rate
+        self._output_rate = output_rate
+        self._block_size = block_size
+        self._decimator = PolyphaseDecimator(input_rate // output_rate, max_block=block_size)
+        self._stream = None
+        self._overflows = 0
+        self._hop_length = 0
+        self._hop_listener = None
+        self._next_hop = 0
+        self.ring = ring if ring is not None else RingBuffer(int(ring_seconds * output_rate))
+
+    @property
+    def sample_rate(self):
+        return self._output_rate
+
+    @property
+    def overflows(self):
+        return self._overflows
+
+    def time_of(self, position):
+        """
+        Monotonic time at which the sample at an absolute position was captured
+
+        Args:
+            position (int): Absolute sample index in the ring buffer
+
+        Returns:
+            float: time.monotonic() based timestamp, None before the first block
+        """
+        last_block = self.ring.last_block
+        if last_block is None:
+            return None
+        index, captured = last_block
+        return captured - (index - position) / self._output_rate
+
+    def set_hop_listener(self, hop_length, listener):
+        """
+        Register a function called every hop_length new samples
+
+        The listener runs on the PortAudio thread with the ring buffer write
+        index as argument, so it must only hand the event over (e.g. with
+        loop.call_soon_threadsafe) and return.
+        """
+        self._hop_length = hop_length
+        self._next_hop = self.ring.write_index + hop_length
+        self._hop_listener = listener
+
+    def set_hop_length(self, hop_length):
+        """Change the hop of the registered listener, taking effect from the next hop"""
+        self._hop_length = hop_length
+
+    def set_device(self, device):
+        """
+        Capture from another input device, reopening the stream if it is running
+
+        The ring buffer, the decimator and the hop listener are kept, so the
+        reader only sees a short gap. If the new device cannot be opened, the
+        previous one is reopened.
+        """
+        if device == self._device:
+            return
+        previous, self._device = self._device, device
+        if self._stream is None:
+            return
+        self.stop()
+        try:
+            self.start()
+        except Exception as e:
+            logger.error(f"Failed to open audio device {device}, back to {previous}: {e}")
+            self._device = previous
+            self.start()
+
+    def _audio_callback(self, indata, frames, time_info, status):
+        """Runs on the PortAudio thread for every captured block"""
+        if status.input_overflow:
+            self._overflows += 1
+        self.ring.write(self._decimator.process(indata[:, self._channel]))
+
+        listener = self._hop_listener
+        write_index = self.ring.write_index
+        # Age of the block's last sample, from the ADC time of its first one when the driver reports it
+        now = time.monotonic()
+        age = time_info.currentTime - time_info.inputBufferAdcTime - frames / self._input_rate
+        self.ring.last_block = (write_index, now - age if 0.0 <= age < 1.0 else now)
+        if listener is not None and write_index >= self._next_hop:
+            missed = (write_index - self._next_hop) // self._hop_length
+            self._next_hop += (missed + 1) * self._hop_length
+            listener(write_index)
+
+    def start(self):
+        """Open the input stream and start capturing"""
+        import sounddevice as sd
+
+        self._stream = sd.InputStream(
+            device=self._device,
+            channels=self._channels,
+            samplerate=self._input_rate,
+            blocksize=self._block_size,
+            dtype='float32',
+            callback=self._audio_callback,
+        )
+        self._stream.start()
+        logger.info(f"Audio capture started: {self._input_rate} Hz -> {self._output_rate} Hz")
+
+    def stop(self):
+        """Stop capturing and close the input stream"""
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+            logger.info(f"Audio capture stopped, input overflows: {self._overflows}")
@@ -0,0 +1,134 @@
+"""
+Child agent
+Hosts the heartbeat and baby cry detection roles in one process, sharing one
+event loop and one WebSocket connection to the parent (or, with --multiprocess,
+in supervised capture, inference and networking processes, see pipeline.py)
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from client import ClientConnection, run_roles
+from config import Config, ConfigError, defaults, identity
+from logsetup import setup_logging
+from metrics import BCD_PORT
+from startup import StartupProfiler, sd_notify
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('heartbeat', 'bcd')
+
+
+def create_roles(names, connection, profiler, json_heartbeat=False, clip_dir=None, backend=None,
+                 model_path=None, govern=True, config=None, client=None):
+    """
+    Build the requested roles on top of the shared connection, following config's reloads if given
+
+    client is the client section naming the roles (default: config's, or the defaults without config)
+    """
+    if client is None:
+        client = config.section('client') if config is not None else defaults('client')
+    roles = []
+    if 'heartbeat' in names:
+        from heartbeat import Heartbeat
+        client_name, room = identity(client, 'heartbeat')
+        heartbeat = Heartbeat(connection.server_url, client_name=client_name, room=room, connection=connection,
+                              json_heartbeat=json_heartbeat,
+                              settings=config.section('heartbeat') if config is not None else None)
+        if config is not None:
+            config.add_listener('heartbeat', heartbeat.apply_config)
+        roles.append(heartbeat)
+    if 'bcd' in names:
+        from bcd import BCD
+        client_name, room = identity(client, 'bcd')
+        bcd = BCD(connection.server_url, client_name=client_name, room=room, connection=connection,
+                  profiler=profiler, clip_dir=clip_dir, backend=backend, model_path=model_path, govern=govern,
+                  settings=config.section('bcd') if config is not None else None)
+        if config is not None:
+            config.add_listener('bcd', bcd.apply_config)
+        roles.append(bcd)
+        profiler.mark("model load")
+    return roles
+
+
+def main():
+    """Main function to run the child agent"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--server', default=None, help="WebSocket server URL (default: the configured one)")
+    parser.add_argument('--config', default=None,
+                        help="configuration file, defaults to LULLGO_CONFIG or /home/rpi/lullgo/cfg/lullgo.json")
+    parser.add_argument('--client-name', default=None,
+                        help="name of this child, its roles are <name>.heartbeat and <name>.bcd "
+                             "(default: the configured one)")
+    parser.add_argument('--room', default=None, help="room of this child (default: the configured one)")
+    parser.add_argument('--roles', default=','.join(ROLES), help=f"comma separated roles out of {ROLES}")
+    parser.add_argument('--json-heartbeat', action='store_true',
+                        help="send JSON heartbeat messages instead of ping frames (compatibility mode)")
+    parser.add_argument('--metrics-port', type=int, default=BCD_PORT,
+                        help="port of the local metrics endpoint, 0 disables it")
+    parser.add_argument('--clip-dir', default="/home/rpi/lullgo/clips",
+                        help="directory of the detection clips, empty to disable recording")
+    parser.add_argument('--backend', default=None, choices=('interpreter', 'task', 'patch'),
+                        help="classifier backend of the bcd role (default: the configured one)")
+    parser.add_argument('--model', default=None, help="model of the bcd role (default: the configured one)")
+    parser.add_argument('--no-governor', dest='govern', action='store_false',
+                        help="keep the classifier threads and inference rate fixed whatever the SoC temperature")
+    parser.add_argument('--multiprocess', action='store_true',
+                        help="run capture, inference and networking as separate supervised processes")
+    parser.add_argument('--log-level', default=None,
+                        help="log level, defaults to LULLGO_CHILD_LOG_LEVEL, LULLGO_LOG_LEVEL or INFO")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.roles.split(',') if name.strip()]
+    unknown = [name for name in names if name not in ROLES]
+    if unknown or not names:
+        parser.error(f"Unknown or missing roles: {unknown}")
+
+    try:
+        setup_logging("child", args.log_level)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        config = Config(args.config)
+    except ConfigError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+    # The server URL given on the command line is kept over reloads
+    server_url = args.server or config.section('client')['server_url']
+    # The name and room are read once, they identify the child to the parent
+    client = config.section('client')
+    client.update({key: value for key, value in (('client_name', args.client_name), ('room', args.room)) if value})
+    if args.multiprocess:
+        if 'bcd' not in names:
+            parser.error("--multiprocess needs the bcd role")
+        from pipeline import Supervisor
+        logger.info(f"Child agent running roles {', '.join(names)} in separate processes")
+        Supervisor(server_url, roles=names, json_heartbeat=args.json_heartbeat, clip_dir=args.clip_dir or None,
+                   backend=args.backend, model_path=args.model, metrics_port=args.metrics_port,
+                   govern=args.govern, config_path=config.path, follow_server_url=args.server is None,
+                   client_name=client['client_name'], room=client['room']).run()
+        return
+
+    profiler = StartupProfiler("child")
+    profiler.mark("imports")
+    connection = ClientConnection(server_url)
+    if args.server is None:
+        config.add_listener('client', connection.apply_config)
+    roles = create_roles(names, connection, profiler, json_heartbeat=args.json_heartbeat,
+                         clip_dir=args.clip_dir or None, backend=args.backend, model_path=args.model,
+                         govern=args.govern, config=config, client=client)
+    if 'bcd' not in names:
+        # The bcd role reports readiness after its first inference
+        sd_notify("READY=1")
+    logger.info(f"Child agent running roles: {', '.join(names)}")
+
+    try:
+        asyncio.run(run_roles(connection, roles + [config], metrics_port=args.metrics_port))
+    except Exception as e:
+        logger.error(f"Client error: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+WebSocket client connection
+One connection to the parent server shared by the child roles (heartbeat,
+bcd), with message dispatch, a bounded outbound queue that survives outages
+and automatic reconnection with backoff
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from liveness import ClockOffset
+from metrics import REGISTRY, MetricsServer
+
+logger = logging.getLogger(__name__)
+
+
+class _Outbound:
+    """Queued message with what is needed to coalesce it"""
+
+    __slots__ = ('message', 'key', 'enqueued')
+
+    def __init__(self, message, key):
+        self.message = message
+        self.key = key
+        self.enqueued = time.monotonic()
+
+
+class ClientConnection:
+    def __init__(self, server_url, reconnect_interval=1, max_reconnect_interval=60, stable_after=10,
+                 clock_sync_interval=10, queue_size=64, metrics=None):
+        """
+        Initialize the connection supervisor
+
+        Args:
+            server_url (str): WebSocket server URL (e.g., ws://192.168.1.100:8765)
+            reconnect_interval (float): First delay before reconnecting, doubled after every failed attempt
+            max_reconnect_interval (float): Upper bound of the reconnection delay
+            stable_after (float): Seconds a connection must last for the delay to start over
+            clock_sync_interval (float): Seconds between clock offset exchanges with the server
+            queue_size (int): Messages kept in the outbound queue, the oldest one is dropped beyond it
+            metrics (Registry): Registry of the connection metrics (default: the process registry)
+        """
+        self._server_url = server_url
+        self._reconnect_interval = reconnect_interval
+        self._max_reconnect_interval = max_reconnect_interval
+        self._stable_after = stable_after
+        self._connection = None
+        # Created on first use, inside the running event loop
+        self._connected = None
+        self._outbound_ready = None
+        self._outbound = deque()
+        self._queue_size = queue_size
+        # Coalescing key -> monotonic time its last message was sent
+        self._last_sent = {}
+        self._handlers = {}
+        self._state_listeners = []
+        self._clock_sync_interval = clock_sync_interval
+        self.clock = ClockOffset()
+        self.add_handler('clock_sync', self._on_clock_sync)
+        metrics = metrics if metrics is not None else REGISTRY
+        self._attempts = 0
+        self._reconnects = metrics.counter('lullgo_client_reconnects_total', "Connection attempts after the first one")
+        self._send_latency = metrics.histogram('lullgo_client_send_seconds', "Time to hand a message to the websocket")
+        self._queue_dropped = metrics.counter('lullgo_client_queue_dropped_total',
+                                              "Queued messages dropped because the outbound queue was full")
+        self._coalesced = metrics.counter('lullgo_client_coalesced_total',
+                                          "Messages merged into an earlier one of the same kind")
+        metrics.gauge('lullgo_client_queue_depth', "Messages waiting in the outbound queue",
+                      fn=lambda: len(self._outbound))
+        metrics.gauge('lullgo_client_connected', "1 while the connection to the server is up",
+                      fn=lambda: int(self.connected))
+        metrics.gauge('lullgo_client_clock_offset_seconds', "Estimated offset of the server's monotonic clock",
+                      fn=lambda: self.clock.offset or 0.0)
+
+    @property
+    def server_url(self):
+        return self._server_url
+
+    def apply_config(self, settings):
+        """Follow a new server URL from the client settings, reconnecting if it changed"""
+        server_url = settings['server_url']
+        if server_url == self._server_url:
+            return
+        logger.info(f"Server URL changed from {self._server_url} to {server_url}")
+        self._server_url = server_url
+        if self._connection is not None:
+            asyncio.ensure_future(self.reconnect())
+
+    @property
+    def connected(self):
+        return self._connection is not None
+
+    def add_handler(self, message_type, handler):
+        """Call handler(data) for every message of the given type received from the server"""
+        self._handlers[message_type] = handler
+
+    def add_state_listener(self, listener):
+        """Call listener(connected) every time the connection is established or lost"""
+        self._state_listeners.append(listener)
+
+    def _connected_event(self):
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        return self._connected
+
+    async def wait_connected(self):
+        """Wait until the connection to the server is up"""
+        await self._connected_event().wait()
+
+    def _outbound_event(self):
+        if self._outbound_ready is None:
+            self._outbound_ready = asyncio.Event()
+        return self._outbound_ready
+
+    def enqueue(self, message, coalesce_key=None, coalesce_window=0.0):
+        """
+        Queue a message for the sender task, without waiting for the network
+
+        Queued messages survive disconnections and are sent in order once the
+        connection is back, keeping their original timestamps.
+
+        Args:
+            message (dict): JSON-serializable message
+            coalesce_key (str): Messages with the same key within coalesce_window are merged
+            coalesce_window (float): Seconds after a message during which the next ones are merged into it
+
+        Returns:
+            bool: False if the message was merged into an earlier one
+        """
+        if coalesce_key is not None:
+            now = time.monotonic()
+            for entry in reversed(self._outbound):
+                if entry.key == coalesce_key and now - entry.enqueued < coalesce_window:
+                    entry.message['detections'] = entry.message.get('detections', 1) + 1
+                    self._coalesced.inc()
+                    return False
+            if now - self._last_sent.get(coalesce_key, float('-inf')) < coalesce_window:
+                self._coalesced.inc()
+                return False
+        if len(self._outbound) >= self._queue_size:
+            dropped = self._outbound.popleft()
+            self._queue_dropped.inc()
+            logger.warning(f"Outbound queue full, dropped a {dropped.message.get('type')} message "
+                           f"queued {time.monotonic() - dropped.enqueued:.1f} s ago")
+        self._outbound.append(_Outbound(message, coalesce_key))
+        self._outbound_event().set()
+        return True
+
+    async def _sender(self):
+        """Send the queued messages in order whenever the connection is up"""
+        while True:
+            await self._outbound_event().wait()
+            await self.wait_connected()
+            while self._outbound and self.connected:
+                entry = self._outbound[0]
+                waited = time.monotonic() - entry.enqueued
+                if waited >= 1.0:
+                    # Sent late, after an outage or a backlog
+                    entry.message['delayed'] = round(waited, 3)
+                trace = entry.message.get('trace')
+                if trace is not None and self.clock.offset is None:
+                    # Right after connecting, give the first clock exchange a moment to complete
+                    deadline = time.monotonic() + 0.5
+                    while self.clock.offset is None and self.connected and time.monotonic() < deadline:
+                        await asyncio.sleep(0.01)
+                if trace is not None:
+                    # Stage timestamps on our clock, with the offset that maps them to the server's
+                    trace.update(sent=time.monotonic(), clock_offset=self.clock.offset, clock_delay=self.clock.delay)
+                if not await self.send(entry.message):
+                    # Wait for the connection to be replaced instead of spinning on a broken one
+                    await asyncio.sleep(0.5)
+                    break
+                self._outbound.popleft()
+                if entry.key is not None:
+                    self._last_sent[entry.key] = time.monotonic()
+                if waited >= 1.0:
+                    logger.info(f"Sent {entry.message.get('type')} message queued {waited:.1f} s ago")
+            if not self._outbound:
+                self._outbound_event().clear()
+
+    async def send(self, message):
+        """
+        Send a message to the server
+
+        Args:
+            message (dict): JSON-serializable message
+
+        Returns:
+            bool: True if the message was handed to the connection
+        """
+        connection = self._connection
+        if connection is None:
+            return False
+        start = time.perf_counter()
+        try:
+            await connection.send(json.dumps(message))
+            self._send_latency.observe(time.perf_counter() - start)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to send {message.get('type')} message: {e}")
+            return False
+
+    async def send_bytes(self, data):
+        """
+        Send a binary frame to the server (live audio)
+
+        Returns:
+            bool: True if the frame was handed to the connection
+        """
+        connection = self._connection
+        if connection is None:
+            return False
+        try:
+            await connection.send(data)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to send binary frame: {e}")
+            return False
+
+    async def ping(self, timeout):
+        """
+        Send a protocol-level ping and wait for its pong
+
+        Args:
+            timeout (float): Seconds to wait for the pong
+
+        Returns:
+            float: round-trip time in seconds, None if not connected or no pong in time
+        """
+        connection = self._connection
+        if connection is None:
+            return None
+        start = time.monotonic()
+        try:
+            pong_waiter = await connection.ping()
+            await asyncio.wait_for(pong_waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        except Exception as e:
+            logger.debug(f"Ping failed: {e}")
+            return None
+        return time.monotonic() - start
+
+    def _on_clock_sync(self, data):
+        """Handle the server's reply to a clock offset request"""
+        received = time.monotonic()
+        try:
+            self.clock.add(data['t0'], data['t1'], data['t2'], received)
+        except (KeyError, TypeError):
+            logger.warning("Incomplete clock_sync reply from server")
+
+    async def _clock_sync_loop(self):
+        """Ask the server for its clock periodically while connected"""
+        while self.connected:
+            await self.send({'type': 'clock_sync', 't0': time.monotonic()})
+            await asyncio.sleep(self._clock_sync_interval)
+
+    async def reconnect(self):
+        """Drop the current connection; run_with_reconnect() opens a new one"""
+        if self._connection is not None:
+            await self._connection.close()
+
+    def _set_state(self, connection):
+        self._connection = connection
+        if connection is not None:
+            self._connected_event().set()
+        else:
+            self._connected_event().clear()
+        for listener in self._state_listeners:
+            try:
+                listener(connection is not None)
+            except Exception as e:
+                logger.error(f"Connection state listener failed: {e}")
+
+    def _dispatch(self, message):
+        if isinstance(message, bytes):
+            logger.warning("Unexpected binary message from server")
+            return
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON received from server")
+            return
+        handler = self._handlers.get(data.get('type'))
+        if handler is None:
+            logger.warning(f"Unknown message type from server: {data.get('type')}")
+            return
+        try:
+            handler(data)
+        except Exception as e:
+            logger.error(f"Error handling {data.get('type')} message: {e}")
+
+    async def _connect(self):
+        """
+        Connect to the WebSocket server and dispatch its messages until the connection drops
+
+        Returns:
+            float: seconds the connection was up, None if it could not be established
+        """
+        import websockets
+
+        logger.info(f"Connecting to server at {self._server_url}")
+        if self._attempts:
+            self._reconnects.inc()
+        self._attempts += 1
+
+        connection = None
+        clock_sync = None
+        connected_at = None
+        try:
+            connection = await websockets.connect(self._server_url)
+            connected_at = time.monotonic()
+            logger.info(f"Connected to server successfully")
+            # The server may have restarted, its clock with it
+            self.clock.reset()
+            self._set_state(connection)
+            clock_sync = asyncio.create_task(self._clock_sync_loop())
+
+            async for message in connection:
+                self._dispatch(message)
+            logger.error("Connection to server closed")
+
+        except websockets.exceptions.ConnectionClosed as e:
+            logger.error(f"Connection closed: {e}")
+        except ConnectionRefusedError:
+            logger.error(f"Connection refused. Is the server running at {self._server_url}?")
+        except Exception as e:
+            logger.error(f"Connection error: {e}")
+        finally:
+            if clock_sync is not None:
+                clock_sync.cancel()
+            if connection is not None:
+                self._set_state(None)
+                await connection.close()
+        return time.monotonic() - connected_at if connected_at is not None else None
+
+    def _reconnect_delay(self, failures):
+        """Exponential backoff with jitter, so restarted clients do not reconnect in lockstep"""
+        delay = min(self._max_reconnect_interval, self._reconnect_interval * 2 ** failures)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def run_with_reconnect(self):
+        """Keep the connection to the server up and drain the outbound queue through it"""
+        sender = asyncio.create_task(self._sender())
+        failures = 0
+        try:
+            while True:
+                try:
+                    uptime = await self._connect()
+                except Exception as e:
+                    logger.error(f"Client error: {e}")
+                    uptime = None
+
+                if uptime is not None and uptime >= self._stable_after:
+                    failures = 0
+                delay = self._reconnect_delay(failures)
+                failures += 1
+                logger.info(f"Attempting to reconnect in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+        finally:
+            sender.cancel()
+
+
+async def run_roles(connection, roles, metrics_port=None):
+    """Run the roles sharing one connection until one of them fails, serving metrics on metrics_port if given"""
+    metrics_server = None
+    if metrics_port:
+        metrics_server = MetricsServer(metrics_port)
+        await metrics_server.start()
+    tasks = [asyncio.create_task(role.run()) for role in roles]
+    tasks.append(asyncio.create_task(connection.run_with_reconnect()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if metrics_server is not None:
+            await metrics_server.stop()
@@ -0,0 +1,76 @@
+"""
+Live audio codec
+8-bit µ-law companding in numpy and the binary frame format used to stream
+audio from a child to the parent over the websocket
+"""
+
+import struct
+import numpy as np
+
+MU = 255
+_LOG_MU = np.log1p(MU)
+
+# magic, sample rate, sequence number, absolute position of the first sample,
+# capture time of the last sample on the parent's monotonic clock (0 if unknown)
+FRAME_HEADER = struct.Struct('<2sHIQd')
+FRAME_MAGIC = b'LA'
+
+# Code -> sample, decoding is a table lookup
+_DECODE = np.arange(256, dtype=np.float32) / np.float32(127.5) - np.float32(1.0)
+_DECODE = (np.sign(_DECODE) * np.expm1(np.abs(_DECODE) * _LOG_MU) / MU).astype(np.float32)
+
+
+def mulaw_encode(samples):
+    """
+    Compand float samples in [-1, 1] to 8-bit µ-law codes
+
+    Args:
+        samples (numpy.ndarray): float32 samples
+
+    Returns:
+        numpy.ndarray: uint8 codes, one per sample
+    """
+    x = np.clip(samples, -1.0, 1.0)
+    y = np.log1p(np.abs(x) * MU) / _LOG_MU
+    np.copysign(y, x, out=y)
+    return (y * 127.5 + 128.0).astype(np.uint8)
+
+
+def mulaw_decode(codes):
+    """Expand 8-bit µ-law codes to float32 samples"""
+    return _DECODE[codes]
+
+
+def encode_frame(seq, position, sample_rate, samples, capture_time=0.0):
+    """
+    Build a binary audio frame
+
+    Args:
+        seq (int): Frame sequence number
+        position (int): Absolute sample index of the first sample at the capture side
+        sample_rate (int): Sample rate of the samples
+        samples (numpy.ndarray): float32 mono samples
+        capture_time (float): Capture time of the last sample on the receiver's monotonic clock, 0 if unknown
+
+    Returns:
+        bytes: header followed by the µ-law codes
+    """
+    return FRAME_HEADER.pack(FRAME_MAGIC, sample_rate, seq & 0xFFFFFFFF, position, capture_time) + \
+        mulaw_encode(samples).tobytes()
+
+
+def decode_frame(data):
+    """
+    Parse a binary audio frame
+
+    Returns:
+        tuple: (seq, position, sample_rate, samples, capture_time)
+
+    Raises:
+        ValueError: if the data is not an audio frame
+    """
+    if len(data) < FRAME_HEADER.size or data[:2] != FRAME_MAGIC:
+        raise ValueError("Not an audio frame")
+    _, sample_rate, seq, position, capture_time = FRAME_HEADER.unpack_from(data)
+    codes = np.frombuffer(data, dtype=np.uint8, offset=FRAME_HEADER.size)
+    return seq, position, sample_rate, mulaw_decode(codes), capture_time
@@ -0,0 +1,303 @@
+"""
+Configuration
+One JSON file shared by the daemons (bcd, heartbeat, child, parent), validated
+as a whole when it is loaded and reloaded on SIGHUP or when it changes on disk.
+A reload swaps in the new settings at once and tells the components whose
+section changed; an invalid file is rejected and the running settings stay.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import signal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "/home/rpi/lullgo/cfg/lullgo.json"
+
+BACKENDS = ('interpreter', 'task', 'patch')
+
+
+class ConfigError(ValueError):
+    """Invalid configuration file, with every problem found in it"""
+
+
+def _number(low=None, high=None, integer=False, high_open=False, optional=False):
+    """Check of a number in [low, high] (or [low, high[ if high_open)"""
+    def check(value):
+        if value is None and optional:
+            return None
+        if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)):
+            return f"expected {'an integer' if integer else 'a number'}, got {value!r}"
+        if low is not None and value < low:
+            return f"{value} is below {low}"
+        if high is not None and (value >= high if high_open else value > high):
+            return f"{value} is not below {high}" if high_open else f"{value} is above {high}"
+        return None
+    return check
+
+
+def _string(value):
+    if not isinstance(value, str) or not value:
+        return f"expected a non-empty string, got {value!r}"
+    return None
+
+
+def _optional_string(value):
+    return None if value is None else _string(value)
+
+
+def _strings(value):
+    if not isinstance(value, list) or not value or any(_string(item) for item in value):
+        return f"expected a non-empty list of non-empty strings, got {value!r}"
+    return None
+
+
+def _choice(*choices):
+    def check(value):
+        if value not in choices:
+            return f"expected one of {list(choices)}, got {value!r}"
+        return None
+    return check
+
+
+def _server_url(value):
+    if _string(value) or not value.startswith(('ws://', 'wss://')):
+        return f"expected a ws:// or wss:// URL, got {value!r}"
+    return None
+
+
+def _device(value):
+    """sounddevice accepts a device index or a substring of its name"""
+    if isinstance(value, str) and value:
+        return None
+    return _number(0, integer=True)(value)
+
+
+_pin = _number(0, 27, integer=True)
+
+# Section -> setting -> (default, check returning a problem or None)
+SCHEMA = {
+    'client': {
+        'server_url': ("ws://parent.local:8765", _server_url),
+        'client_name': ("rpi-nurse", _string),
+        'room': (None, _optional_string),
+    },
+    'bcd': {
+        'model_path': ("/home/rpi/lullgo/models/yamnet.tflite", _string),
+        'backend': ("interpreter", _choice(*BACKENDS)),
+        'cpu_threads': (4, _number(1, 16, integer=True)),
+        'audio_device': (0, _device),
+        'score_threshold': (0.3, _number(0.0, 1.0)),
+        'desired_classes': (["Screaming", "Baby laughter", "Crying, sobbing", "Baby cry, infant cry"], _strings),
+        'send_interval': (2, _number(0)),
+        'overlap_factor': (0.5, _number(0.0, 1.0, high_open=True)),
+        'quiet_overlap': (0.0, _number(0.0, 1.0, high_open=True)),
+        'active_overlap': (0.8, _number(0.0, 1.0, high_open=True)),
+        'rate_cooldown': (10, _number(0)),
+    },
+    'heartbeat': {
+        'interval': (2, _number(0.1)),
+        'ping_timeout': (2, _number(0.1)),
+        'max_missed': (5, _number(1, integer=True)),
+        'led_pin': (26, _pin),
+    },
+    'parent': {
+        'host': ("0.0.0.0", _string),
+        'port': (8765, _number(1, 65535, integer=True)),
+        'ping_interval': (5, _number(0.1, optional=True)),
+        'ping_timeout': (5, _number(0.1, optional=True)),
+        'heartbeat_interval': (2, _number(0.1)),
+        'led_pin': (26, _pin),
+        'sounds': ([
+            "/home/rpi/lullgo/sounds/adel_shakal.wav",
+            "/home/rpi/lullgo/sounds/waaa2_1.wav",
+            "/home/rpi/lullgo/sounds/waaa2_2.wav",
+        ], _strings),
+    },
+}
+
+
+def defaults(section):
+    """Default settings of one section"""
+    return {key: copy.deepcopy(default) for key, (default, _) in SCHEMA[section].items()}
+
+
+def identity(client, role):
+    """
+    Name and room a child role announces to the parent
+
+    Args:
+        client (dict): client section of the configuration
+        role (str): 'bcd' or 'heartbeat'
+
+    Returns:
+        tuple: (client name, room), e.g. ('nursery-1.bcd', 'nursery'); the room defaults to the client name
+    """
+    return f"{client['client_name']}.{role}", client['room'] or client['client_name']
+
+
+def parse(data):
+    """
+    Validate the content of a configuration file and fill in the defaults
+
+    Args:
+        data (dict): Decoded JSON, sections of settings; missing ones take their default
+
+    Returns:
+        dict: section -> setting -> value, for every section of SCHEMA
+
+    Raises:
+        ConfigError: listing every unknown or invalid setting
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("The configuration must be a JSON object of sections")
+    problems = [f"{section}: unknown section" for section in data if section not in SCHEMA]
+    settings = {}
+    for section, schema in SCHEMA.items():
+        values = data.get(section, {})
+        if not isinstance(values, dict):
+            problems.append(f"{section}: expected an object of settings")
+            values = {}
+        problems += [f"{section}.{key}: unknown setting" for key in values if key not in schema]
+        settings[section] = defaults(section)
+        for key, (_, check) in schema.items():
+            if key not in values:
+                continue
+            problem = check(values[key])
+            if problem is not None:
+                problems.append(f"{section}.{key}: {problem}")
+            settings[section][key] = values[key]
+    if problems:
+        raise ConfigError("; ".join(problems))
+    return settings
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load(path):
+    """
+    Read and validate a configuration file, the defaults when it does not exist
+
+    Raises:
+        ConfigError: if the file cannot be read, is not JSON or has invalid settings
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return parse({})
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"Cannot read {path}: {e}")
+    return parse(data)
+
+
+class Config:
+    """Settings of the daemons, reloaded on SIGHUP or when the file changes"""
+
+    def __init__(self, path=None, interval=2.0):
+        """
+        Load the configuration file
+
+        Args:
+            path (str): Configuration file (default: LULLGO_CONFIG or /home/rpi/lullgo/cfg/lullgo.json)
+            interval (float): Seconds between two checks of the file modification time
+
+        Raises:
+            ConfigError: if the file is invalid, the daemon should not start with it
+        """
+        self.path = path or os.environ.get("LULLGO_CONFIG") or DEFAULT_PATH
+        self._interval = interval
+        self._stamp = _stamp(self.path)
+        self._settings = load(self.path)
+        # Section -> functions called with its new settings
+        self._listeners = {}
+        self._requested = False
+        self._wakeup = None
+        if self._stamp is None:
+            logger.info(f"No configuration file at {self.path}, using the defaults")
+        else:
+            logger.info(f"Configuration loaded from {self.path}")
+
+    def section(self, name):
+        """Current settings of one section (a copy)"""
+        return copy.deepcopy(self._settings[name])
+
+    def add_listener(self, section, listener):
+        """Call listener(settings) with the new settings of the section every time a reload changes it"""
+        self._listeners.setdefault(section, []).append(listener)
+
+    def reload(self):
+        """
+        Load the file again and notify the listeners of the sections that changed
+
+        Returns:
+            bool: True if the settings changed, False if they did not or the file was rejected
+        """
+        self._stamp = _stamp(self.path)
+        if self._stamp is None:
+            logger.warning(f"Configuration file {self.path} is gone, keeping the current settings")
+            return False
+        try:
+            settings = load(self.path)
+        except ConfigError as e:
+            logger.error(f"Configuration rejected, keeping the current settings: {e}")
+            return False
+        changed = [section for section in settings if settings[section] != self._settings[section]]
+        # Swapped as a whole, so every reader sees either the old or the new settings
+        previous, self._settings = self._settings, settings
+        if not changed:
+            logger.info("Configuration reloaded, no changes")
+            return False
+        for section in changed:
+            keys = sorted(key for key in settings[section] if settings[section][key] != previous[section][key])
+            logger.info(f"Configuration section {section} changed: {', '.join(keys)}")
+            for listener in self._listeners.get(section, []):
+                try:
+                    listener(self.section(section))
+                except Exception as e:
+                    logger.error(f"Failed to apply the {section} settings: {e}")
+        return True
+
+    def request_reload(self):
+        """Reload at the next check (e.g. from a SIGHUP handler)"""
+        self._requested = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def check(self):
+        """
+        Reload if it was requested or the file changed on disk
+
+        Returns:
+            bool: True if the settings changed
+        """
+        requested, self._requested = self._requested, False
+        if not requested and _stamp(self.path) == self._stamp:
+            return False
+        return self.reload()
+
+    async def run(self):
+        """Watch the file and SIGHUP, so the config can run next to the roles (see client.run_roles)"""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                self.check()
+        finally:
+            loop.remove_signal_handler(signal.SIGHUP)
+            self._wakeup = None
@@ -0,0 +1,232 @@
+"""
+Inference governor
+Backs the detector off before the SoC throttles: follows the temperature and
+the CPU load of the other processes, and steps the interpreter threads and
+the highest inference rate down and back up within bounds, never below the
+guaranteed rate
+"""
+
+import logging
+import os
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+STAT_PATH = "/proc/stat"
+
+
+class SystemSource:
+    """Reads the SoC temperature and the CPU usage from sysfs and procfs (or from fake files with the same format)"""
+
+    def __init__(self, thermal_path=THERMAL_PATH, stat_path=STAT_PATH):
+        """
+        Initialize the source
+
+        Args:
+            thermal_path (str): File holding the temperature in millidegrees Celsius
+            stat_path (str): File in the /proc/stat format
+        """
+        self._thermal_path = thermal_path
+        self._stat_path = stat_path
+        self._cpus = os.cpu_count() or 1
+        self._last = None
+
+    def _temperature(self):
+        try:
+            with open(self._thermal_path) as f:
+                return int(f.read().strip()) / 1000.0
+        except (OSError, ValueError):
+            return None
+
+    def _cpu_times(self):
+        """(busy, total) jiffies of all cores"""
+        try:
+            with open(self._stat_path) as f:
+                fields = [int(value) for value in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # user nice system idle iowait irq softirq steal (guest time is already in user)
+        total = sum(fields[:8])
+        return total - fields[3] - fields[4], total
+
+    def read(self):
+        """
+        Sample the system
+
+        Returns:
+            dict: 'temperature' in Celsius (None if unknown), 'busy' and 'own' as fractions of all cores since
+            the previous call (None on the first one), 'own' being this process
+        """
+        times = self._cpu_times()
+        now = (time.monotonic(), time.process_time())
+        last, self._last = self._last, (times, now)
+        busy = own = None
+        if last is not None and times is not None and last[0] is not None and times[1] > last[0][1]:
+            busy = (times[0] - last[0][0]) / (times[1] - last[0][1])
+            wall = now[0] - last[1][0]
+            if wall > 0:
+                own = min(busy, (now[1] - last[1][1]) / (wall * self._cpus))
+        return {'temperature': self._temperature(), 'busy': busy, 'own': own}
+
+
+class InferenceGovernor:
+    """
+    Steps the detector along a ladder of (threads, highest inference rate) levels
+
+    Level 0 runs max_threads without a rate cap; each level below takes one
+    interpreter thread away, then caps the rate further, down to min_rate.
+    A step down happens when the SoC is hot or the other processes load the
+    CPU, at most once every settle seconds so the previous step shows in the
+    temperature; a step up only after recovery seconds of calm readings
+    (cool and idle, below both lower thresholds) and as long since the last
+    level change.
+    """
+
+    def __init__(self, source=None, max_threads=4, min_threads=1, min_rate=1.0, rate_caps=(4.0, 2.0),
+                 temp_high=70.0, temp_low=65.0, busy_high=0.75, busy_low=0.5, settle=15.0, recovery=60.0, history=100,
+                 metrics=None):
+        """
+        Initialize the governor
+
+        Args:
+            source (SystemSource): Readings of the system (default: the real sysfs and procfs files)
+            max_threads (int): Interpreter threads when the system is cool and idle
+            min_threads (int): Fewest interpreter threads
+            min_rate (float): Guaranteed inference rate per second of audio, the lowest cap
+            rate_caps (tuple): Rate caps between no cap and min_rate, highest first
+            temp_high (float): Temperature in Celsius from which the governor steps down
+            temp_low (float): Temperature below which it may step back up
+            busy_high (float): CPU used by other processes, as a fraction of all cores, from which it steps down
+            busy_low (float): CPU used by other processes below which it may step back up
+            settle (float): Seconds after a level change before stepping down again
+            recovery (float): Seconds of calm before stepping up one level
+            history (int): Decisions kept in decisions
+            metrics (Registry): Registry of the governor metrics (default: the process registry)
+        """
+        if not 1 <= min_threads <= max_threads:
+            raise ValueError(f"Invalid thread bounds [{min_threads}, {max_threads}]")
+        if min_rate <= 0:
+            raise ValueError(f"The guaranteed inference rate must be positive, not {min_rate}")
+        self._source = source if source is not None else SystemSource()
+        self._temp_high = temp_high
+        self._temp_low = temp_low
+        self._busy_high = busy_high
+        self._busy_low = busy_low
+        self._settle = settle
+        self._recovery = recovery
+        self._min_threads = min_threads
+        self._min_rate = min_rate
+        self._rate_caps = rate_caps
+        self._levels = self._ladder(max_threads)
+        self._level = 0
+        self._last_change = float('-inf')
+        # Last reading that was hot, busy or between the thresholds
+        self._last_unsettled = float('-inf')
+        self.reading = {}
+        # Decisions with the readings that led to them, oldest first
+        self.decisions = deque(maxlen=history)
+        metrics = metrics if metrics is not None else REGISTRY
+        self._decisions = metrics.counter('lullgo_governor_decisions_total', "Level changes of the inference governor")
+        metrics.gauge('lullgo_governor_level', "Inference governor level, 0 is full speed", fn=lambda: self._level)
+        metrics.gauge('lullgo_governor_threads', "Interpreter threads chosen by the governor", fn=lambda: self.threads)
+        metrics.gauge('lullgo_governor_max_rate', "Inference rate cap chosen by the governor, 0 for none",
+                      fn=lambda: self.max_rate or 0.0)
+        metrics.gauge('lullgo_soc_temperature_celsius', "SoC temperature",
+                      fn=lambda: self.reading.get('temperature') or 0.0)
+
+    def _ladder(self, max_threads):
+        levels = [(threads, None) for threads in range(max_threads, self._min_threads - 1, -1)]
+        levels += [(self._min_threads, rate) for rate in sorted(set(self._rate_caps), reverse=True)
+                   if rate > self._min_rate]
+        levels.append((self._min_threads, self._min_rate))
+        return levels
+
+    def _rescaled(self, max_threads):
+        """Ladder under another thread ceiling and the level as many steps above its lowest one as now"""
+        if max_threads < self._min_threads:
+            raise ValueError(f"Invalid thread bounds [{self._min_threads}, {max_threads}]")
+        levels = self._ladder(max_threads)
+        return levels, max(0, len(levels) - (len(self._levels) - self._level))
+
+    def threads_with(self, max_threads):
+        """Interpreter threads the current level would use under another thread ceiling"""
+        levels, level = self._rescaled(max_threads)
+        return levels[level][0]
+
+    def set_max_threads(self, max_threads):
+        """Change the thread ceiling (e.g. on a configuration reload)"""
+        self._levels, self._level = self._rescaled(max_threads)
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def threads(self):
+        """Interpreter threads at the current level"""
+        return self._levels[self._level][0]
+
+    @property
+    def max_rate(self):
+        """Highest inference rate at the current level, None for no cap"""
+        return self._levels[self._level][1]
+
+    def update(self, now=None):
+        """
+        Sample the source and move one level if needed
+
+        Args:
+            now (float): Monotonic time of the decision (default: now)
+
+        Returns:
+            dict: the decision if the level changed, None otherwise
+        """
+        now = time.monotonic() if now is None else now
+        reading = self.reading = self._source.read()
+        temperature = reading.get('temperature')
+        others = None
+        if reading.get('busy') is not None:
+            others = reading['busy'] - (reading.get('own') or 0.0)
+
+        reason = None
+        if temperature is not None and temperature >= self._temp_high:
+            reason = f"temperature {temperature:.1f} C"
+        elif others is not None and others >= self._busy_high:
+            reason = f"other processes using {others * 100:.0f}% of the CPU"
+        if reason is not None:
+            self._last_unsettled = now
+            if self._level == len(self._levels) - 1 or now - self._last_change < self._settle:
+                return None
+            level = self._level + 1
+        else:
+            calm = (temperature is None or temperature < self._temp_low) and (others is None or others < self._busy_low)
+            if not calm:
+                self._last_unsettled = now
+            since = now - max(self._last_change, self._last_unsettled)
+            if not calm or self._level == 0 or since < self._recovery:
+                return None
+            level = self._level - 1
+            reason = f"calm for {since:.0f} s"
+
+        previous = (self.threads, self.max_rate)
+        self._level = level
+        self._last_change = now
+        self._decisions.inc()
+        decision = {
+            'time': time.time(),
+            'level': level,
+            'threads': self.threads,
+            'max_rate': self.max_rate,
+            'temperature': temperature,
+            'other_cpu': round(others, 3) if others is not None else None,
+            'reason': reason,
+        }
+        self.decisions.append(decision)
+        caps = [f"{rate:.2f}/s" if rate else "none" for rate in (previous[1], self.max_rate)]
+        logger.info(f"Governor level {level}: {previous[0]} -> {self.threads} threads, rate cap "
+                    f"{caps[0]} -> {caps[1]} ({reason})")
+        return decision
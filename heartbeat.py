@@ -1,152 +1,194 @@
 """
 WebSocket Client
-Sends heartbeat messages every 2 seconds and listens for acknowledgements
+Checks the link to the server every 2 seconds with websocket ping/pong frames
+(or JSON heartbeat messages and acknowledgements in compatibility mode)
 """
 
 import asyncio
-import websockets
-import json
 import logging
-from datetime import datetime
+import sys
 import time
+from datetime import datetime
 from gpiozero import LED
+from client import ClientConnection, run_roles
+from config import Config, ConfigError, defaults, identity
+from logsetup import setup_logging
+from metrics import HEARTBEAT_PORT, REGISTRY
+from liveness import RttStats
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
 class Heartbeat:
-    def __init__(self, server_url, client_name="rpi-nurse.heartbeat"):
+    def __init__(self, server_url, client_name="rpi-nurse.heartbeat", room=None, connection=None, json_heartbeat=False,
+                 metrics=None, settings=None):
         """
-        Initialize the WebSocket client
+        Initialize the heartbeat role
 
         Args:
             server_url (str): WebSocket server URL (e.g., ws://192.168.1.100:8765)
             client_name (str): Name of this client
+            room (str): Room announced with every message (default: the client name up to its first dot)
+            connection (ClientConnection): Connection shared with other roles (default: a dedicated one)
+            json_heartbeat (bool): Send JSON heartbeat messages instead of ping frames (compatibility mode)
+            metrics (Registry): Registry of the link metrics (default: the process registry)
+            settings (dict): heartbeat section of the configuration (default: the defaults of config.py)
         """
-        self._server_url = server_url
         self._client_name = client_name
-        self._connection = None
-        self._heartbeat_interval = 2  # seconds
-        self._reconnect_interval = 5  # seconds
-        self._is_running = False
+        self._room = room or client_name.split('.', 1)[0]
+        self._connection = connection if connection is not None else ClientConnection(server_url)
+        self._json_heartbeat = json_heartbeat
+        settings = settings if settings is not None else defaults('heartbeat')
+        self._heartbeat_interval = settings['interval']  # seconds
+        self._ping_timeout = settings['ping_timeout']  # seconds
+        self._rtt_log_interval = 30  # pings
         self._missed_heartbeats = 0
-        self._max_missed_heartbeats = 5
-        self._led = LED(26)
+        self._max_missed_heartbeats = settings['max_missed']
+        self._rtt = RttStats()
+        metrics = metrics if metrics is not None else REGISTRY
+        self._rtt_histogram = metrics.histogram('lullgo_heartbeat_rtt_seconds', "Ping/pong round-trip time to the server")
+        self._timeouts = metrics.counter('lullgo_heartbeat_timeouts_total', "Pings without a pong in time")
+        self._led_pin = settings['led_pin']
+        self._led = LED(self._led_pin)
+        self._led_state = None
+        self._connection.add_handler('acknowledgement', self._on_acknowledgement)
+        self._connection.add_state_listener(self._on_connection_state)
+
+    @property
+    def connection(self):
+        return self._connection
+
+    @property
+    def rtt(self):
+        """Round-trip-time statistics of the link"""
+        return self._rtt
+
+    def _set_led(self, alive):
+        """Drive the LED from the link state, GPIO is only touched when the state changes"""
+        if alive == self._led_state:
+            return
+        self._led_state = alive
+        if alive:
+            self._led.on()
+        else:
+            self._led.blink()
+
+    def apply_config(self, settings):
+        """Apply the heartbeat section of a reloaded configuration, the GPIO is only reopened if the pin changed"""
+        self._heartbeat_interval = settings['interval']
+        self._ping_timeout = settings['ping_timeout']
+        self._max_missed_heartbeats = settings['max_missed']
+        if settings['led_pin'] != self._led_pin:
+            self._led.close()
+            self._led_pin = settings['led_pin']
+            self._led = LED(self._led_pin)
+            state, self._led_state = self._led_state, None
+            if state is not None:
+                self._set_led(state)
+            logger.info(f"Link LED moved to GPIO {self._led_pin}")
+
+    def _on_acknowledgement(self, data):
+        """Handle an acknowledgement from the server (compatibility mode)"""
+        logger.debug(f"acknowledgement received from {data.get('server_name')} "
+                     f"for heartbeat {data.get('received_heartbeat')}")
+        if 't1' in data:
+            # The exchange doubles as a clock offset measurement
+            self._connection.clock.add(data['t0'], data['t1'], data['t2'], time.monotonic())
+        self._set_led(True)
+
+    def _on_connection_state(self, connected):
+        if connected:
+            # Registers the client with the server, which otherwise does not see the ping frames
+            asyncio.ensure_future(self._connection.send({
+                'type': 'hello',
+                'client_name': self._client_name,
+                'room': self._room,
+                'capabilities': [],
+            }))
+        else:
+            self._set_led(False)
 
     async def _send_heartbeat(self):
         """Send heartbeat message to server"""
         heartbeat_message = {
             'type': 'heartbeat',
             'client_name': self._client_name,
+            'room': self._room,
             'timestamp': datetime.now().isoformat(),
+            't0': time.monotonic(),
         }
 
-        try:
-            await self._connection.send(json.dumps(heartbeat_message))
-            logger.info(f"Heartbeat sent to server at {datetime.now().strftime('%H:%M:%S')}")
+        if await self._connection.send(heartbeat_message):
+            logger.debug("Heartbeat sent to server")
             return True
-        except Exception as e:
-            logger.error(f"Failed to send heartbeat: {e}")
-            return False
-
-    async def _listen_for_messages(self):
-        """Listen for messages from server"""
-        try:
-            async for message in self._connection:
-                try:
-                    data = json.loads(message)
-
-                    if data.get('type') == 'acknowledgement':
-                        logger.info(f"acknowledgement received from server: {data.get('message')}")
-                        logger.info(f"Server: {data.get('server_name')}, Heartbeat time: {data.get('received_heartbeat')}")
-                        self._led.on()
-                    else:
-                        logger.warning(f"Unknown message type from server: {data.get('type')}")
-
-                except json.JSONDecodeError:
-                    logger.error("Invalid JSON received from server")
-
-        except websockets.exceptions.ConnectionClosed as e:
-            logger.error(f"Connection closed: {e}")
+        logger.error("Failed to send heartbeat")
+        return False
+
+    async def _ping(self):
+        """Check the link with a ping frame and record the round-trip time"""
+        rtt = await self._connection.ping(self._ping_timeout)
+        if rtt is None:
+            self._rtt.add_timeout()
+            self._timeouts.inc()
+            logger.warning(f"No pong from server within {self._ping_timeout} s")
             return False
 
+        self._rtt.add(rtt)
+        self._rtt_histogram.observe(rtt)
+        self._set_led(True)
+        logger.debug(f"Pong received, RTT {rtt * 1000:.1f} ms")
+        if self._rtt.count % self._rtt_log_interval == 0:
+            logger.info(f"Link RTT: {self._rtt}")
         return True
 
-    async def _heartbeat_loop(self):
+    async def run(self):
         """Main heartbeat loop"""
-        while self._is_running:
-            # Send heartbeat
-            success = await self._send_heartbeat()
+        while True:
+            await self._connection.wait_connected()
+
+            # Check the link
+            if self._json_heartbeat:
+                success = await self._send_heartbeat()
+            else:
+                success = await self._ping()
 
             if not success:
                 self._missed_heartbeats += 1
                 logger.warning(f"Missed heartbeat count: {self._missed_heartbeats}")
-                self._led.blink()
+                self._set_led(False)
 
                 if self._missed_heartbeats >= self._max_missed_heartbeats:
                     logger.error(f"Too many missed heartbeats. Reconnecting...")
-                    # self._led.off()
-                    return False
+                    self._missed_heartbeats = 0
+                    await self._connection.reconnect()
             else:
-                # Reset missed heartbeat counter on successful send
+                # Reset missed heartbeat counter on success
                 self._missed_heartbeats = 0
 
-            # Wait for the interval before sending next heartbeat
+            # Wait for the interval before the next check
             await asyncio.sleep(self._heartbeat_interval)
 
-        return True
-
-    async def _connect(self):
-        """Connect to the WebSocket server"""
-        logger.info(f"Connecting to server at {self._server_url}")
-
-        try:
-            self._connection = await websockets.connect(self._server_url)
-            logger.info(f"Connected to server successfully")
-
-            # Start listening for messages
-            listener_task = asyncio.create_task(self._listen_for_messages())
-
-            # Start heartbeat loop
-            self._is_running = True
-            heartbeat_task = asyncio.create_task(self._heartbeat_loop())
-
-            await asyncio.sleep(1)
-            # Wait for tasks to complete
-            await asyncio.gather(listener_task, heartbeat_task)
-
-        except ConnectionRefusedError:
-            logger.error(f"Connection refused. Is the server running at {self._server_url}?")
-        except Exception as e:
-            logger.error(f"Connection error: {e}")
-        finally:
-            self._is_running = False
-            if self._connection:
-                await self._connection.close()
-
-    async def run_with_reconnect(self):
-        """Run client with automatic reconnection"""
-        while True:
-            try:
-                await self._connect()
-            except Exception as e:
-                logger.error(f"Client error: {e}")
-
-            logger.info(f"Attempting to reconnect in {self._reconnect_interval} seconds...")
-            await asyncio.sleep(self._reconnect_interval)
+    async def run_with_reconnect(self, metrics_port=HEARTBEAT_PORT, config=None):
+        """Run the heartbeat on its own connection with automatic reconnection, reloading config if given"""
+        await run_roles(self._connection, [self] + ([config] if config is not None else []), metrics_port=metrics_port)
 
 
 def main():
     """Main function to run the client"""
-    client = Heartbeat(server_url="ws://parent.local:8765")
+    setup_logging("heartbeat")
+    try:
+        config = Config()
+    except ConfigError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+    client_name, room = identity(config.section('client'), 'heartbeat')
+    client = Heartbeat(server_url=config.section('client')['server_url'], client_name=client_name, room=room,
+                       settings=config.section('heartbeat'))
+    config.add_listener('heartbeat', client.apply_config)
+    config.add_listener('client', client.connection.apply_config)
 
     try:
-        asyncio.run(client.run_with_reconnect())
+        asyncio.run(client.run_with_reconnect(config=config))
     except Exception as e:
         logger.error(f"Client error: {e}")
 
@@ -0,0 +1,329 @@
+"""
+Parent hub
+Registry of the connected nursery units keyed by client name, per-room alert
+state, fan-out of alerts to the subscribed parent listeners and detection of
+the units that went silent
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from liveness import Deadlines
+
+logger = logging.getLogger(__name__)
+
+ALL_ROOMS = '*'
+
+
+def room_of(data):
+    """Room of a message: its 'room' field, else the client name prefix (rpi-nurse.bcd -> rpi-nurse)"""
+    room = data.get('room')
+    if room:
+        return room
+    return data.get('client_name', 'Unknown').split('.', 1)[0]
+
+
+class ClientRecord:
+    """What the server knows about one named client"""
+
+    def __init__(self, name, room, websocket):
+        self.name = name
+        self.room = room
+        self.websocket = websocket
+        self.address = websocket.remote_address
+        self.last_heartbeat = None
+        self.last_bcd = None
+        self.last_seen = None
+        self.last_seen_monotonic = None
+        self.capabilities = set()
+
+    def touch(self):
+        self.last_seen = datetime.now().isoformat()
+        self.last_seen_monotonic = time.monotonic()
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'room': self.room,
+            'address': self.address,
+            'last_heartbeat': self.last_heartbeat,
+            'last_bcd': self.last_bcd,
+            'last_seen': self.last_seen,
+            'capabilities': sorted(self.capabilities),
+        }
+
+
+class RoomState:
+    """Alert state of one room, independent of the other rooms"""
+
+    def __init__(self, name):
+        self.name = name
+        self.alerts = 0
+        self.last_alert = None
+        self.last_alert_monotonic = None
+
+
+class Subscriber:
+    """Parent listener with a bounded send queue, so a slow one cannot stall the others"""
+
+    def __init__(self, websocket, name, rooms, queue_size=32):
+        """
+        Initialize the subscriber
+
+        Args:
+            websocket: WebSocket connection of the listener
+            name (str): Name of the listener
+            rooms (list): Rooms to receive alerts from, '*' for all
+            queue_size (int): Messages buffered before the oldest one is dropped
+        """
+        self.websocket = websocket
+        self.name = name
+        self.rooms = set(rooms)
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._task = None
+
+    def push(self, message):
+        """Queue a serialized message, dropping the oldest one when the queue is full"""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            logger.warning(f"Subscriber {self.name} is slow, dropped {self.dropped} messages so far")
+        self._queue.put_nowait(message)
+
+    def start(self):
+        self._task = asyncio.create_task(self._sender())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sender(self):
+        """Send the queued messages one by one"""
+        while True:
+            message = await self._queue.get()
+            try:
+                await self.websocket.send(message)
+            except Exception as e:
+                logger.error(f"Failed to send to subscriber {self.name}: {e}")
+                return
+
+
+class Hub:
+    def __init__(self, queue_size=32, alert_cooldown=2.0, heartbeat_interval=2.0, on_liveness=None):
+        """
+        Initialize the hub
+
+        Args:
+            queue_size (int): Send queue length of every subscriber
+            alert_cooldown (float): Seconds during which further alerts from the same room are merged
+            heartbeat_interval (float): Heartbeat interval of the children. A child silent for twice as long is
+                stale, i.e. it is reported one interval after its first missed heartbeat rather than at it: the next
+                heartbeat of a healthy child is due right at one interval, so any jitter would raise false alarms
+            on_liveness (callable): Called with (record, stale) when a client goes stale or is heard from again
+        """
+        self._queue_size = queue_size
+        self._alert_cooldown = alert_cooldown
+        self._heartbeat_interval = heartbeat_interval
+        self._on_liveness = on_liveness
+        self.clients = {}
+        self.rooms = {}
+        self._connection_clients = {}
+        self._subscribers = {}
+        self._room_subscribers = {ALL_ROOMS: set()}
+        # Client name -> latest record, kept after its connection closed until it goes stale or comes back
+        self._watched = {}
+        self._deadlines = Deadlines()
+        # Clients silent for one interval, waiting for the second one (or for the pong of a probe)
+        self._probed = set()
+        self._probes = {}
+        # Client name -> record of the clients that went silent
+        self.stale = {}
+
+    def touch(self, websocket, data):
+        """
+        Register or refresh the client that sent a message
+
+        Returns:
+            ClientRecord: the client's record
+        """
+        name = data.get('client_name', 'Unknown')
+        record = self.clients.get(name)
+        if record is None or record.websocket is not websocket:
+            record = ClientRecord(name, room_of(data), websocket)
+            self.clients[name] = record
+            self._connection_clients.setdefault(websocket, set()).add(name)
+            logger.info(f"Client {name} registered in room {record.room} from {record.address}")
+        if 'capabilities' in data:
+            record.capabilities = set(data['capabilities'])
+        record.touch()
+        self._watch(record)
+        return record
+
+    def set_heartbeat_interval(self, heartbeat_interval):
+        """Use another heartbeat interval from the next message of every client"""
+        self._heartbeat_interval = heartbeat_interval
+
+    def _watch(self, record):
+        """Restart the silence deadline of a client that was just heard from"""
+        self._watched[record.name] = record
+        self._probed.discard(record.name)
+        self._deadlines.schedule(record.name, record.last_seen_monotonic + self._heartbeat_interval)
+        if self.stale.pop(record.name, None) is not None:
+            logger.info(f"Client {record.name} (room {record.room}) is back")
+            self.publish(record.room, {
+                'type': 'recovered',
+                'room': record.room,
+                'client_name': record.name,
+                'timestamp': record.last_seen,
+            })
+            if self._on_liveness is not None:
+                self._on_liveness(record, False)
+
+    def _on_deadline(self, name):
+        """
+        A client has been silent for one interval, then for two
+
+        The first deadline is the grace period for a heartbeat that is merely late (and the time to probe the
+        clients that rely on ping frames), the second one reports the client stale.
+        """
+        record = self._watched.get(name)
+        if record is None:
+            return
+        if name not in self._probed:
+            self._probed.add(name)
+            self._deadlines.schedule(name, record.last_seen_monotonic + 2 * self._heartbeat_interval)
+            if record.last_heartbeat is None:
+                # Checked with ping frames, which the server does not see: ask the connection itself
+                self._probe(record.websocket)
+            return
+        del self._watched[name]
+        self._probed.discard(name)
+        self.stale[name] = record
+        silent = time.monotonic() - record.last_seen_monotonic
+        logger.warning(f"Client {name} (room {record.room}) silent for {silent:.1f} s")
+        self.publish(record.room, {
+            'type': 'alert',
+            'kind': 'stale',
+            'room': record.room,
+            'client_name': name,
+            'timestamp': datetime.now().isoformat(),
+            'last_seen': record.last_seen,
+            'silent_seconds': round(silent, 1),
+        })
+        if self._on_liveness is not None:
+            self._on_liveness(record, True)
+
+    def _probe(self, websocket):
+        if websocket not in self._probes:
+            self._probes[websocket] = asyncio.ensure_future(self._ping(websocket))
+
+    async def _ping(self, websocket):
+        """Ping a connection, a pong counts as a message from its clients that rely on ping frames"""
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self._heartbeat_interval)
+        except Exception:
+            # No pong in time or a closed connection, the stale deadline decides
+            return
+        finally:
+            self._probes.pop(websocket, None)
+        for name in self._connection_clients.get(websocket, ()):
+            record = self.clients.get(name)
+            if record is not None and record.websocket is websocket and record.last_heartbeat is None:
+                record.touch()
+                self._watch(record)
+
+    async def watch(self):
+        """Report the clients that go silent, until cancelled"""
+        await self._deadlines.run(self._on_deadline)
+
+    def find(self, room, capability):
+        """
+        Find the client of a room offering a capability (e.g. 'listen')
+
+        Returns:
+            ClientRecord: the most recently seen one, None if no client offers it
+        """
+        candidates = [record for record in self.clients.values()
+                      if record.room == room and capability in record.capabilities]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda record: record.last_seen_monotonic)
+
+    def subscribe(self, websocket, name, rooms):
+        """
+        Register a parent listener for the alerts of some rooms
+
+        Raises:
+            ValueError: if rooms is not a list of room names
+        """
+        if rooms is not None and (not isinstance(rooms, list) or
+                                  not all(isinstance(room, str) and room for room in rooms)):
+            raise ValueError(f"rooms must be a list of room names, got {rooms!r}")
+        self.unsubscribe(websocket)
+        subscriber = Subscriber(websocket, name, rooms or [ALL_ROOMS], self._queue_size)
+        self._subscribers[websocket] = subscriber
+        for room in subscriber.rooms:
+            self._room_subscribers.setdefault(room, set()).add(subscriber)
+        subscriber.start()
+        logger.info(f"Subscriber {name} listening to rooms {sorted(subscriber.rooms)}")
+        return subscriber
+
+    def unsubscribe(self, websocket):
+        subscriber = self._subscribers.pop(websocket, None)
+        if subscriber is None:
+            return
+        subscriber.stop()
+        for room in subscriber.rooms:
+            self._room_subscribers.get(room, set()).discard(subscriber)
+
+    def drop_connection(self, websocket):
+        """Forget the clients and the subscriber that used a closed connection"""
+        for name in self._connection_clients.pop(websocket, ()):
+            record = self.clients.get(name)
+            if record is not None and record.websocket is websocket:
+                del self.clients[name]
+        self.unsubscribe(websocket)
+        probe = self._probes.pop(websocket, None)
+        if probe is not None:
+            probe.cancel()
+
+    def publish(self, room, message):
+        """Fan a message out to the subscribers of a room; it is serialized once"""
+        subscribers = self._room_subscribers.get(room, set()) | self._room_subscribers[ALL_ROOMS]
+        if not subscribers:
+            return 0
+        payload = json.dumps(message)
+        for subscriber in subscribers:
+            subscriber.push(payload)
+        return len(subscribers)
+
+    def alert(self, record, timestamp):
+        """
+        Raise an alert for the room of a client
+
+        Returns:
+            bool: False if the room already alerted within the cooldown
+        """
+        state = self.rooms.get(record.room)
+        if state is None:
+            state = self.rooms[record.room] = RoomState(record.room)
+        now = time.monotonic()
+        if state.last_alert_monotonic is not None and now - state.last_alert_monotonic < self._alert_cooldown:
+            return False
+        state.alerts += 1
+        state.last_alert = timestamp
+        state.last_alert_monotonic = now
+        listeners = self.publish(record.room, {
+            'type': 'alert',
+            'room': record.room,
+            'client_name': record.name,
+            'timestamp': timestamp,
+            'kind': 'cry',
+            'alerts': state.alerts,
+        })
+        logger.info(f"Alert from room {record.room} ({record.name}) sent to {listeners} subscribers")
+        return True
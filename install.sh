@@ -28,10 +28,11 @@ sudo npm install -g serve
 
 sudo cp ./services/bcd.service /etc/systemd/system/bcd.service
 sudo cp ./services/heartbeat.service /etc/systemd/system/heartbeat.service
+sudo cp ./services/child.service /etc/systemd/system/child.service
 sudo cp ./services/parent.service /etc/systemd/system/parent.service
 sudo systemctl daemon-reload
-sudo systemctl enable bcd.service
-sudo systemctl enable heartbeat.service
+# child.service runs heartbeat + bcd in one process; bcd.service and heartbeat.service run them separately
+sudo systemctl enable child.service
 sudo systemctl enable parent.service
 
 sudo reboot now
@@ -0,0 +1,290 @@
+"""
+Live listen-in
+On-demand streaming of the child's microphone to the parent: the child sends
+µ-law frames read from its capture ring buffer, the parent plays them through
+an adaptive jitter buffer
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+import numpy as np
+
+from capture import lowpass_taps
+from codec import decode_frame, encode_frame
+
+logger = logging.getLogger(__name__)
+
+
+class LiveStream:
+    """Child side: streams the capture ring buffer to the server while a listener asks for it"""
+
+    def __init__(self, connection, capture, frame_seconds=0.02, max_seconds=600):
+        """
+        Initialize the live stream
+
+        Args:
+            connection (ClientConnection): Connection the frames are sent on
+            capture (AudioCapture): Capture whose ring buffer is streamed
+            frame_seconds (float): Audio per frame
+            max_seconds (float): The stream stops by itself after this long
+        """
+        self._connection = connection
+        self._capture = capture
+        self._frame_length = int(frame_seconds * capture.sample_rate)
+        self._poll_interval = frame_seconds / 2
+        self._max_seconds = max_seconds
+        self._task = None
+        self.frames = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+        connection.add_handler('listen', self._on_listen)
+        connection.add_state_listener(self._on_connection_state)
+
+    @property
+    def streaming(self):
+        return self._task is not None and not self._task.done()
+
+    def _on_listen(self, data):
+        """Start or stop the stream on the server's request"""
+        if data.get('action') == 'start':
+            if not self.streaming:
+                self._task = asyncio.ensure_future(self._stream())
+        elif data.get('action') == 'stop':
+            self.stop()
+
+    def _on_connection_state(self, connected):
+        if not connected:
+            self.stop()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _stream(self):
+        """Send every new frame of the ring buffer until stopped"""
+        ring = self._capture.ring
+        rate = self._capture.sample_rate
+        frame = self._frame_length
+        # Start from the latest samples, listening is about now
+        position = ring.write_index
+        seq = 0
+        started = time.monotonic()
+        frames, nbytes, encode_seconds = self.frames, self.bytes, self.encode_seconds
+        logger.info("Live stream started")
+        try:
+            while time.monotonic() - started < self._max_seconds:
+                write_index = ring.write_index
+                if write_index - position > ring.capacity // 2:
+                    # The network fell far behind, skip ahead instead of sending stale audio
+                    position = write_index - frame
+                while write_index - position >= frame:
+                    start = time.perf_counter()
+                    captured = self._capture.time_of(position + frame)
+                    offset = self._connection.clock.offset
+                    data = encode_frame(seq, position, rate, ring.read(position, position + frame),
+                                        captured + offset if captured is not None and offset is not None else 0.0)
+                    self.encode_seconds += time.perf_counter() - start
+                    if not await self._connection.send_bytes(data):
+                        return
+                    self.frames += 1
+                    self.bytes += len(data)
+                    seq += 1
+                    position += frame
+                await asyncio.sleep(self._poll_interval)
+        finally:
+            audio = (self.frames - frames) * frame / rate
+            if audio:
+                logger.info(f"Live stream stopped after {audio:.1f} s of audio, "
+                            f"{(self.bytes - nbytes) / audio / 1000:.1f} kB/s, encoding "
+                            f"{(self.encode_seconds - encode_seconds) / audio * 100:.3f}% of a CPU")
+
+
+class Upsampler:
+    """Stateful integer-factor FIR interpolator, so frame boundaries do not click"""
+
+    def __init__(self, factor, taps_per_phase=24):
+        self._factor = factor
+        self._taps = (lowpass_taps(taps_per_phase * factor + 1, 1.0 / factor) * factor).astype(np.float32)
+        self._state = np.zeros(len(self._taps) - 1, dtype=np.float32)
+
+    def process(self, samples):
+        # Imported on first use, scipy adds most of the startup time of the daemons
+        from scipy.signal import lfilter
+
+        stuffed = np.zeros(len(samples) * self._factor, dtype=np.float32)
+        stuffed[::self._factor] = samples
+        out, self._state = lfilter(self._taps, 1.0, stuffed, zi=self._state)
+        return out.astype(np.float32)
+
+
+class JitterBuffer:
+    """
+    Parent side: buffers the received frames and feeds the output stream
+
+    Frames are pushed from the event loop and read from the PortAudio thread.
+    The playout delay follows the measured interarrival jitter; when the buffer
+    grows beyond max_delay the oldest audio is dropped instead of letting the
+    latency build up.
+    """
+
+    def __init__(self, output_rate, min_delay=0.04, max_delay=0.3, capacity_seconds=1.0, output_latency=0.0):
+        """
+        Initialize the jitter buffer
+
+        Args:
+            output_rate (int): Sample rate of the output stream
+            min_delay (float): Smallest playout delay in seconds
+            max_delay (float): Buffered audio beyond which the oldest samples are dropped
+            capacity_seconds (float): Size of the buffer
+            output_latency (float): Latency of the output stream, added to the latency estimates
+        """
+        self._rate = output_rate
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._output_latency = output_latency
+        self._data = np.zeros(int(capacity_seconds * output_rate), dtype=np.float32)
+        self._write = 0
+        self._read = 0
+        # Read index the reader must jump to, set by the writer when the buffer grows beyond max_delay
+        self._skip_to = 0
+        self._prebuffering = True
+        self._converter = None
+        self._source_rate = None
+        self._expected = None
+        self._last_arrival = None
+        self._jitter = 0.0
+        self.frames = 0
+        self.late = 0
+        self.gaps = 0
+        # Samples dropped by the writer on a full buffer, and skipped by the reader
+        self._overflowed = 0
+        self._skipped = 0
+        self.underruns = 0
+        self.latencies = deque(maxlen=512)
+
+    @property
+    def target_delay(self):
+        """Current playout delay in seconds"""
+        return min(self._max_delay / 2, max(self._min_delay, 4 * self._jitter))
+
+    @property
+    def buffered(self):
+        """Seconds of audio waiting to be played"""
+        return (self._write - self._pending_read()) / self._rate
+
+    @property
+    def dropped_samples(self):
+        """Samples received but never played"""
+        return self._overflowed + self._skipped
+
+    def _pending_read(self):
+        """Read index once the reader has applied the pending skip"""
+        return max(self._read, self._skip_to)
+
+    def _convert(self, samples, source_rate):
+        if source_rate != self._source_rate:
+            self._source_rate = source_rate
+            if self._rate % source_rate == 0 and self._rate != source_rate:
+                self._converter = Upsampler(self._rate // source_rate).process
+            elif self._rate == source_rate:
+                self._converter = lambda block: block
+            else:
+                from scipy.signal import resample_poly
+
+                logger.warning(f"Resampling live audio {source_rate} Hz -> {self._rate} Hz frame by frame")
+                self._converter = lambda block: resample_poly(block, self._rate, source_rate).astype(np.float32)
+        return self._converter(samples)
+
+    def push(self, data, arrival):
+        """
+        Add a received frame (called from the event loop)
+
+        Args:
+            data (bytes): Binary audio frame
+            arrival (float): Monotonic time the frame was received
+
+        Returns:
+            float: estimated capture-to-speaker latency of the frame in seconds, None if unknown
+        """
+        seq, position, source_rate, samples, capture_time = decode_frame(data)
+        self.frames += 1
+        # Interarrival jitter as in RFC 3550
+        if self._last_arrival is not None:
+            deviation = (arrival - self._last_arrival[0]) - (position - self._last_arrival[1]) / source_rate
+            self._jitter += (abs(deviation) - self._jitter) / 16
+        self._last_arrival = (arrival, position)
+
+        length = len(samples)
+        if self._expected is not None:
+            if position < self._expected:
+                self.late += 1
+                return None
+            if position > self._expected:
+                # Missing audio is replaced by silence, up to 100 ms
+                self.gaps += 1
+                missing = min(position - self._expected, source_rate // 10)
+                samples = np.concatenate([np.zeros(missing, dtype=np.float32), samples])
+        # The next frame starts after this one, not after this one and its silence
+        self._expected = position + length
+
+        out = self._convert(samples, source_rate)
+        capacity = len(self._data)
+        read = self._pending_read()
+        if self._write - read + len(out) > capacity:
+            self._overflowed += len(out)
+            return None
+        pos = self._write % capacity
+        first = min(len(out), capacity - pos)
+        self._data[pos:pos + first] = out[:first]
+        self._data[:len(out) - first] = out[first:]
+        self._write += len(out)
+
+        buffered = self._write - read
+        if buffered > self._max_delay * self._rate:
+            # Counted as dropped by the reader when it jumps
+            self._skip_to = self._write - int(self.target_delay * self._rate)
+            buffered = self._write - self._skip_to
+        if not capture_time:
+            return None
+        latency = arrival - capture_time + buffered / self._rate + self._output_latency
+        self.latencies.append(latency)
+        return latency
+
+    def read_into(self, out):
+        """Fill an output buffer (called from the PortAudio thread)"""
+        n = len(out)
+        skip_to = min(self._skip_to, self._write)
+        if skip_to > self._read:
+            self._skipped += skip_to - self._read
+            self._read = skip_to
+        available = self._write - self._read
+        if self._prebuffering:
+            if available < self.target_delay * self._rate:
+                out.fill(0)
+                return
+            self._prebuffering = False
+        take = min(n, available)
+        capacity = len(self._data)
+        pos = self._read % capacity
+        first = min(take, capacity - pos)
+        out[:first] = self._data[pos:pos + first]
+        out[first:take] = self._data[:take - first]
+        out[take:] = 0
+        self._read += take
+        if take < n:
+            self.underruns += 1
+            self._prebuffering = True
+
+    def summary(self):
+        """Counters of the stream and its latency percentiles in milliseconds"""
+        summary = {'frames': self.frames, 'late': self.late, 'gaps': self.gaps,
+                   'dropped_ms': self.dropped_samples / self._rate * 1000, 'underruns': self.underruns,
+                   'jitter_ms': self._jitter * 1000, 'target_delay_ms': self.target_delay * 1000}
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            summary['latency_p50_ms'] = float(np.percentile(latencies, 50))
+            summary['latency_p99_ms'] = float(np.percentile(latencies, 99))
+        return summary
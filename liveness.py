@@ -0,0 +1,192 @@
+"""
+Link liveness
+Round-trip-time statistics of the websocket ping/pong exchange, NTP-style
+estimation of the offset between the server's clock and ours, and deadlines
+that fire when a peer has been silent for too long
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+import numpy as np
+
+
+class RttStats:
+    """Keeps the last round-trip times and summarizes them"""
+
+    def __init__(self, size=512):
+        """
+        Initialize the statistics
+
+        Args:
+            size (int): Number of recent samples used for the average and percentiles
+        """
+        self._samples = deque(maxlen=size)
+        self._min = None
+        self.count = 0
+        self.timeouts = 0
+
+    def add(self, rtt):
+        """Record one round-trip time in seconds"""
+        self._samples.append(rtt)
+        self._min = rtt if self._min is None else min(self._min, rtt)
+        self.count += 1
+
+    def add_timeout(self):
+        """Record a ping that got no pong in time"""
+        self.timeouts += 1
+
+    @property
+    def last(self):
+        return self._samples[-1] if self._samples else None
+
+    def summary(self):
+        """
+        Returns:
+            dict: last/min/avg/p99 round-trip times in milliseconds, ping and timeout counts
+        """
+        if not self._samples:
+            return {'count': self.count, 'timeouts': self.timeouts}
+        samples = np.fromiter(self._samples, dtype=float) * 1000
+        return {
+            'last_ms': float(samples[-1]),
+            'min_ms': self._min * 1000,
+            'avg_ms': float(samples.mean()),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'count': self.count,
+            'timeouts': self.timeouts,
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        if 'last_ms' not in summary:
+            return f"no samples, {self.timeouts} timeouts"
+        return (f"last {summary['last_ms']:.1f} ms, min {summary['min_ms']:.1f} ms, avg {summary['avg_ms']:.1f} ms, "
+                f"p99 {summary['p99_ms']:.1f} ms, {summary['count']} pings, {summary['timeouts']} timeouts")
+
+
+class ClockOffset:
+    """
+    Offset of the server's monotonic clock from ours, estimated NTP-style
+
+    Every exchange gives t0 (request sent, our clock), t1 (request received,
+    server clock), t2 (reply sent, server clock) and t3 (reply received, our
+    clock). The recent exchange with the shortest round trip gives the estimate.
+    """
+
+    def __init__(self, size=8):
+        """
+        Initialize the estimator
+
+        Args:
+            size (int): Number of recent exchanges the best one is picked from
+        """
+        self._samples = deque(maxlen=size)
+
+    def add(self, t0, t1, t2, t3):
+        """Record one request/reply exchange"""
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self._samples.append((delay, offset))
+
+    def reset(self):
+        """Forget the exchanges, e.g. when connecting to a server that may have restarted"""
+        self._samples.clear()
+
+    @property
+    def offset(self):
+        """Seconds to add to our monotonic time to get the server's, None before the first exchange"""
+        return min(self._samples)[1] if self._samples else None
+
+    @property
+    def delay(self):
+        """Round-trip time of the exchange the offset comes from"""
+        return min(self._samples)[0] if self._samples else None
+
+
+class Deadlines:
+    """
+    Monotonic deadlines keyed by name, fired earliest first
+
+    Moving a deadline later, which is what every message of a peer does, only
+    updates a dict; the heap keeps one entry per key, which is pushed again
+    with the current deadline when it comes up early. The waiting task only
+    wakes up when a deadline is due or an earlier one was scheduled.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # Key -> current deadline
+        self._deadlines = {}
+        # Key -> deadline of its live heap entry
+        self._queued = {}
+        self._counter = itertools.count()
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, deadline):
+        """Set the monotonic deadline of key, replacing the previous one"""
+        self._deadlines[key] = deadline
+        queued = self._queued.get(key)
+        if queued is not None and queued <= deadline:
+            return
+        self._queued[key] = deadline
+        entry = (deadline, next(self._counter), key)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def expired(self, now):
+        """
+        Remove and return the keys whose deadline has passed
+
+        Args:
+            now (float): Monotonic time
+
+        Returns:
+            list: keys, earliest deadline first
+        """
+        keys = []
+        while self._heap and self._heap[0][0] <= now:
+            queued, _, key = heapq.heappop(self._heap)
+            if self._queued.get(key) != queued:
+                # Superseded by an earlier entry of the same key
+                continue
+            del self._queued[key]
+            deadline = self._deadlines.get(key)
+            if deadline is None:
+                continue
+            if deadline > now:
+                self._queued[key] = deadline
+                heapq.heappush(self._heap, (deadline, next(self._counter), key))
+                continue
+            del self._deadlines[key]
+            keys.append(key)
+        return keys
+
+    async def run(self, on_expired):
+        """Call on_expired(key) on the event loop as each deadline passes, until cancelled"""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self._wakeup.clear()
+                timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                for key in self.expired(time.monotonic()):
+                    on_expired(key)
+        finally:
+            self._wakeup = None
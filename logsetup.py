@@ -0,0 +1,199 @@
+"""
+Logging setup shared by the daemons
+Records are handed to a background thread through a queue, repetitive
+messages are summarised and recent debug records are kept in RAM until a
+detection or an error asks for them
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from collections import deque
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Set on a record to make the ring buffer dump what it holds, the value is the reason
+DUMP_ATTRIBUTE = 'dump_recent'
+
+# Third-party loggers kept at the output level: their debug records (websockets logs every frame) would flood
+# the ring buffer and cost a formatting on the event loop thread each
+QUIET_LOGGERS = ('websockets', 'asyncio')
+
+_listener = None
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Merges the message arguments on the caller's thread, formatting happens on the listener thread"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RateLimitedHandler(logging.Handler):
+    """Lets a few records per call site through every period and summarises the rest"""
+
+    def __init__(self, target, period=60.0, burst=5, max_level=logging.WARNING):
+        """
+        Initialize the handler
+
+        Args:
+            target (logging.Handler): Handler receiving the records that pass
+            period (float): Seconds of one rate-limiting window
+            burst (int): Records per call site passed in one window
+            max_level (int): Records above this level are never limited
+        """
+        super().__init__()
+        self._target = target
+        self._period = period
+        self._burst = burst
+        self._max_level = max_level
+        # (pathname, lineno) -> [window start, records in window, suppressed, last suppressed record]
+        self._sites = {}
+
+    def _summarise(self, now, force=False):
+        for site, state in self._sites.items():
+            start, _, suppressed, last = state
+            if suppressed and (force or now - start >= self._period):
+                summary = logging.makeLogRecord(last.__dict__)
+                summary.msg = (f"{suppressed} similar messages from {os.path.basename(site[0])}:{site[1]} "
+                               f"suppressed in the last {now - start:.0f} s, last one: {last.getMessage()}")
+                summary.args = None
+                summary.created = time.time()
+                summary.msecs = (summary.created % 1) * 1000
+                self._target.handle(summary)
+                state[2] = 0
+
+    def emit(self, record):
+        now = time.monotonic()
+        self._summarise(now)
+        if record.levelno > self._max_level:
+            self._target.handle(record)
+            return
+
+        site = (record.pathname, record.lineno)
+        state = self._sites.get(site)
+        if state is None or now - state[0] >= self._period:
+            state = self._sites[site] = [now, 0, 0, None]
+        state[1] += 1
+        if state[1] <= self._burst:
+            self._target.handle(record)
+        else:
+            state[2] += 1
+            state[3] = record
+
+    def flush(self):
+        self._summarise(time.monotonic(), force=True)
+        self._target.flush()
+
+    def setFormatter(self, fmt):
+        self._target.setFormatter(fmt)
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the recent records below the output level and dumps them on an error or on request"""
+
+    def __init__(self, target, capacity=500, output_level=logging.INFO):
+        """
+        Initialize the handler
+
+        Args:
+            target (logging.Handler): Handler the records are dumped to
+            capacity (int): Records kept in RAM
+            output_level (int): Level of the regular output; records below it are kept
+        """
+        super().__init__(level=logging.DEBUG)
+        self._target = target
+        self._records = deque(maxlen=capacity)
+        self._output_level = output_level
+
+    def emit(self, record):
+        reason = getattr(record, DUMP_ATTRIBUTE, None)
+        if reason is not None:
+            self.dump(reason)
+        elif record.levelno >= logging.ERROR:
+            self.dump(record.getMessage())
+        elif record.levelno < self._output_level:
+            self._records.append(record)
+
+    def dump(self, reason):
+        if not self._records:
+            return
+        header = logging.makeLogRecord({'levelno': logging.INFO, 'levelname': 'INFO', 'name': __name__,
+                                        'msg': f"--- {len(self._records)} recent debug records ({reason}) ---"})
+        self._target.handle(header)
+        while self._records:
+            self._target.handle(self._records.popleft())
+
+
+def _level_for(daemon, level):
+    if level is None:
+        level = (os.environ.get(f"LULLGO_{daemon.upper()}_LOG_LEVEL")
+                 or os.environ.get("LULLGO_LOG_LEVEL")
+                 or "INFO")
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level for {daemon}")
+    return level
+
+
+def setup_logging(daemon, level=None, ring_capacity=500, period=60.0, burst=5):
+    """
+    Configure non-blocking logging for a daemon
+
+    Args:
+        daemon (str): Daemon name; LULLGO_<DAEMON>_LOG_LEVEL or LULLGO_LOG_LEVEL set the level
+        level (str or int): Log level, overrides the environment
+        ring_capacity (int): Recent debug records kept in RAM (0 disables the ring buffer)
+        period (float): Rate-limiting window in seconds
+        burst (int): Records per call site passed in one window
+    """
+    global _listener
+
+    level = _level_for(daemon, level)
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    output = RateLimitedHandler(stream, period=period, burst=burst)
+    output.setLevel(level)
+    handlers = [output]
+    if ring_capacity:
+        handlers.append(RingBufferHandler(stream, capacity=ring_capacity, output_level=level))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(logging.DEBUG if ring_capacity else level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(level)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush the queue and stop the listener thread"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush()
+        _listener = None
+
+
+def dump_recent_logs(reason):
+    """Ask the ring buffer to write out the recent debug records (e.g. on a detection)"""
+    logging.getLogger(__name__).debug(f"Dumping recent logs: {reason}", extra={DUMP_ATTRIBUTE: reason})
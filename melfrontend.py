@@ -0,0 +1,154 @@
+"""
+Streaming log-mel frontend
+YAMNet's feature extraction in numpy, computed incrementally: the frames of
+the samples shared with the previous window are kept, only the frames of the
+new hop are computed
+"""
+
+import numpy as np
+
+# YAMNet parameters (models/research/audioset/yamnet/params.py)
+SAMPLE_RATE = 16000
+STFT_WINDOW = 400  # 25 ms
+STFT_HOP = 160  # 10 ms
+FFT_LENGTH = 512
+MEL_BANDS = 64
+MEL_MIN_HZ = 125.0
+MEL_MAX_HZ = 7500.0
+LOG_OFFSET = 0.001
+PATCH_FRAMES = 96
+
+
+def hertz_to_mel(frequencies):
+    """HTK mel scale, as in tf.signal"""
+    return 1127.0 * np.log1p(np.asarray(frequencies, dtype=np.float64) / 700.0)
+
+
+def mel_weight_matrix(num_mel_bins=MEL_BANDS, num_spectrogram_bins=FFT_LENGTH // 2 + 1, sample_rate=SAMPLE_RATE,
+                      lower_edge_hertz=MEL_MIN_HZ, upper_edge_hertz=MEL_MAX_HZ):
+    """
+    Port of tf.signal.linear_to_mel_weight_matrix
+
+    Returns:
+        numpy.ndarray: (num_spectrogram_bins, num_mel_bins) float32 matrix, the DC bin has no weight
+    """
+    linear_frequencies = np.linspace(0.0, sample_rate / 2.0, num_spectrogram_bins)[1:]
+    spectrogram_bins_mel = hertz_to_mel(linear_frequencies)[:, None]
+    band_edges_mel = np.linspace(hertz_to_mel(lower_edge_hertz), hertz_to_mel(upper_edge_hertz), num_mel_bins + 2)
+    lower_edge_mel = band_edges_mel[:-2][None, :]
+    center_mel = band_edges_mel[1:-1][None, :]
+    upper_edge_mel = band_edges_mel[2:][None, :]
+    lower_slopes = (spectrogram_bins_mel - lower_edge_mel) / (center_mel - lower_edge_mel)
+    upper_slopes = (upper_edge_mel - spectrogram_bins_mel) / (upper_edge_mel - center_mel)
+    weights = np.maximum(0.0, np.minimum(lower_slopes, upper_slopes))
+    return np.pad(weights, ((1, 0), (0, 0))).astype(np.float32)
+
+
+def periodic_hann(length=STFT_WINDOW):
+    """tf.signal.hann_window(periodic=True)"""
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(length) / length)).astype(np.float32)
+
+
+class LogMelFrontend:
+    """Log-mel frames of YAMNet, the whole window at once (reference for the streaming frontend)"""
+
+    def __init__(self):
+        self._window = periodic_hann()
+        self._weights = mel_weight_matrix()
+
+    @property
+    def window_length(self):
+        """Samples covered by one patch"""
+        return (PATCH_FRAMES - 1) * STFT_HOP + STFT_WINDOW
+
+    def frames(self, samples):
+        """
+        Log-mel features of every complete STFT frame of samples
+
+        Args:
+            samples (numpy.ndarray): float32 mono samples at SAMPLE_RATE
+
+        Returns:
+            numpy.ndarray: (frames, MEL_BANDS) float32 features
+        """
+        count = (len(samples) - STFT_WINDOW) // STFT_HOP + 1
+        if count <= 0:
+            return np.zeros((0, MEL_BANDS), dtype=np.float32)
+        framed = np.lib.stride_tricks.as_strided(
+            samples, shape=(count, STFT_WINDOW), strides=(samples.strides[0] * STFT_HOP, samples.strides[0]),
+            writeable=False)
+        spectrum = np.abs(np.fft.rfft(framed * self._window, n=FFT_LENGTH)).astype(np.float32)
+        return np.log(spectrum @ self._weights + LOG_OFFSET)
+
+    def patch(self, window):
+        """(PATCH_FRAMES, MEL_BANDS) features of one window_length window"""
+        return self.frames(np.ascontiguousarray(window, dtype=np.float32))[:PATCH_FRAMES]
+
+
+class StreamingLogMel(LogMelFrontend):
+    """
+    Log-mel patches of overlapping windows, computing only the frames not seen before
+
+    Frames are laid on a fixed grid of absolute sample positions (a frame
+    starts every STFT_HOP samples since the capture started), so the frames of
+    two overlapping windows coincide when both windows start on the grid;
+    align() moves a window end onto the grid. The features are kept in a ring
+    indexed by absolute frame number.
+    """
+
+    def __init__(self, capacity_frames=2 * PATCH_FRAMES):
+        """
+        Initialize the streaming frontend
+
+        Args:
+            capacity_frames (int): Features kept, at least PATCH_FRAMES
+        """
+        super().__init__()
+        if capacity_frames < PATCH_FRAMES:
+            raise ValueError(f"The feature ring must hold at least {PATCH_FRAMES} frames")
+        self._features = np.zeros((capacity_frames, MEL_BANDS), dtype=np.float32)
+        # Absolute number of the frame after the last computed one
+        self._next_frame = None
+        self.frames_computed = 0
+        self.patches = 0
+
+    @staticmethod
+    def align(end):
+        """Latest window end at or before end whose window starts on the frame grid"""
+        window_length = (PATCH_FRAMES - 1) * STFT_HOP + STFT_WINDOW
+        return end - (end - window_length) % STFT_HOP
+
+    def reset(self):
+        self._next_frame = None
+
+    def patch_at(self, window, end, out=None):
+        """
+        Features of the window ending at an absolute sample position
+
+        Args:
+            window (numpy.ndarray): window_length float32 samples ending at end
+            end (int): Absolute sample index of the end of the window, aligned with align()
+            out (numpy.ndarray): (PATCH_FRAMES, MEL_BANDS) array the patch is written to, if given
+
+        Returns:
+            numpy.ndarray: (PATCH_FRAMES, MEL_BANDS) float32 features
+        """
+        start = end - self.window_length
+        if start % STFT_HOP:
+            raise ValueError(f"Window ending at {end} is not on the frame grid, see align()")
+        first = start // STFT_HOP
+        last = first + PATCH_FRAMES
+        capacity = len(self._features)
+        following = self._next_frame
+        # Reuse the cached frames unless the window moved back or jumped past them
+        if following is None or following <= first or following > last:
+            following = first
+        if following < last:
+            offset = (following - first) * STFT_HOP
+            new = self.frames(np.ascontiguousarray(window[offset:], dtype=np.float32))
+            rows = np.arange(following, last) % capacity
+            self._features[rows] = new
+            self.frames_computed += len(new)
+        self._next_frame = last
+        self.patches += 1
+        return np.take(self._features, np.arange(first, last) % capacity, axis=0, out=out)
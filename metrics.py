@@ -0,0 +1,188 @@
+"""
+Metrics
+Preallocated counters, gauges and histograms exposed in the Prometheus text
+format by a small HTTP endpoint running on the daemon's event loop
+"""
+
+import asyncio
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Default endpoint ports of the daemons
+BCD_PORT = 9101
+HEARTBEAT_PORT = 9102
+PARENT_PORT = 9103
+# Networking stage of the multiprocess child (pipeline.py), the inference stage keeps BCD_PORT
+NETWORK_PORT = 9104
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic count; either incremented or read from fn() at scrape time"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, None, self.fn() if self.fn is not None else self.value
+
+
+class Gauge(Counter):
+    """Current value; either set or read from fn() at scrape time"""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self._bounds = tuple(sorted(buckets))
+        # One slot per bucket plus the +Inf one
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self._bounds + (float('inf'),), self._counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'le="{_format(bound)}"', cumulative
+        yield f"{self.name}_sum", None, self.sum
+        yield f"{self.name}_count", None, self.count
+
+
+class Registry:
+    """
+    Named metrics of one process
+
+    Metrics are created once and updated without locks: every metric has a
+    single writer thread, the scrape only reads.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif type(metric) is not cls:
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help, fn=None):
+        metric = self._get(Counter, name, help)
+        if fn is not None:
+            metric.fn = fn
+        return metric
+
+    def gauge(self, name, help, fn=None):
+        metric = self._get(Gauge, name, help)
+        if fn is not None:
+            metric.fn = fn
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}")
+            except Exception as e:
+                logger.debug(f"Failed to read metric {metric.name}: {e}")
+        lines.append('')
+        return '\n'.join(lines)
+
+
+# Registry shared by the roles of a process
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """Serves GET /metrics from the running event loop"""
+
+    def __init__(self, port, host='127.0.0.1', registry=None):
+        """
+        Initialize the metrics endpoint
+
+        Args:
+            port (int): TCP port to listen on
+            host (str): Address to bind to (default: local only)
+            registry (Registry): Metrics to serve (default: the process registry)
+        """
+        self._port = port
+        self._host = host
+        self._registry = registry if registry is not None else REGISTRY
+        self._server = None
+
+    async def start(self):
+        """Start listening; a busy port is logged and does not stop the daemon"""
+        try:
+            self._server = await asyncio.start_server(self._handle, self._host, self._port)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint disabled, cannot listen on {self._host}:{self._port}: {e}")
+            return
+        logger.info(f"Metrics available at http://{self._host}:{self._port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the request headers
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+                status, body = '200 OK', self._registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
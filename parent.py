@@ -2,60 +2,208 @@
 WebSocket Server
 Listens for heartbeat messages and sends acknowledgements
 Listens for baby cry detection messages
+Reports the children that went silent and shows the state on the status LED
 """
 
 import asyncio
 import websockets
 import json
 import logging
+import os
+import time
 from datetime import datetime
+from math import gcd
 import numpy as np
 import threading
 import queue
 import soundfile as sf
+import sys
 from gpiozero import LED
+from config import Config, ConfigError, defaults
+from hub import Hub
+from listen import JitterBuffer
+from logsetup import setup_logging
+from metrics import PARENT_PORT, REGISTRY, MetricsServer
+from tracing import LatencyBreakdown
 
 import sounddevice as sd
 sd.default.device = 0
 sd.default.channels = 1
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
+class SoundCache:
+    """Alert sounds decoded once, resampled to the output rate and kept in memory"""
+
+    def __init__(self, paths, sample_rate, max_bytes=32 * 1024 * 1024):
+        """
+        Initialize the sound cache
+
+        Args:
+            paths (list): Sound files to cache
+            sample_rate (int): Output device sample rate the sounds are resampled to
+            max_bytes (int): Memory budget; files beyond it are decoded on demand
+        """
+        self._paths = list(paths)
+        self._sample_rate = sample_rate
+        self._max_bytes = max_bytes
+        self._sounds = {}
+        self._stamps = {}
+
+    @property
+    def nbytes(self):
+        return sum(sound.nbytes for sound in self._sounds.values())
+
+    def _decode(self, path):
+        """Read a file as float32 mono at the output sample rate"""
+        data, file_rate = sf.read(path, dtype='float32', always_2d=True)
+        data = data.mean(axis=1)
+        if file_rate != self._sample_rate:
+            # Imported on first use, scipy adds most of the startup time
+            from scipy.signal import resample_poly
+
+            common = gcd(file_rate, self._sample_rate)
+            data = resample_poly(data, self._sample_rate // common, file_rate // common)
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    def _load(self, path):
+        try:
+            stat = os.stat(path)
+            sound = self._decode(path)
+        except Exception as e:
+            logger.error(f"Failed to load sound {path}: {e}")
+            self._sounds.pop(path, None)
+            self._stamps.pop(path, None)
+            return
+        self._stamps[path] = (stat.st_mtime_ns, stat.st_size)
+        old = self._sounds.pop(path, None)
+        if self.nbytes + sound.nbytes > self._max_bytes:
+            logger.warning(f"Sound cache budget exceeded, {path} will be decoded on demand")
+            return
+        self._sounds[path] = sound
+        logger.info(f"{'Reloaded' if old is not None else 'Cached'} sound {path}: "
+                    f"{len(sound) / self._sample_rate:.1f} s, {sound.nbytes / 1024:.0f} KiB")
+
+    def load(self):
+        """Decode every sound file"""
+        for path in self._paths:
+            self._load(path)
+
+    def refresh(self):
+        """Reload the files that changed on disk since they were cached"""
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self._stamps.get(path) != (stat.st_mtime_ns, stat.st_size):
+                self._load(path)
+
+    def choice(self):
+        """Pick a sound randomly and return its samples"""
+        path = self._paths[np.random.randint(len(self._paths))]
+        sound = self._sounds.get(path)
+        if sound is None:
+            sound = self._decode(path)
+        return path, sound
+
+
 class AudioPlayer:
-    """Non-blocking audio player that manages audio playback in a separate thread"""
+    """Non-blocking audio player feeding a persistent output stream from pre-decoded sounds"""
 
-    def __init__(self):
-        """Initialize the audio player"""
+    def __init__(self, metrics=None, sounds=None):
+        """
+        Initialize the audio player
+
+        Args:
+            metrics (Registry): Registry of the playback metrics (default: the process registry)
+            sounds (list): Alert sound files, one is picked at random per alert (default: the configured ones)
+        """
         self._audio_file = None
-        self._audio_data = None
-        self._sample_rate = None
         self._playback_queue = queue.Queue()
         self._is_playing = False
         self._playback_thread = None
         self._stop_event = threading.Event()
-        self._audio_list = [
-            "/home/rpi/lullgo/sounds/adel_shakal.wav",
-            "/home/rpi/lullgo/sounds/waaa2_1.wav",
-            "/home/rpi/lullgo/sounds/waaa2_2.wav",
-        ]
+        self._finished = threading.Event()
+        self._audio_list = list(sounds) if sounds else defaults('parent')['sounds']
+        self._refresh_interval = 5  # seconds
+        # Buffer currently fed to the output stream and the read position in it
+        self._current = None
+        self._position = 0
+        self._trigger_time = None
+        self._on_started = None
+        # Live stream played while no alert is playing
+        self._live = None
+        self.last_start_latency = None
+        metrics = metrics if metrics is not None else REGISTRY
+        self._start_latency = metrics.histogram('lullgo_parent_playback_start_seconds',
+                                                "Time from an alert to its first sample at the DAC")
+        self._skipped = metrics.counter('lullgo_parent_playbacks_skipped_total',
+                                        "Alerts not played because a sound was already playing")
+        metrics.gauge('lullgo_parent_playback_queue_depth', "Play commands waiting for the playback thread",
+                      fn=self._playback_queue.qsize)
+
+        # Open the output stream once and keep it running
+        self._sample_rate = int(sd.query_devices(sd.default.device[1], 'output')['default_samplerate'])
+        self._cache = SoundCache(self._audio_list, self._sample_rate)
+        self._cache.load()
+        self._stream = sd.OutputStream(
+            samplerate=self._sample_rate,
+            channels=1,
+            dtype='float32',
+            callback=self._audio_callback,
+        )
+        self._stream.start()
+        logger.info(f"Audio output stream open at {self._sample_rate} Hz, latency {self._stream.latency * 1000:.1f} ms")
 
         # Start the playback thread
         self._start__playback_thread()
 
-    def _load_audio(self):
-        """Load the audio file randomly from a list of audio files"""
-        try:
-            self._audio_file = np.random.choice(self._audio_list)
-            self._audio_data, self._sample_rate = sf.read(self._audio_file, dtype='float32')
-            logger.info(f"Loaded audio file: {self._audio_file}, " f"Sample rate: {self._sample_rate}")
-        except Exception as e:
-            logger.error(f"soundfile not available: {e}")
+    def set_sounds(self, sounds):
+        """
+        Switch to other alert sounds, decoded before the switch so alerts keep playing meanwhile
+
+        Runs the decoding on the calling thread, the output stream stays open.
+
+        Raises:
+            ValueError: if a file does not exist, the current sounds are kept
+        """
+        if list(sounds) == self._audio_list:
+            return
+        missing = [path for path in sounds if not os.path.isfile(path)]
+        if missing:
+            raise ValueError(f"Sound files not found: {missing}")
+        cache = SoundCache(sounds, self._sample_rate)
+        cache.load()
+        # The playback thread picks up the new cache with its next alert
+        self._audio_list = list(sounds)
+        self._cache = cache
+        logger.info(f"Alert sounds switched to {', '.join(self._audio_list)}")
+
+    def _audio_callback(self, outdata, frames, time_info, status):
+        """Runs on the PortAudio thread, copies the next frames of the current sound"""
+        buffer = self._current
+        if buffer is None:
+            live = self._live
+            if live is not None:
+                live.read_into(outdata[:, 0])
+            else:
+                outdata.fill(0)
+            return
+
+        position = self._position
+        if position == 0 and self._trigger_time is not None:
+            # Time from the trigger until the first sample reaches the DAC
+            dac_delay = max(0.0, time_info.outputBufferDacTime - time_info.currentTime)
+            self.last_start_latency = time.monotonic() - self._trigger_time + dac_delay
+        chunk = buffer[position:position + frames]
+        outdata[:len(chunk), 0] = chunk
+        outdata[len(chunk):] = 0
+        self._position = position + len(chunk)
+        if self._position >= len(buffer):
+            self._current = None
+            self._finished.set()
 
     def _start__playback_thread(self):
         """Start the audio playback thread"""
@@ -68,48 +216,84 @@ class AudioPlayer:
         logger.info("Audio playback thread started")
 
     def _playback_worker(self):
-        """Worker thread that handles audio playback"""
+        """Worker thread that switches the output stream to a new sound and keeps the cache fresh"""
+        last_refresh = time.monotonic()
         while not self._stop_event.is_set():
             try:
                 # Wait for play command (with timeout to check stop event)
                 play_signal = self._playback_queue.get(timeout=0.1)
                 if play_signal == "PLAY":
-                    # Load audio file randomly
-                    self._load_audio()
-
-                    self._is_playing = True
-                    logger.info("Starting audio playback")
-
-                    # Play audio - this will block until playback is complete
-                    # but that's OK since we're in a separate thread
-                    sd.play(self._audio_data, self._sample_rate)
-                    sd.wait()  # Wait for playback to finish
-
-                    logger.info("Audio playback finished")
+                    # Pick an audio file randomly, already decoded
+                    self.last_start_latency = None
+                    self._audio_file, sound = self._cache.choice()
+                    logger.info(f"Starting audio playback: {self._audio_file}")
+
+                    # Switch the buffer fed by the output stream
+                    self._finished.clear()
+                    self._position = 0
+                    self._current = sound
+                    while not self._finished.wait(timeout=0.1):
+                        if self._stop_event.is_set() or self._current is None:
+                            break
+
+                    if self.last_start_latency is not None:
+                        self._start_latency.observe(self.last_start_latency)
+                        if self._on_started is not None:
+                            self._on_started(self._trigger_time + self.last_start_latency)
+                    logger.info(f"Audio playback finished, start latency: "
+                                f"{(self.last_start_latency or 0.0) * 1000:.1f} ms")
                     self._is_playing = False
 
             except queue.Empty:
-                # No play command, just continue
+                # No play command, check the sound files for changes
+                if time.monotonic() - last_refresh >= self._refresh_interval:
+                    self._cache.refresh()
+                    last_refresh = time.monotonic()
                 continue
             except Exception as e:
                 logger.error(f"Error in playback worker: {e}")
                 self._is_playing = False
 
-    def play(self):
-        """Trigger audio playback (non-blocking)"""
+    def play(self, on_started=None):
+        """
+        Trigger audio playback (non-blocking)
+
+        Args:
+            on_started (callable): Called from the playback thread with the monotonic time the
+                first sample reached the DAC
+        """
         if self._is_playing:
             logger.info("Audio is already playing, skipping new request")
+            self._skipped.inc()
             return False
 
         # Add play command to queue (non-blocking)
         try:
+            self._is_playing = True
+            self._on_started = on_started
+            self._trigger_time = time.monotonic()
             self._playback_queue.put_nowait("PLAY")
             logger.info("Audio play command queued")
             return True
         except queue.Full:
             logger.warning("Playback queue is full")
+            self._is_playing = False
             return False
 
+    def start_live(self):
+        """
+        Play a live stream through the output stream until stop_live(), alerts take precedence
+
+        Returns:
+            JitterBuffer: buffer the received frames are pushed to
+        """
+        self._live = JitterBuffer(self._sample_rate, output_latency=self._stream.latency)
+        return self._live
+
+    def stop_live(self):
+        live, self._live = self._live, None
+        return live
+
     def is_playing(self):
         """Check if audio is currently playing"""
         return self._is_playing
@@ -117,7 +301,8 @@ class AudioPlayer:
     def stop(self):
         """Stop audio playback"""
         if self._is_playing:
-            sd.stop()
+            self._current = None
+            self._finished.set()
             self._is_playing = False
             logger.info("Audio playback stopped")
 
@@ -127,26 +312,269 @@ class AudioPlayer:
         self._stop_event.set()
         if self._playback_thread:
             self._playback_thread.join(timeout=1.0)
+        self._stream.stop()
+        self._stream.close()
         logger.info("Audio player shutdown complete")
 
 
+class StatusLed:
+    """
+    Status LED driven by state transitions
+
+    waiting (no child connected) blinks slowly, connected is steady and stale
+    (a child went silent) blinks fast. The GPIO is only touched when the
+    state changes.
+    """
+
+    PATTERNS = {
+        'waiting': {'on_time': 1.0, 'off_time': 1.0},
+        'connected': None,
+        'stale': {'on_time': 0.2, 'off_time': 0.2},
+    }
+
+    def __init__(self, pin):
+        """
+        Initialize the LED, waiting for children
+
+        Args:
+            pin (int): GPIO of the LED
+        """
+        self.pin = pin
+        self._led = LED(pin)
+        self.state = None
+        self.set('waiting')
+
+    def set(self, state):
+        """
+        Switch to a state
+
+        Returns:
+            bool: True if it changed
+        """
+        if state == self.state:
+            return False
+        pattern = self.PATTERNS[state]
+        if pattern is None:
+            self._led.on()
+        else:
+            self._led.blink(**pattern)
+        logger.info(f"Status LED: {self.state or 'off'} -> {state}")
+        self.state = state
+        return True
+
+    def close(self):
+        self._led.close()
+
+
 class WebsocketServer:
-    def __init__(self, host='0.0.0.0', port=8765):
+    def __init__(self, host=None, port=None, metrics_port=PARENT_PORT, metrics=None, settings=None):
         """
         Initialize the WebSocket server
 
         Args:
-            host (str): Host address to bind to (default: all interfaces)
-            port (int): Port to listen on
+            host (str): Host address to bind to (default: the configured one, all interfaces)
+            port (int): Port to listen on (default: the configured one)
+            metrics_port (int): Port of the local metrics endpoint (None disables it)
+            metrics (Registry): Registry of the server metrics (default: the process registry)
+            settings (dict): parent section of the configuration (default: the defaults of config.py), host and
+                port take precedence over it, also when it is reloaded; its ping_interval is the time between
+                keepalive pings to each client (None disables them) and ping_timeout the time without pong before
+                a client connection is closed, heartbeat_interval the heartbeat interval of the children (one
+                silent for twice as long is reported stale, one interval after its first missed heartbeat)
         """
-        self._host = host
-        self._port = port
+        overrides = {'host': host, 'port': port}
+        self._overrides = {key: value for key, value in overrides.items() if value is not None}
+        self._settings = settings = dict(settings if settings is not None else defaults('parent'), **self._overrides)
+        # Set to bind the websocket server again with the current settings
+        self._rebind = None
         self._clients = set()
-        self._client_info = {}
-        self._led = LED(26)
+        self._hub = Hub(heartbeat_interval=settings['heartbeat_interval'], on_liveness=self._on_liveness)
+        self._led = StatusLed(settings['led_pin'])
+        # Message type -> handler(websocket, data, received)
+        self._handlers = {
+            'heartbeat': self._on_heartbeat,
+            'bcd': self._on_bcd,
+            'subscribe': self._on_subscribe,
+            'clock_sync': self._on_clock_sync,
+            'hello': self._on_hello,
+            'listen': self._on_listen,
+        }
+        # (room, websocket of the streaming client, jitter buffer) while listening in
+        self._listening = None
 
         # Initialize audio player
-        self._audio_player = AudioPlayer()
+        self._audio_player = AudioPlayer(metrics=metrics, sounds=settings['sounds'])
+
+        # Metrics
+        self._metrics_port = metrics_port
+        self._metrics = metrics = metrics if metrics is not None else REGISTRY
+        self._messages = metrics.counter('lullgo_parent_messages_total', "Messages received from clients")
+        self._alerts = metrics.counter('lullgo_parent_alerts_total', "Alerts raised")
+        metrics.gauge('lullgo_parent_connections', "Open websocket connections", fn=lambda: len(self._clients))
+        metrics.gauge('lullgo_parent_clients', "Registered clients", fn=lambda: len(self._hub.clients))
+        self._stale = metrics.counter('lullgo_parent_stale_total', "Children reported silent")
+        metrics.gauge('lullgo_parent_stale_clients', "Children silent right now", fn=lambda: len(self._hub.stale))
+        self._latency = LatencyBreakdown(metrics=metrics)
+        self._listen_latency = metrics.histogram('lullgo_listen_latency_seconds',
+                                                 "Estimated capture-to-speaker latency of the live audio")
+        self._listen_frames = metrics.counter('lullgo_listen_frames_total', "Live audio frames received")
+
+    @property
+    def latency(self):
+        """Per-stage latency breakdown of the detections"""
+        return self._latency
+
+    def apply_config(self, settings):
+        """Apply the parent section of a reloaded configuration (see Config.add_listener)"""
+        asyncio.ensure_future(self._reconfigure(dict(settings, **self._overrides)))
+
+    async def _reconfigure(self, settings):
+        """
+        Switch to new settings, rebuilding only what they require
+
+        New alert sounds are decoded off the event loop before the switch, the
+        LED GPIO is reopened only when its pin changed, and the websocket server
+        is bound again (dropping the connections, the clients reconnect) only
+        when the address or the keepalive settings changed.
+        """
+        previous, self._settings = self._settings, settings
+        if settings['sounds'] != previous['sounds']:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._audio_player.set_sounds,
+                                                                 settings['sounds'])
+            except Exception as e:
+                logger.error(f"Failed to switch the alert sounds, keeping the current ones: {e}")
+                settings['sounds'] = previous['sounds']
+        if settings['led_pin'] != previous['led_pin']:
+            self._led.close()
+            self._led = StatusLed(settings['led_pin'])
+            self._update_led()
+            logger.info(f"Status LED moved to GPIO {self._led.pin}")
+        if settings['heartbeat_interval'] != previous['heartbeat_interval']:
+            self._hub.set_heartbeat_interval(settings['heartbeat_interval'])
+        if any(settings[key] != previous[key] for key in ('host', 'port', 'ping_interval', 'ping_timeout')):
+            if self._rebind is not None:
+                self._rebind.set()
+
+    async def _on_clock_sync(self, websocket, data, received):
+        """Answer a clock offset request with our receive and send times"""
+        await websocket.send(json.dumps({
+            'type': 'clock_sync',
+            't0': data.get('t0'),
+            't1': received,
+            't2': time.monotonic(),
+        }))
+
+    async def _on_heartbeat(self, websocket, data, received):
+        """Acknowledge a JSON heartbeat (compatibility mode)"""
+        record = self._hub.touch(websocket, data)
+        timestamp = data.get('timestamp', '')
+        record.last_heartbeat = timestamp
+
+        # Log the heartbeat (compatibility mode, liveness is normally checked with ping frames)
+        logger.debug(f"Heartbeat received from {record.name} at {timestamp}")
+
+        # Prepare acknowledgement
+        ack_message = {
+            'type': 'acknowledgement',
+            'server_name': 'rpi-parent',
+            'timestamp': datetime.now().isoformat(),
+            'received_heartbeat': timestamp,
+            'message': 'Heartbeat received and acknowledged'
+        }
+        if 't0' in data:
+            # Lets the client estimate the clock offset from the heartbeat exchange
+            ack_message.update(t0=data['t0'], t1=received, t2=time.monotonic())
+
+        # Send acknowledgement back to client
+        await websocket.send(json.dumps(ack_message))
+        logger.debug(f"acknowledgement sent to {record.name}")
+
+    async def _on_bcd(self, websocket, data, received):
+        """Raise an alert for the room of the client that detected a cry"""
+        record = self._hub.touch(websocket, data)
+        timestamp = data.get('timestamp', '')
+        record.last_bcd = timestamp
+
+        # Log the bcd message
+        delayed = data.get('delayed')
+        delayed = f", delayed {delayed:.1f} s by the client" if isinstance(delayed, (int, float)) and delayed else ""
+        logger.info(f"BCD message {data.get('trace_id')} received from {record.name} (room {record.room}) "
+                    f"at {timestamp}{delayed}")
+
+        trace = self._latency.begin(data, received)
+        played = False
+        if self._hub.alert(record, timestamp):
+            self._alerts.inc()
+            # Play audio
+            if not self._audio_player.is_playing():
+                played = self._audio_player.play(on_started=trace.playback_started if trace else None)
+        if trace is not None and not played:
+            trace.finish()
+
+    async def _on_hello(self, websocket, data, received):
+        """Register a client and what it offers"""
+        record = self._hub.touch(websocket, data)
+        logger.info(f"Client {record.name} offers {sorted(record.capabilities)}")
+
+    async def _on_listen(self, websocket, data, received):
+        """Start or stop playing a room's live audio on the local speaker"""
+        action = data.get('action')
+        if action == 'start':
+            room = data.get('room')
+            source = self._hub.find(room, 'listen')
+            if source is None:
+                logger.warning(f"No client of room {room} can be listened to")
+                await websocket.send(json.dumps({'type': 'listen', 'room': room, 'status': 'unavailable'}))
+                return
+            await self._stop_listening()
+            self._listening = (room, source.websocket, self._audio_player.start_live())
+            try:
+                await source.websocket.send(json.dumps({'type': 'listen', 'action': 'start'}))
+            except websockets.exceptions.ConnectionClosed:
+                # The child's connection just closed, not the requester's
+                logger.warning(f"Client {source.name} of room {room} disconnected, cannot listen to it")
+                await self._stop_listening(notify=False)
+                if websocket is not source.websocket:
+                    await websocket.send(json.dumps({'type': 'listen', 'room': room, 'status': 'unavailable'}))
+                return
+            logger.info(f"Listening to room {room} through {source.name}")
+            if websocket is not source.websocket:
+                await websocket.send(json.dumps({'type': 'listen', 'room': room, 'status': 'started'}))
+        elif action == 'stop':
+            await self._stop_listening()
+
+    async def _stop_listening(self, notify=True):
+        """Stop the live stream and tell its client, unless it is gone"""
+        if self._listening is None:
+            return
+        room, source, jitter = self._listening
+        self._listening = None
+        self._audio_player.stop_live()
+        if notify:
+            try:
+                await source.send(json.dumps({'type': 'listen', 'action': 'stop'}))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        logger.info(f"Stopped listening to room {room}: {jitter.summary()}")
+
+    def _on_audio_frame(self, websocket, data, received):
+        """Queue a live audio frame for playback"""
+        listening = self._listening
+        if listening is None or listening[1] is not websocket:
+            return
+        self._listen_frames.inc()
+        try:
+            latency = listening[2].push(data, received)
+        except ValueError as e:
+            logger.warning(f"Invalid audio frame from {websocket.remote_address}: {e}")
+            return
+        if latency is not None:
+            self._listen_latency.observe(latency)
+
+    async def _on_subscribe(self, websocket, data, received):
+        """Register a parent listener for the alerts of some rooms"""
+        self._hub.subscribe(websocket, data.get('client_name', str(websocket.remote_address)), data.get('rooms'))
 
     async def _handle_client(self, websocket):
         """
@@ -155,108 +583,125 @@ class WebsocketServer:
         Args:
             websocket: WebSocket connection object
         """
-        client_id = id(websocket)
         client_address = websocket.remote_address
         logger.info(f"New client connected: {client_address}")
         self._clients.add(websocket)
+        self._update_led()
 
         try:
             async for message in websocket:
+                received = time.monotonic()
+                if isinstance(message, bytes):
+                    self._on_audio_frame(websocket, message, received)
+                    continue
                 try:
                     # Parse the incoming message
                     data = json.loads(message)
-
-                    if data.get('type') == 'heartbeat':
-                        # Extract client information
-                        client_name = data.get('client_name', 'Unknown')
-                        timestamp = data.get('timestamp', '')
-
-                        # Log the heartbeat
-                        logger.info(f"Heartbeat received from {client_name} at {timestamp}")
-
-                        # Prepare acknowledgement
-                        ack_message = {
-                            'type': 'acknowledgement',
-                            'server_name': 'rpi-parent',
-                            'timestamp': datetime.now().isoformat(),
-                            'received_heartbeat': timestamp,
-                            'message': 'Heartbeat received and acknowledged'
-                        }
-
-                        # Send acknowledgement back to client
-                        await websocket.send(json.dumps(ack_message))
-                        logger.info(f"acknowledgement sent to {client_name}")
-
-                        # Store client info
-                        self._client_info[client_id] = {
-                            'name': client_name,
-                            'address': client_address,
-                            'last_heartbeat': timestamp,
-                            'last_seen': datetime.now().isoformat()
-                        }
-                    elif data.get('type') == 'bcd':
-                        # Extract client information
-                        client_name = data.get('client_name', 'Unknown')
-                        timestamp = data.get('timestamp', '')
-
-                        # Log the bcd message
-                        logger.info(f"BCD message received from {client_name} at {timestamp}")
-
-                        # Store client info
-                        self._client_info[client_id] = {
-                            'name': client_name,
-                            'address': client_address,
-                            'last_bcd': timestamp,
-                            'last_seen': datetime.now().isoformat()
-                        }
-
-                        # Play audio
-                        if not self._audio_player.is_playing():
-                            self._audio_player.play()
-                    else:
-                        logger.warning(f"Unknown message type from {client_address}: {data.get('type')}")
-
                 except json.JSONDecodeError:
                     logger.error(f"Invalid JSON received from {client_address}")
+                    continue
+                if not isinstance(data, dict):
+                    logger.error(f"Message from {client_address} is not a JSON object")
+                    continue
+
+                self._messages.inc()
+                handler = self._handlers.get(data.get('type'))
+                if handler is None:
+                    logger.warning(f"Unknown message type from {client_address}: {data.get('type')}")
+                    continue
+                try:
+                    await handler(websocket, data, received)
+                except websockets.exceptions.ConnectionClosed:
+                    raise
+                except Exception as e:
+                    # A malformed message must not take the connection and its subscriptions down
+                    logger.error(f"Error handling {data.get('type')} message from {client_address}: {e}")
 
         except websockets.exceptions.ConnectionClosed as e:
             logger.info(f"Client disconnected: {client_address}, reason: {e}")
         finally:
+            if self._listening is not None and self._listening[1] is websocket:
+                await self._stop_listening(notify=False)
             self._clients.remove(websocket)
-            if client_id in self._client_info:
-                del self._client_info[client_id]
+            self._hub.drop_connection(websocket)
+            self._update_led()
             logger.info(f"Active connections: {len(self._clients)}")
 
-    async def _periodic_status(self):
-        """Periodically check server status"""
-        while True:
-            await asyncio.sleep(3)
-            logger.info(f"Server status - Active connections: {len(self._clients)}")
-            if len(self._clients) != 0:
-                self._led.on()
-            else:
-                self._led.blink()
+    def _on_liveness(self, record, stale):
+        """A child went silent or was heard from again (see Hub)"""
+        if stale:
+            self._stale.inc()
+        self._update_led()
+
+    def _update_led(self):
+        """Show the worst state: a silent child, then no connection at all"""
+        if self._hub.stale:
+            self._led.set('stale')
+        elif self._clients:
+            self._led.set('connected')
+        else:
+            self._led.set('waiting')
 
     async def run(self):
-        """Run the WebSocket server"""
-        logger.info(f"Server will listen on all interfaces {self._host}:{self._port}")
+        """Run the WebSocket server, bound again when its settings change"""
+        watch_task = asyncio.create_task(self._hub.watch())
+        try:
+            await self._serve()
+        finally:
+            watch_task.cancel()
 
-        # Start periodic status logging
-        status_task = asyncio.create_task(self._periodic_status())
+    async def _serve(self):
+        if self._metrics_port:
+            await MetricsServer(self._metrics_port, registry=self._metrics).start()
 
-        # Start WebSocket server
-        async with websockets.serve(self._handle_client, self._host, self._port):
+        bound = None
+        while True:
+            settings = self._settings
+            self._rebind = asyncio.Event()
+            logger.info(f"Server will listen on {settings['host']}:{settings['port']}")
+            try:
+                server = await websockets.serve(self._handle_client, settings['host'], settings['port'],
+                                                ping_interval=settings['ping_interval'],
+                                                ping_timeout=settings['ping_timeout'])
+            except OSError as e:
+                if bound is None:
+                    raise
+                # Keep serving on the previous address rather than not at all
+                logger.error(f"Cannot listen on {settings['host']}:{settings['port']}: {e}, "
+                             f"back to {bound['host']}:{bound['port']}")
+                self._settings = dict(settings, **{key: bound[key] for key in
+                                                   ('host', 'port', 'ping_interval', 'ping_timeout')})
+                continue
+            bound = settings
             logger.info("WebSocket server is running.")
-            # Keep the server running
-            await asyncio.Future()
+            try:
+                await self._rebind.wait()
+            finally:
+                server.close()
+                await server.wait_closed()
+            logger.info("Binding the WebSocket server again with the new settings")
 
 
 def main():
     """Main function to run the server"""
-    server = WebsocketServer()
+    setup_logging("parent")
+    try:
+        config = Config()
+    except ConfigError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+    server = WebsocketServer(settings=config.section('parent'))
+    config.add_listener('parent', server.apply_config)
+
+    async def serve():
+        watcher = asyncio.create_task(config.run())
+        try:
+            await server.run()
+        finally:
+            watcher.cancel()
 
     try:
-        asyncio.run(server.run())
+        asyncio.run(serve())
     except Exception as e:
         logger.error(f"Server error: {e}")
 
@@ -0,0 +1,608 @@
+"""
+Multiprocess child
+Optional split of the child agent over three processes so audio capture,
+inference and networking each get their own GIL and core: the capture stage
+writes 16 kHz samples into a shared-memory ring buffer, the inference stage
+classifies windows straight from it and publishes detections as datagrams
+to the networking stage. A supervisor restarts a stage that exits or stalls
+without stopping the others.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from functools import partial
+from multiprocessing import shared_memory
+import numpy as np
+
+from capture import AudioCapture, RingBuffer
+from config import Config, identity
+from logsetup import setup_logging, shutdown_logging
+from metrics import BCD_PORT, NETWORK_PORT, REGISTRY, MetricsServer
+from startup import StartupProfiler, sd_notify
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Header of the shared ring buffer, int64 slots (the block time is read as float64)
+_WRITE_INDEX = 0
+_BLOCK_SEQ = 1
+_BLOCK_INDEX = 2
+_BLOCK_TIME = 3
+_OVERFLOWS = 4
+_RESTARTS = 5
+_HOPS_SKIPPED = 6
+_DROPPED = 7
+_HEADER_SLOTS = 8
+
+
+def _header_counter(slot, doc):
+    """Property reading and writing one counter of the shared header"""
+    def get(self):
+        return int(self._header[slot])
+
+    def set(self, value):
+        self._header[slot] = value
+
+    return property(get, set, doc=doc)
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    RingBuffer in a multiprocessing.shared_memory segment
+
+    One process writes, any number read. The write index is published after
+    the samples are in place, like in RingBuffer; the timestamp of the latest
+    block is two values, guarded by a sequence counter that is odd while the
+    writer updates them (readers retry instead of taking a lock). A few
+    counters of the stages live in the same header.
+    """
+
+    def __init__(self, capacity, name=None):
+        """
+        Create a ring buffer or attach to an existing one
+
+        Args:
+            capacity (int): Number of samples kept
+            name (str): Shared memory segment to attach to (default: create a new one)
+        """
+        self._capacity = capacity
+        self._owner = name is None
+        size = 8 * _HEADER_SLOTS + 4 * 2 * capacity
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._header = np.ndarray((_HEADER_SLOTS,), dtype=np.int64, buffer=self._shm.buf)
+        self._times = np.ndarray((_HEADER_SLOTS,), dtype=np.float64, buffer=self._shm.buf)
+        self._data = np.ndarray((2 * capacity,), dtype=np.float32, buffer=self._shm.buf, offset=8 * _HEADER_SLOTS)
+        if self._owner:
+            self._header[:] = 0
+            self._data[:] = 0.0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def _write_index(self):
+        return int(self._header[_WRITE_INDEX])
+
+    @_write_index.setter
+    def _write_index(self, value):
+        self._header[_WRITE_INDEX] = value
+
+    @property
+    def last_block(self):
+        """(write index, monotonic capture time) of the latest block, None before the first one"""
+        header = self._header
+        for _ in range(100):
+            seq = int(header[_BLOCK_SEQ])
+            if seq == 0:
+                return None
+            if seq % 2 == 0:
+                block = (int(header[_BLOCK_INDEX]), float(self._times[_BLOCK_TIME]))
+                if int(header[_BLOCK_SEQ]) == seq:
+                    return block
+        return None
+
+    @last_block.setter
+    def last_block(self, block):
+        header = self._header
+        header[_BLOCK_SEQ] += 1
+        header[_BLOCK_INDEX] = block[0]
+        self._times[_BLOCK_TIME] = block[1]
+        header[_BLOCK_SEQ] += 1
+
+    overflows = _header_counter(_OVERFLOWS, "Input overflows of the capture stage, summed over its restarts")
+    restarts = _header_counter(_RESTARTS, "Stage restarts by the supervisor")
+    hops_skipped = _header_counter(_HOPS_SKIPPED, "Hops the inference stage did not classify because it was behind")
+    dropped = _header_counter(_DROPPED, "Detections dropped because the networking stage did not drain them")
+
+    def close(self):
+        """Detach from the segment, the owner also removes it"""
+        del self._header, self._times, self._data
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedCapture:
+    """Read side of the capture stage, in place of AudioCapture in the other stages"""
+
+    def __init__(self, ring, sample_rate=SAMPLE_RATE, poll_interval=0.01):
+        """
+        Initialize the reader
+
+        Args:
+            ring (SharedRingBuffer): Ring buffer written by the capture stage
+            sample_rate (int): Sample rate of the ring buffer
+            poll_interval (float): Seconds between checks of the write index for the hop listener
+        """
+        self.ring = ring
+        self._sample_rate = sample_rate
+        self._poll_interval = poll_interval
+        self._hop_length = 0
+        self._hop_listener = None
+        self._next_hop = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    @property
+    def overflows(self):
+        return self.ring.overflows
+
+    def time_of(self, position):
+        """Monotonic time at which the sample at an absolute position was captured, None before the first block"""
+        last_block = self.ring.last_block
+        if last_block is None:
+            return None
+        index, captured = last_block
+        return captured - (index - position) / self._sample_rate
+
+    def set_hop_listener(self, hop_length, listener):
+        """Register a function called with the write index every hop_length new samples, from a polling thread"""
+        self._hop_length = hop_length
+        self._next_hop = self.ring.write_index + hop_length
+        self._hop_listener = listener
+
+    def set_hop_length(self, hop_length):
+        self._hop_length = hop_length
+
+    def _poll(self):
+        while not self._stop.wait(self._poll_interval):
+            write_index = self.ring.write_index
+            if self._hop_listener is not None and write_index >= self._next_hop:
+                missed = (write_index - self._next_hop) // self._hop_length
+                self._next_hop += (missed + 1) * self._hop_length
+                self._hop_listener(write_index)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, name="hop-poll", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+
+class DetectionPublisher:
+    """Stands in for the ClientConnection of the inference stage: messages go to the networking stage"""
+
+    def __init__(self, detections, ring):
+        """
+        Initialize the publisher
+
+        Args:
+            detections (socket.socket): Sending end of the datagram socket pair read by the networking stage
+            ring (SharedRingBuffer): Ring buffer whose header counts the dropped detections
+        """
+        self._detections = detections
+        self._detections.setblocking(False)
+        self._ring = ring
+        # The networking stage owns the connection
+        self.connected = True
+
+    def add_handler(self, message_type, handler):
+        pass
+
+    def add_state_listener(self, listener):
+        pass
+
+    def enqueue(self, message, coalesce_key=None, coalesce_window=0.0):
+        """Hand a message to the networking stage, which queues it on the real connection"""
+        trace = message.get('trace')
+        if trace is not None:
+            trace['published'] = time.monotonic()
+        try:
+            self._detections.send(json.dumps([message, coalesce_key, coalesce_window]).encode())
+            return True
+        except OSError as e:
+            # The socket buffer is full (the networking stage is stuck) or the message is too large
+            self._ring.dropped += 1
+            logger.warning(f"Dropped a {message.get('type')} message on its way to the networking stage: {e}")
+            return False
+
+
+class DetectionForwarder:
+    """Networking stage role: moves the detections of the inference stage onto the connection"""
+
+    def __init__(self, connection, detections, client_name="rpi-nurse.bcd", room=None, listen=True, metrics=None):
+        """
+        Initialize the forwarder
+
+        Args:
+            connection (ClientConnection): Connection to the server
+            detections (socket.socket): Receiving end of the datagram socket pair written by the inference stage
+            client_name (str): Name announced to the server with the listen-in capability
+            room (str): Room announced with it (default: the client name up to its first dot)
+            listen (bool): Announce live listen-in
+            metrics (Registry): Registry of the forwarding metrics (default: the process registry)
+        """
+        self._connection = connection
+        self._detections = detections
+        self._detections.setblocking(False)
+        self._client_name = client_name
+        self._room = room or client_name.split('.', 1)[0]
+        self._listen = listen
+        metrics = metrics if metrics is not None else REGISTRY
+        self._queue_latency = metrics.histogram('lullgo_pipeline_queue_seconds',
+                                                "Time from classification to the networking stage's outbound queue")
+        connection.add_state_listener(self._on_connection_state)
+
+    def _on_connection_state(self, connected):
+        if connected and self._listen:
+            asyncio.ensure_future(self._connection.send({
+                'type': 'hello',
+                'client_name': self._client_name,
+                'room': self._room,
+                'capabilities': ['listen'],
+            }))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.sock_recv(self._detections, 65536)
+            try:
+                message, coalesce_key, coalesce_window = json.loads(data)
+            except ValueError:
+                logger.error("Invalid detection datagram from the inference stage")
+                continue
+            published = (message.get('trace') or {}).get('published')
+            if published is not None:
+                self._queue_latency.observe(time.monotonic() - published)
+            self._connection.enqueue(message, coalesce_key=coalesce_key, coalesce_window=coalesce_window)
+
+
+class _ReadyProfiler(StartupProfiler):
+    """Tells the supervisor when the inference stage has classified its first window"""
+
+    def __init__(self, name, ready):
+        super().__init__(name)
+        self._ready = ready
+
+    def mark(self, phase):
+        super().mark(phase)
+        if phase == "first inference":
+            self._ready.set()
+
+
+def _init_stage(name):
+    """Common setup of a stage process"""
+    # Only the supervisor is the main process of the service, it reports readiness
+    os.environ.pop('NOTIFY_SOCKET', None)
+    # Ctrl-C reaches the whole process group, the supervisor stops the stages
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Until the stage watches its configuration, a reload forwarded by the supervisor must not kill it
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    setup_logging("child")
+    logger.info(f"Stage {name} started (pid {os.getpid()})")
+
+
+def _capture_stage(ring_name, ring_capacity, capture_factory, config_path):
+    """Capture process: the audio source writes into the shared ring buffer until SIGTERM"""
+    _init_stage("capture")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    config = Config(config_path)
+    ring = SharedRingBuffer(ring_capacity, name=ring_name)
+    capture = capture_factory(ring=ring)
+    if isinstance(capture, AudioCapture):
+        capture.set_device(config.section('bcd')['audio_device'])
+        # Only a new audio device concerns this stage, the stream is reopened on the same ring buffer
+        config.add_listener('bcd', lambda settings: capture.set_device(settings['audio_device']))
+    signal.signal(signal.SIGHUP, lambda *_: config.request_reload())
+    overflows = ring.overflows
+    try:
+        capture.start()
+        while True:
+            time.sleep(0.5)
+            ring.overflows = overflows + capture.overflows
+            config.check()
+    finally:
+        capture.stop()
+        ring.overflows = overflows + capture.overflows
+        shutdown_logging()
+
+
+async def _cancel_on_sigterm():
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+
+
+async def _run_inference(ring, detections, ready, options, metrics_port, config_path):
+    from bcd import BCD
+
+    await _cancel_on_sigterm()
+    config = Config(config_path)
+    profiler = _ReadyProfiler("inference", ready)
+    bcd = BCD(None, connection=DetectionPublisher(detections, ring), capture=SharedCapture(ring), live=False,
+              profiler=profiler, settings=config.section('bcd'), **options)
+    config.add_listener('bcd', bcd.apply_config)
+    profiler.mark("model load")
+    if bcd.sample_rate != SAMPLE_RATE:
+        raise ValueError(f"The model expects {bcd.sample_rate} Hz, the capture stage delivers {SAMPLE_RATE} Hz")
+    hops_skipped = REGISTRY.counter('lullgo_bcd_hops_skipped_total', "")
+    skipped = ring.hops_skipped
+    metrics_server = MetricsServer(metrics_port) if metrics_port else None
+    if metrics_server is not None:
+        await metrics_server.start()
+    task = asyncio.create_task(bcd.run())
+    watcher = asyncio.create_task(config.run())
+    try:
+        while not task.done():
+            await asyncio.wait([task], timeout=1.0)
+            ring.hops_skipped = skipped + hops_skipped.value
+        task.result()
+    finally:
+        task.cancel()
+        watcher.cancel()
+        if metrics_server is not None:
+            await metrics_server.stop()
+
+
+def _inference_stage(ring_name, ring_capacity, detections, ready, options, metrics_port, config_path):
+    """Inference process: classifies windows read from the shared ring buffer"""
+    _init_stage("inference")
+    ring = SharedRingBuffer(ring_capacity, name=ring_name)
+    try:
+        asyncio.run(_run_inference(ring, detections, ready, options, metrics_port, config_path))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        shutdown_logging()
+
+
+async def _run_network(ring, detections, options):
+    from client import ClientConnection, run_roles
+
+    await _cancel_on_sigterm()
+    config = Config(options['config_path'])
+    connection = ClientConnection(options['server_url'])
+    if options['follow_server_url']:
+        config.add_listener('client', connection.apply_config)
+    roles = [config]
+    if options['heartbeat']:
+        from heartbeat import Heartbeat
+        client_name, room = identity(options['client'], 'heartbeat')
+        heartbeat = Heartbeat(options['server_url'], client_name=client_name, room=room, connection=connection,
+                              json_heartbeat=options['json_heartbeat'], settings=config.section('heartbeat'))
+        config.add_listener('heartbeat', heartbeat.apply_config)
+        roles.append(heartbeat)
+    if ring is not None:
+        from listen import LiveStream
+        LiveStream(connection, SharedCapture(ring))
+        client_name, room = identity(options['client'], 'bcd')
+        roles.append(DetectionForwarder(connection, detections, client_name=client_name, room=room))
+        REGISTRY.counter('lullgo_pipeline_restarts_total', "Stages restarted by the supervisor",
+                         fn=lambda: ring.restarts)
+        REGISTRY.counter('lullgo_pipeline_dropped_total', "Detections dropped between inference and networking",
+                         fn=lambda: ring.dropped)
+    await run_roles(connection, roles, metrics_port=options['metrics_port'])
+
+
+def _network_stage(ring_name, ring_capacity, detections, options):
+    """Networking process: the server connection, the heartbeat role, forwarded detections and listen-in"""
+    _init_stage("network")
+    ring = SharedRingBuffer(ring_capacity, name=ring_name) if ring_name else None
+    try:
+        asyncio.run(_run_network(ring, detections, options))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        shutdown_logging()
+
+
+class _Stage:
+    """A supervised process"""
+
+    def __init__(self, name, target, args):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.process = None
+        self.started = 0.0
+        self.next_start = 0.0
+        self.backoff = 1.0
+        self.restarts = 0
+
+
+class Supervisor:
+    """Runs the stages of the multiprocess child and restarts the ones that exit or stall"""
+
+    def __init__(self, server_url, roles=('heartbeat', 'bcd'), json_heartbeat=False, clip_dir=None,
+                 backend=None, model_path=None, metrics_port=BCD_PORT, network_metrics_port=NETWORK_PORT,
+                 capture_factory=None, ring_seconds=10.0, stall_timeout=5.0, report_interval=60.0, govern=True,
+                 config_path=None, follow_server_url=True, client_name="rpi-nurse", room=None):
+        """
+        Initialize the supervisor
+
+        Args:
+            server_url (str): WebSocket server URL (e.g., ws://192.168.1.100:8765)
+            roles (tuple): Child roles, 'heartbeat' and/or 'bcd'
+            json_heartbeat (bool): Send JSON heartbeat messages instead of ping frames
+            clip_dir (str): Directory of the detection clips (None disables recording)
+            backend (str): Classifier backend of the inference stage (default: the configured one)
+            model_path (str): Model of the inference stage (default: the configured one)
+            metrics_port (int): Metrics endpoint of the inference stage, 0 disables it
+            network_metrics_port (int): Metrics endpoint of the networking stage, 0 disables it
+            capture_factory (callable): Picklable factory(ring=...) of the audio source (default: the I2S mic)
+            ring_seconds (float): Seconds of audio in the shared ring buffer
+            stall_timeout (float): Seconds without new samples after which the capture stage is restarted
+            report_interval (float): Seconds between two log lines of the pipeline counters
+            govern (bool): Let the inference governor adjust the classifier threads and rate
+            config_path (str): Configuration file every stage loads and watches (default: config.py's)
+            follow_server_url (bool): Reconnect to the configured server URL when it changes
+            client_name (str): Name of this child, its roles announce themselves as <client_name>.<role>
+            room (str): Room of this child (default: client_name)
+        """
+        self._server_url = server_url
+        self._roles = tuple(roles)
+        self._json_heartbeat = json_heartbeat
+        self._client = {'client_name': client_name, 'room': room}
+        bcd_name, bcd_room = identity(self._client, 'bcd')
+        self._bcd_options = {'clip_dir': clip_dir, 'backend': backend, 'model_path': model_path, 'govern': govern,
+                             'client_name': bcd_name, 'room': bcd_room}
+        self._config_path = config_path
+        self._follow_server_url = follow_server_url
+        self._metrics_port = metrics_port
+        self._network_metrics_port = network_metrics_port
+        self._capture_factory = capture_factory or partial(AudioCapture, output_rate=SAMPLE_RATE)
+        self._ring_capacity = int(ring_seconds * SAMPLE_RATE)
+        self._stall_timeout = stall_timeout
+        self._report_interval = report_interval
+        self._stopping = False
+        self._stages = []
+        # Latest reported counters, also available after run() returned
+        self.counters = {}
+
+    def _start(self, stage, context):
+        stage.process = context.Process(target=stage.target, args=stage.args, name=f"lullgo-{stage.name}",
+                                        daemon=True)
+        stage.process.start()
+        stage.started = time.monotonic()
+
+    def _stop_stage(self, stage, timeout=5.0):
+        process = stage.process
+        if process is None or not process.is_alive():
+            return
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning(f"Stage {stage.name} did not stop, killing it")
+            process.kill()
+            process.join(1.0)
+
+    def _report(self, ring):
+        """Log the pipeline counters and keep them in self.counters"""
+        counters = {'restarts': {stage.name: stage.restarts for stage in self._stages}}
+        restarts = ', '.join(f"{stage.name} {stage.restarts}" for stage in self._stages)
+        if ring is None:
+            logger.info(f"Pipeline restarts: {restarts}")
+        else:
+            counters.update(overflows=ring.overflows, hops_skipped=ring.hops_skipped, dropped=ring.dropped)
+            logger.info(f"Pipeline: {ring.overflows} input overflows, {ring.hops_skipped} hops skipped, "
+                        f"{ring.dropped} detections dropped, restarts: {restarts}")
+        self.counters = counters
+
+    def stop(self):
+        self._stopping = True
+
+    def reload(self):
+        """Have every running stage reload the configuration"""
+        for stage in self._stages:
+            if stage.process is not None and stage.process.is_alive():
+                os.kill(stage.process.pid, signal.SIGHUP)
+
+    def run(self):
+        """Start the stages and supervise them until SIGTERM or SIGINT"""
+        context = multiprocessing.get_context('spawn')
+        with_bcd = 'bcd' in self._roles
+        ring = SharedRingBuffer(self._ring_capacity) if with_bcd else None
+        ring_name = ring.name if ring is not None else None
+        # Datagrams survive a stage being killed at any point, unlike a queue with its locks and feeder thread
+        receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        ready = context.Event()
+        network_options = {
+            'server_url': self._server_url,
+            'heartbeat': 'heartbeat' in self._roles,
+            'json_heartbeat': self._json_heartbeat,
+            'metrics_port': self._network_metrics_port,
+            'config_path': self._config_path,
+            'follow_server_url': self._follow_server_url,
+            'client': self._client,
+        }
+        if with_bcd:
+            self._stages.append(_Stage("capture", _capture_stage,
+                                       (ring_name, self._ring_capacity, self._capture_factory, self._config_path)))
+            self._stages.append(_Stage("inference", _inference_stage,
+                                       (ring_name, self._ring_capacity, sender, ready, self._bcd_options,
+                                        self._metrics_port, self._config_path)))
+        self._stages.append(_Stage("network", _network_stage,
+                                   (ring_name, self._ring_capacity, receiver, network_options)))
+
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        signal.signal(signal.SIGINT, lambda *_: self.stop())
+        signal.signal(signal.SIGHUP, lambda *_: self.reload())
+        notified = not with_bcd
+        if notified:
+            sd_notify("READY=1")
+        last_report = time.monotonic()
+        last_progress = (0, time.monotonic())
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                for stage in self._stages:
+                    process = stage.process
+                    if process is not None and not process.is_alive():
+                        # Back off when a stage keeps failing, start over once it has run for a while
+                        if now - stage.started >= 60:
+                            stage.backoff = 1.0
+                        stage.next_start = now + stage.backoff
+                        stage.restarts += 1
+                        if ring is not None:
+                            ring.restarts += 1
+                        logger.error(f"Stage {stage.name} exited with code {process.exitcode}, "
+                                     f"restarting in {stage.backoff:.0f} s")
+                        stage.backoff = min(30.0, stage.backoff * 2)
+                        stage.process = None
+                    if stage.process is None and now >= stage.next_start and not self._stopping:
+                        self._start(stage, context)
+
+                if ring is not None:
+                    # A capture stage that is alive but stuck (e.g. a hung audio driver) is restarted too
+                    write_index = ring.write_index
+                    capture = self._stages[0]
+                    if write_index != last_progress[0] or capture.process is None:
+                        last_progress = (write_index, now)
+                    elif now - max(last_progress[1], capture.started + 10.0) > self._stall_timeout:
+                        logger.error(f"No audio for {now - last_progress[1]:.1f} s, restarting the capture stage")
+                        self._stop_stage(capture)
+                        last_progress = (write_index, now)
+                if not notified and ready.is_set():
+                    sd_notify("READY=1")
+                    notified = True
+                if now - last_report >= self._report_interval:
+                    last_report = now
+                    self._report(ring)
+                time.sleep(0.2)
+        finally:
+            logger.info("Stopping the pipeline")
+            for stage in reversed(self._stages):
+                self._stop_stage(stage)
+            self._report(ring)
+            receiver.close()
+            sender.close()
+            if ring is not None:
+                ring.close()
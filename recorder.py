@@ -0,0 +1,229 @@
+"""
+Clip recorder
+Keeps the audio around every detection: pre-roll and post-roll are copied out
+of the capture ring buffer and written as FLAC on a background thread, within
+a disk quota
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.jsonl'
+
+
+def read_index(path):
+    """
+    Read a clip index
+
+    Args:
+        path (str): Clip directory or its index file
+
+    Returns:
+        list: index entries, oldest first, with 'path' set to the clip file
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, INDEX_NAME)
+    directory = os.path.dirname(path)
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping invalid line in {path}")
+                continue
+            entry['path'] = os.path.join(directory, entry['file'])
+            entries.append(entry)
+    return entries
+
+
+class _PendingClip:
+    """Detection waiting for its post-roll"""
+
+    def __init__(self, start, end, detected, label, score):
+        self.start = start
+        self.end = end
+        self.detected = detected
+        self.label = label
+        self.score = score
+        self.detections = 1
+        self.time = datetime.now()
+
+
+class ClipRecorder:
+    """Writes the audio around detections to disk without blocking the inference loop"""
+
+    def __init__(self, directory, ring, sample_rate, window_length, pre_roll=3.0, post_roll=2.0,
+                 max_bytes=200 * 1024 * 1024, queue_size=4):
+        """
+        Initialize the clip recorder
+
+        Args:
+            directory (str): Directory of the clips and of their index
+            ring (RingBuffer): Capture ring buffer the clips are copied from
+            sample_rate (int): Sample rate of the ring buffer
+            window_length (int): Samples in one model window, the detection covers the window
+            pre_roll (float): Seconds kept before the detected window
+            post_roll (float): Seconds kept after the detected window
+            max_bytes (int): Disk quota of the clips, the oldest ones are evicted beyond it
+            queue_size (int): Clips waiting for the writer thread before new ones are dropped
+        """
+        self._directory = directory
+        self._ring = ring
+        self._sample_rate = sample_rate
+        self._window_length = window_length
+        self._pre_roll = int(pre_roll * sample_rate)
+        self._post_roll = int(post_roll * sample_rate)
+        self._max_bytes = max_bytes
+        # Keep clear of the samples the audio thread is about to overwrite
+        self._max_length = ring.capacity - ring.capacity // 8
+        if self._window_length + self._pre_roll + self._post_roll > self._max_length:
+            raise ValueError(f"Ring buffer of {ring.capacity} samples is too short for the pre/post-roll")
+        self._pending = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._index_path = os.path.join(directory, INDEX_NAME)
+        self._entries = []
+        self._total_bytes = 0
+        self.clips = 0
+        self.dropped = 0
+        self._thread = None
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def start(self):
+        """Load the existing index and start the writer thread"""
+        os.makedirs(self._directory, exist_ok=True)
+        if os.path.exists(self._index_path):
+            entries = [entry for entry in read_index(self._index_path) if os.path.exists(entry['path'])]
+            for entry in entries:
+                del entry['path']
+            self._entries = entries
+            self._total_bytes = sum(entry['bytes'] for entry in entries)
+            self._rewrite_index()
+        self._thread = threading.Thread(target=self._writer, name="clip-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Clip recorder writing to {self._directory}, {len(self._entries)} clips, "
+                    f"{self._total_bytes / 1e6:.1f} of {self._max_bytes / 1e6:.0f} MB used")
+
+    def stop(self):
+        """Write what is pending with the post-roll available so far and stop the writer thread"""
+        if self._pending is not None:
+            self._pending.end = min(self._pending.end, self._ring.write_index)
+            self._flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def trigger(self, position, label, score):
+        """
+        Record a detection (called from the inference loop)
+
+        Args:
+            position (int): Absolute sample index of the end of the detected window
+            label (str): Detected class
+            score (float): Its score
+        """
+        start = position - self._window_length - self._pre_roll
+        end = position + self._post_roll
+        pending = self._pending
+        if pending is not None and start <= pending.end:
+            # Overlapping detections share one clip, as long as it fits in the ring buffer
+            if end - pending.start <= self._max_length:
+                pending.end = max(pending.end, end)
+            pending.detections += 1
+            if score > pending.score:
+                pending.label, pending.score = label, score
+            return
+        if pending is not None:
+            self._flush()
+        self._pending = _PendingClip(start, end, position, label, score)
+
+    def poll(self, write_index):
+        """Hand the pending clip to the writer once its post-roll is captured (called every hop)"""
+        if self._pending is not None and write_index >= self._pending.end:
+            self._flush()
+
+    def _flush(self):
+        pending, self._pending = self._pending, None
+        start = max(pending.start, self._ring.write_index - self._max_length, 0)
+        if start >= pending.end:
+            return
+        # Copy now, the ring buffer moves on
+        samples = self._ring.read(start, pending.end).copy()
+        try:
+            self._queue.put_nowait((pending, start, samples))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Clip writer is behind, dropped the clip of {pending.label} ({pending.score:.2f})")
+
+    def _writer(self):
+        """Writer thread: encodes the clips, updates the index and enforces the quota"""
+        import soundfile as sf
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending, start, samples = item
+            name = (f"{pending.time.strftime('%Y%m%d-%H%M%S-%f')[:-3]}-"
+                    f"{pending.label.split(',')[0].replace(' ', '_')}.flac")
+            path = os.path.join(self._directory, name)
+            try:
+                sf.write(path, samples, self._sample_rate, format='FLAC', subtype='PCM_16')
+                size = os.path.getsize(path)
+            except Exception as e:
+                logger.error(f"Failed to write clip {path}: {e}")
+                continue
+            entry = {
+                'file': name,
+                'timestamp': pending.time.isoformat(),
+                'label': pending.label,
+                'score': round(float(pending.score), 4),
+                'detections': pending.detections,
+                'duration': round(len(samples) / self._sample_rate, 3),
+                # Offset of the end of the first detected window in the clip
+                'detected_at': round((pending.detected - start) / self._sample_rate, 3),
+                'bytes': size,
+            }
+            self._entries.append(entry)
+            self._total_bytes += size
+            self.clips += 1
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+                self._rewrite_index()
+            else:
+                with open(self._index_path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            logger.info(f"Clip {name} written: {entry['duration']:.1f} s, {size / 1024:.0f} KiB")
+
+    def _evict(self):
+        """Delete the oldest clips until the quota is met"""
+        while self._total_bytes > self._max_bytes and len(self._entries) > 1:
+            entry = self._entries.pop(0)
+            self._total_bytes -= entry['bytes']
+            try:
+                os.remove(os.path.join(self._directory, entry['file']))
+            except OSError as e:
+                logger.warning(f"Failed to evict clip {entry['file']}: {e}")
+            logger.info(f"Evicted clip {entry['file']} to stay within the disk quota")
+
+    def _rewrite_index(self):
+        """Replace the index file atomically"""
+        temporary = f"{self._index_path}.{int(time.time())}.tmp"
+        with open(temporary, 'w') as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temporary, self._index_path)
@@ -0,0 +1,172 @@
+"""
+Offline replay
+Streams WAV/FLAC files through the BCD windowing and classify path as fast as
+the CPU allows and reports throughput and latency figures
+"""
+
+import argparse
+import glob
+import logging
+import os
+import time
+from math import gcd
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+from capture import PolyphaseDecimator, RingBuffer
+from recorder import INDEX_NAME, read_index
+
+logger = logging.getLogger(__name__)
+
+
+class ReplaySource:
+    """Reads audio files block by block and delivers float32 mono samples at the model rate"""
+
+    def __init__(self, paths, sample_rate=16000, block_size=4800, channel=0):
+        """
+        Initialize the replay source
+
+        Args:
+            paths (list): Audio files, directories of audio files or clip indexes, replayed in order
+            sample_rate (int): Sample rate delivered to the pipeline
+            block_size (int): Frames read from disk per block
+            channel (int): Channel used when a file has more than one
+        """
+        self._paths = self._expand(paths)
+        self._sample_rate = sample_rate
+        self._block_size = block_size
+        self._channel = channel
+        self.audio_seconds = 0.0
+
+    @staticmethod
+    def _expand(paths):
+        files = []
+        for path in paths:
+            if path.endswith('.jsonl') or os.path.exists(os.path.join(path, INDEX_NAME)):
+                # Clips recorded around detections, oldest first
+                files.extend(entry['path'] for entry in read_index(path))
+            elif os.path.isdir(path):
+                files.extend(sorted(f for f in glob.glob(os.path.join(path, '*'))
+                                    if f.lower().endswith(('.wav', '.flac'))))
+            else:
+                files.append(path)
+        return files
+
+    @property
+    def paths(self):
+        return self._paths
+
+    def _converter(self, file_rate):
+        """Return a function converting one block at file_rate to the delivered rate"""
+        if file_rate == self._sample_rate:
+            return lambda block: block
+        if file_rate % self._sample_rate == 0:
+            decimator = PolyphaseDecimator(file_rate // self._sample_rate, max_block=self._block_size)
+            return decimator.process
+        common = gcd(file_rate, self._sample_rate)
+        up, down = self._sample_rate // common, file_rate // common
+        logger.warning(f"Resampling {file_rate} Hz -> {self._sample_rate} Hz block by block")
+        return lambda block: resample_poly(block, up, down).astype(np.float32)
+
+    def blocks(self):
+        """Yield consecutive blocks of mono samples from all files"""
+        for path in self._paths:
+            info = sf.info(path)
+            convert = self._converter(info.samplerate)
+            channel = min(self._channel, info.channels - 1)
+            logger.info(f"Replaying {path} ({info.duration:.1f} s, {info.samplerate} Hz)")
+            for block in sf.blocks(path, blocksize=self._block_size, dtype='float32', always_2d=True):
+                self.audio_seconds += len(block) / info.samplerate
+                yield convert(block[:, channel])
+
+
+def replay(bcd, source):
+    """
+    Feed a replay source through the BCD windowing, overlap and classify path
+
+    Args:
+        bcd (BCD): Detector providing input_length, hop_length, gate_stats, align_window and classify_window
+        source (ReplaySource): Audio to replay
+
+    Returns:
+        dict: throughput, latency and detection figures
+    """
+    input_length = bcd.input_length
+    ring = RingBuffer(4 * input_length)
+    next_end = input_length
+    latencies = []
+    detections = 0
+    gated_before = bcd.gate_stats['gated']
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for block in source.blocks():
+        ring.write(block)
+        while ring.write_index >= next_end:
+            end = bcd.align_window(next_end)
+            window = ring.read(end - input_length, end)
+            gated = bcd.gate_stats['gated']
+            start = time.perf_counter()
+            matches = bcd.classify_window(window, end)
+            elapsed = time.perf_counter() - start
+            # Latency figures only cover windows that reached the model
+            if bcd.gate_stats['gated'] == gated:
+                latencies.append(elapsed)
+            if matches:
+                detections += 1
+                logger.debug(f"Detection at {next_end / bcd.sample_rate:.2f} s: {matches}")
+            # The hop follows the adaptive inference rate
+            next_end += bcd.hop_length
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    inferences = len(latencies)
+    gated = bcd.gate_stats['gated'] - gated_before
+    latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        'files': len(source.paths),
+        'audio_seconds': source.audio_seconds,
+        'windows': inferences + gated,
+        'gated_windows': gated,
+        'inferences': inferences,
+        'inferences_per_second': inferences / wall if wall else 0.0,
+        'realtime_factor': source.audio_seconds / wall if wall else 0.0,
+        'cpu_seconds_per_audio_second': cpu / source.audio_seconds if source.audio_seconds else 0.0,
+        'classify_p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'classify_p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'detections': detections,
+    }
+
+
+def main():
+    """Replay audio files through the detector and print the figures"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('paths', nargs='+', help="WAV/FLAC files, directories or clip directories/indexes")
+    parser.add_argument('--model', default="/home/rpi/lullgo/models/yamnet.tflite")
+    parser.add_argument('--threads', type=int, default=4, help="classifier CPU threads")
+    parser.add_argument('--overlap', type=float, default=0.5, help="fixed overlap factor, in ]0, 1[")
+    parser.add_argument('--adaptive', action='store_true', help="use the adaptive inference rate instead of --overlap")
+    parser.add_argument('--backend', default='interpreter', choices=['interpreter', 'task', 'patch'])
+    parser.add_argument('--no-gate', action='store_true', help="run the model on every window")
+    parser.add_argument('--verbose', action='store_true', help="log every detection")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    from bcd import BCD
+
+    bcd = BCD(server_url=None, model_path=args.model, overlap_factor=args.overlap, cpu_threads=args.threads,
+              use_gate=not args.no_gate, backend=args.backend, adaptive=args.adaptive)
+    source = ReplaySource(args.paths, sample_rate=bcd.sample_rate)
+    stats = replay(bcd, source)
+
+    print(f"backend={args.backend} threads={args.threads} overlap={'adaptive' if args.adaptive else args.overlap} gate={not args.no_gate}")
+    for key, value in stats.items():
+        print(f"{key:>30}: {value:.3f}" if isinstance(value, float) else f"{key:>30}: {value}")
+
+
+if __name__ == '__main__':
+    main()
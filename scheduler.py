@@ -0,0 +1,99 @@
+"""
+Adaptive inference scheduler
+Runs with little overlap while the desired classes are quiet and steps up to
+dense overlap as soon as one of them starts to score
+"""
+
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveScheduler:
+    """Chooses the overlap between consecutive inference windows from recent scores"""
+
+    def __init__(self, input_length, sample_rate, score_threshold, quiet_overlap=0.0, active_overlap=0.8,
+                 rise_ratio=0.3, cooldown=10.0):
+        """
+        Initialize the scheduler
+
+        Args:
+            input_length (int): Samples in one model window
+            sample_rate (int): Sample rate of the windows
+            score_threshold (float): Detection threshold of the desired classes
+            quiet_overlap (float): Overlap used while the desired classes are quiet, in [0, 1[
+            active_overlap (float): Overlap used during activity, in [0, 1[
+            rise_ratio (float): Fraction of score_threshold that switches to dense overlap
+            cooldown (float): Seconds of audio without rising scores before going back to quiet
+        """
+        for overlap in (quiet_overlap, active_overlap):
+            if not 0 <= overlap < 1:
+                raise ValueError(f"Overlap {overlap} is outside [0, 1[")
+        self._input_length = input_length
+        self._sample_rate = sample_rate
+        self._rise_score = rise_ratio * score_threshold
+        self._quiet_overlap = quiet_overlap
+        self._active_overlap = active_overlap
+        self._cooldown_samples = int(cooldown * sample_rate)
+        self._active = False
+        self._last_rise = None
+        # Shortest hop allowed by a rate cap (see set_max_rate)
+        self._min_hop = 1
+
+    @property
+    def overlap(self):
+        return self._active_overlap if self._active else self._quiet_overlap
+
+    @property
+    def hop_length(self):
+        """Samples between two consecutive inferences at the current overlap and rate cap"""
+        return max(self._min_hop, int(self._input_length * (1 - self.overlap)))
+
+    @property
+    def inference_rate(self):
+        """Inferences per second of audio at the current overlap"""
+        return self._sample_rate / self.hop_length
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def set_max_rate(self, max_rate):
+        """
+        Cap the inference rate, whatever the overlap
+
+        Args:
+            max_rate (float): Highest inferences per second of audio, None for no cap
+
+        Returns:
+            bool: True when the hop length changed
+        """
+        hop_length = self.hop_length
+        # Rounded first, so a cap of sample_rate / input_length gives a hop of exactly input_length
+        self._min_hop = max(1, math.ceil(round(self._sample_rate / max_rate, 6))) if max_rate else 1
+        return self.hop_length != hop_length
+
+    def update(self, score, position):
+        """
+        Feed the best desired-class score of the window ending at position
+
+        Args:
+            score (float): Best desired-class score (0 for gated windows)
+            position (int): Absolute sample index of the end of the window
+
+        Returns:
+            bool: True when the hop length changed
+        """
+        was_active = self._active
+        if score >= self._rise_score:
+            self._last_rise = position
+            self._active = True
+        elif self._active and position - self._last_rise >= self._cooldown_samples:
+            self._active = False
+
+        if self._active == was_active:
+            return False
+        logger.info(f"Inference rate {'raised' if self._active else 'lowered'} to {self.inference_rate:.2f}/s "
+                    f"(overlap {self.overlap:.2f}, score {score:.2f})")
+        return True
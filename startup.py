@@ -0,0 +1,80 @@
+"""
+Startup helpers
+Phase-by-phase startup timing and systemd readiness notification
+"""
+
+import logging
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age():
+    """Seconds since this process was started, from /proc (0 if unavailable)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, fields are counted after its closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return max(0.0, uptime - started)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupProfiler:
+    """Records how long each startup phase took, measured from process start"""
+
+    def __init__(self, name):
+        """
+        Initialize the profiler
+
+        Args:
+            name (str): Name of the daemon, used in the log lines
+        """
+        self._name = name
+        self._origin = time.monotonic() - _process_age()
+        self._last = self._origin
+        self._phases = {}
+
+    def mark(self, phase):
+        """Record the end of a startup phase (only the first mark of a phase counts)"""
+        if phase in self._phases:
+            return
+        now = time.monotonic()
+        self._phases[phase] = now - self._origin
+        logger.info(f"{self._name} startup: {phase} done after {now - self._origin:.3f} s (+{now - self._last:.3f} s)")
+        self._last = now
+
+    @property
+    def phases(self):
+        """Seconds from process start to the end of every recorded phase"""
+        return dict(self._phases)
+
+
+def sd_notify(state):
+    """
+    Send a state string (e.g. "READY=1") to systemd for Type=notify services
+
+    Does nothing when the process was not started by systemd with NOTIFY_SOCKET.
+
+    Returns:
+        bool: True if the notification was sent
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # Abstract namespace socket
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+        return True
+    except OSError as e:
+        logger.warning(f"Failed to notify systemd: {e}")
+        return False
@@ -0,0 +1,56 @@
+"""
+Backend benchmark
+Compares the per-inference cost of the tflite_support Task library backend
+with the direct tflite_runtime interpreter backend
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import InterpreterBackend, TaskLibraryBackend  # noqa: E402
+
+DESIRED_CLASSES = ["Screaming", "Baby laughter", "Crying, sobbing", "Baby cry, infant cry"]
+
+
+def measure(name, fn, windows, warmup=5):
+    """Time fn over all windows after a few warmup calls"""
+    for window in windows[:warmup]:
+        fn(window)
+    timings = np.zeros(len(windows))
+    for i, window in enumerate(windows):
+        start = time.perf_counter()
+        fn(window)
+        timings[i] = time.perf_counter() - start
+    print(f"{name:>12}: mean {timings.mean() * 1e3:7.2f} ms, p50 {np.percentile(timings, 50) * 1e3:7.2f} ms, "
+          f"p99 {np.percentile(timings, 99) * 1e3:7.2f} ms")
+    return timings.mean()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', default="/home/rpi/lullgo/models/yamnet.tflite")
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    interpreter = InterpreterBackend(args.model, DESIRED_CLASSES, cpu_threads=args.threads)
+    task = TaskLibraryBackend(args.model, DESIRED_CLASSES, cpu_threads=args.threads)
+
+    rng = np.random.default_rng(0)
+    windows = [(rng.standard_normal(interpreter.input_length) * 0.1).astype(np.float32)
+               for _ in range(args.iterations)]
+
+    # invoke() alone is the floor both backends pay; the rest is per-inference overhead
+    raw = interpreter._interpreter
+    invoke = measure('invoke only', lambda window: raw.invoke(), windows)
+    for name, backend in (('interpreter', interpreter), ('task', task)):
+        mean = measure(name, backend.score, windows)
+        print(f"{'':>12}  overhead over invoke: {(mean - invoke) * 1e3:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Capture benchmark
+Compares the audio callback cost of the old FFT resample patch against the
+streaming polyphase decimator + ring buffer used by capture.py
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from scipy.signal import resample
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from capture import PolyphaseDecimator, RingBuffer  # noqa: E402
+
+
+def resample_callback(ring):
+    """Callback body of the patched tflite_support audio_record.py"""
+    def callback(data):
+        original_sr = 48000
+        target_sr = 16000
+        ratio = target_sr / original_sr
+        target_num_samples = int(len(data[:, 0]) * ratio)
+        resampled_data = resample(data[:, 0], target_num_samples)
+        resampled_data = resampled_data.reshape(-1, 1)
+        ring.write(resampled_data[:, 0])
+    return callback
+
+
+def decimator_callback(ring, block_size):
+    """Callback body of capture.AudioCapture"""
+    decimator = PolyphaseDecimator(3, max_block=block_size)
+
+    def callback(data):
+        ring.write(decimator.process(data[:, 0]))
+    return callback
+
+
+def measure(name, callback, blocks):
+    """Time every callback, then count allocations over a second pass"""
+    timings = np.zeros(len(blocks))
+    for i, block in enumerate(blocks):
+        start = time.perf_counter()
+        callback(block)
+        timings[i] = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    snapshot_start = tracemalloc.take_snapshot()
+    for block in blocks:
+        callback(block)
+    snapshot_end = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    stats = snapshot_end.compare_to(snapshot_start, 'filename')
+    allocations = sum(max(stat.count_diff, 0) for stat in stats)
+
+    block_seconds = len(blocks[0]) / 48000
+    print(f"{name:>10}: mean {timings.mean() * 1e6:8.1f} us, "
+          f"p99 {np.percentile(timings, 99) * 1e6:8.1f} us, "
+          f"cpu {timings.mean() / block_seconds * 100:5.2f}% of realtime, "
+          f"peak extra memory {peak / 1024:7.1f} KiB, "
+          f"retained blocks {allocations}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--block-size', type=int, default=1536, help="frames per callback at 48 kHz")
+    parser.add_argument('--seconds', type=float, default=30.0, help="amount of audio to push through")
+    args = parser.parse_args()
+
+    nof_blocks = int(args.seconds * 48000 / args.block_size)
+    rng = np.random.default_rng(0)
+    blocks = [rng.standard_normal((args.block_size, 2)).astype(np.float32) * 0.1 for _ in range(nof_blocks)]
+
+    print(f"{nof_blocks} callbacks of {args.block_size} frames ({args.seconds:.0f} s of 48 kHz stereo)")
+    measure('resample', resample_callback(RingBuffer(64000)), blocks)
+    measure('decimator', decimator_callback(RingBuffer(64000), args.block_size), blocks)
+
+
+if __name__ == '__main__':
+    main()
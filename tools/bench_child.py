@@ -0,0 +1,72 @@
+"""
+Child agent benchmark
+Compares the memory (RSS) and CPU used by heartbeat.py + bcd.py as two
+processes against child.py hosting both roles
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def measure(name, commands, warmup, duration):
+    """Start the processes, let them settle, then sample their RSS and CPU time"""
+    processes = [subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for command in commands]
+    try:
+        time.sleep(warmup)
+        if any(process.poll() is not None for process in processes):
+            raise RuntimeError(f"{name}: a process exited during warmup")
+        cpu_start = sum(cpu_seconds(process.pid) for process in processes)
+        samples = []
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            samples.append(sum(rss_kib(process.pid) for process in processes))
+            time.sleep(1.0)
+        cpu = sum(cpu_seconds(process.pid) for process in processes) - cpu_start
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    rss = max(samples) / 1024
+    print(f"{name:>12}: {len(processes)} process(es), peak RSS {rss:7.1f} MiB, CPU {cpu / duration * 100:5.1f}%")
+    return rss, cpu / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--python', default=sys.executable)
+    parser.add_argument('--warmup', type=float, default=20.0, help="seconds before sampling starts")
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds of sampling")
+    args = parser.parse_args()
+
+    separate = measure('two process', [[args.python, 'heartbeat.py'], [args.python, 'bcd.py']],
+                       args.warmup, args.duration)
+    combined = measure('child agent', [[args.python, 'child.py']], args.warmup, args.duration)
+    print(f"saved: {separate[0] - combined[0]:.1f} MiB RSS, {(separate[1] - combined[1]) * 100:.1f}% CPU")
+
+
+if __name__ == '__main__':
+    main()
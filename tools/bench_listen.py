@@ -0,0 +1,172 @@
+"""
+Live listen-in benchmark
+Measures the µ-law codec CPU cost and bandwidth, then streams synthetic
+capture audio through LiveStream, a loopback websocket and the parent's
+JitterBuffer in real time and reports the capture-to-speaker latency.
+Exits non-zero if the jitter buffer miscounts a single lost stretch of audio
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+import numpy as np
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from capture import RingBuffer  # noqa: E402
+from client import ClientConnection  # noqa: E402
+from codec import decode_frame, encode_frame  # noqa: E402
+from listen import JitterBuffer, LiveStream  # noqa: E402
+
+
+def bench_codec(seconds, sample_rate=16000, frame_seconds=0.02):
+    """Encode and decode noise frame by frame, return per-frame times and bytes per second"""
+    frame = int(frame_seconds * sample_rate)
+    audio = (np.random.randn(int(seconds * sample_rate)) * 0.1).astype(np.float32)
+    frames = [audio[i:i + frame] for i in range(0, len(audio) - frame + 1, frame)]
+    start = time.process_time()
+    encoded = [encode_frame(seq, seq * frame, sample_rate, samples) for seq, samples in enumerate(frames)]
+    encode = time.process_time() - start
+    start = time.process_time()
+    for data in encoded:
+        decode_frame(data)
+    decode = time.process_time() - start
+    audio_seconds = len(frames) * frame_seconds
+    return {
+        'encode_us_per_frame': encode / len(frames) * 1e6,
+        'decode_us_per_frame': decode / len(frames) * 1e6,
+        'encode_cpu_percent': encode / audio_seconds * 100,
+        'kbytes_per_second': sum(len(data) for data in encoded) / audio_seconds / 1000,
+        'pcm16_kbytes_per_second': sample_rate * 2 / 1000,
+    }
+
+
+def check_gap(frames=20, frame=320, gap=100, sample_rate=16000):
+    """One stretch of missing audio must count as one gap, the frames after it are not late"""
+    jitter = JitterBuffer(sample_rate)
+    position = 0
+    for seq in range(frames):
+        if seq == frames // 4:
+            position += gap
+        jitter.push(encode_frame(seq, position, sample_rate, np.zeros(frame, dtype=np.float32)), time.monotonic())
+        position += frame
+    return {'gaps': jitter.gaps, 'late': jitter.late}
+
+
+class SyntheticCapture:
+    """Writes a tone into a ring buffer in real time, in blocks like the I2S capture"""
+
+    def __init__(self, sample_rate=16000, block=512):
+        self.sample_rate = sample_rate
+        self.ring = RingBuffer(sample_rate * 4)
+        self._block = block
+        self._last_block = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def time_of(self, position):
+        last_block = self._last_block
+        if last_block is None:
+            return None
+        index, captured = last_block
+        return captured - (index - position) / self.sample_rate
+
+    def _run(self):
+        phase = 0
+        period = self._block / self.sample_rate
+        next_block = time.monotonic()
+        while not self._stop.is_set():
+            t = np.arange(phase, phase + self._block) / self.sample_rate
+            self.ring.write((0.2 * np.sin(2 * np.pi * 440 * t)).astype(np.float32))
+            self._last_block = (self.ring.write_index, time.monotonic())
+            phase += self._block
+            next_block += period
+            time.sleep(max(0.0, next_block - time.monotonic()))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def play_out(jitter, stop, output_rate, block):
+    """Pull output blocks from the jitter buffer like the PortAudio callback"""
+    out = np.zeros(block, dtype=np.float32)
+    period = block / output_rate
+    next_block = time.monotonic()
+    while not stop.is_set():
+        jitter.read_into(out)
+        next_block += period
+        time.sleep(max(0.0, next_block - time.monotonic()))
+
+
+async def bench_stream(seconds, network_jitter, output_rate=48000, port=18790):
+    jitter = JitterBuffer(output_rate)
+    last_arrival = [0.0]
+    loop = asyncio.get_running_loop()
+
+    async def handler(websocket):
+        await websocket.send('{"type": "listen", "action": "start"}')
+        async for message in websocket:
+            if isinstance(message, bytes):
+                # Simulated network jitter, frames keep their order like on TCP
+                arrival = max(last_arrival[0], time.monotonic() + random.uniform(0, network_jitter))
+                last_arrival[0] = arrival
+                loop.call_at(loop.time() + arrival - time.monotonic(),
+                             lambda data=message: jitter.push(data, time.monotonic()))
+                continue
+            data = json.loads(message)
+            if data.get('type') == 'clock_sync':
+                await websocket.send(json.dumps({'type': 'clock_sync', 't0': data['t0'],
+                                                 't1': time.monotonic(), 't2': time.monotonic()}))
+
+    capture = SyntheticCapture()
+    capture.start()
+    stop = threading.Event()
+    player = threading.Thread(target=play_out, args=(jitter, stop, output_rate, 1024), daemon=True)
+    player.start()
+    async with websockets.serve(handler, '127.0.0.1', port):
+        connection = ClientConnection(f'ws://127.0.0.1:{port}', clock_sync_interval=1)
+        stream = LiveStream(connection, capture)
+        task = asyncio.create_task(connection.run_with_reconnect())
+        cpu = time.process_time()
+        await asyncio.sleep(seconds)
+        cpu = time.process_time() - cpu
+        stream.stop()
+        task.cancel()
+    stop.set()
+    capture.stop()
+    summary = jitter.summary()
+    summary['child_encode_cpu_percent'] = stream.encode_seconds / seconds * 100
+    summary['process_cpu_percent'] = cpu / seconds * 100
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=10.0, help="duration of the streaming run")
+    parser.add_argument('--network-jitter-ms', type=float, default=0.0,
+                        help="random extra delay of every frame on the loopback link")
+    args = parser.parse_args()
+
+    gap = check_gap()
+    print(f"{'single gap':>28}: {gap['gaps']} gaps, {gap['late']} late frames")
+    if gap != {'gaps': 1, 'late': 0}:
+        print("FAILED: a single gap must give 1 gap and no late frames")
+        sys.exit(1)
+    for key, value in bench_codec(60).items():
+        print(f"{key:>28}: {value:.3f}")
+    print()
+    stats = asyncio.run(bench_stream(args.seconds, args.network_jitter_ms / 1000))
+    for key, value in stats.items():
+        print(f"{key:>28}: {value:.3f}" if isinstance(value, float) else f"{key:>28}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Log-mel frontend benchmark
+Feature extraction time per inference of the streaming frontend against
+computing the whole window every time, for the overlaps BCD uses
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from melfrontend import SAMPLE_RATE, LogMelFrontend, StreamingLogMel  # noqa: E402
+
+
+def bench(overlap, audio, iterations):
+    """Mean milliseconds per window of both frontends at one overlap"""
+    streaming = StreamingLogMel()
+    reference = LogMelFrontend()
+    window_length = streaming.window_length
+    hop = max(1, int(window_length * (1 - overlap)))
+    ends = []
+    end = window_length
+    while len(ends) < iterations and end <= len(audio):
+        ends.append(streaming.align(end))
+        end += hop
+    timings = {}
+    for name, fn in (('whole window', lambda end: reference.patch(audio[end - window_length:end])),
+                     ('streaming', lambda end: streaming.patch_at(audio[end - window_length:end], end))):
+        start = time.perf_counter()
+        for end in ends:
+            fn(end)
+        timings[name] = (time.perf_counter() - start) / len(ends) * 1e3
+    return hop, timings, streaming.frames_computed / streaming.patches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=300)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal(SAMPLE_RATE * 600) * 0.1).astype(np.float32)
+    print(f"{'overlap':>8} {'hop ms':>8} {'whole ms':>9} {'stream ms':>10} {'frames':>7} {'speedup':>8}")
+    for overlap in (0.0, 0.5, 0.8, 0.9, 0.95):
+        hop, timings, frames = bench(overlap, audio, args.iterations)
+        print(f"{overlap:8.2f} {hop / SAMPLE_RATE * 1e3:8.0f} {timings['whole window']:9.3f} "
+              f"{timings['streaming']:10.3f} {frames:7.1f} {timings['whole window'] / timings['streaming']:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
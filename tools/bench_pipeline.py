@@ -0,0 +1,193 @@
+"""
+Pipeline benchmark
+Runs the bcd role in the single-process child and in the multiprocess
+pipeline (pipeline.py) on the same audio, fed in real time through the
+capture decimator instead of the mic, against a local collector server, and
+reports input overruns, skipped hops, CPU and the capture-to-server latency of
+the detections
+
+    tools/bench_pipeline.py --audio cry.wav --seconds 120
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+from types import SimpleNamespace
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from capture import AudioCapture  # noqa: E402
+
+
+class FileCapture(AudioCapture):
+    """AudioCapture fed with a file (or noise) in real time, through the same callback and decimator as the mic"""
+
+    def __init__(self, audio=None, ring=None, ring_seconds=10.0):
+        super().__init__(output_rate=16000, ring=ring, ring_seconds=ring_seconds)
+        self._audio_path = audio
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load(self):
+        """Stereo blocks at the device rate, like the INMP441 delivers them"""
+        if self._audio_path is None:
+            rng = np.random.default_rng(0)
+            mono = (rng.standard_normal(self._input_rate * 30) * 0.01).astype(np.float32)
+        else:
+            import soundfile as sf
+            from scipy.signal import resample_poly
+
+            mono, rate = sf.read(self._audio_path, dtype='float32', always_2d=True)
+            mono = mono.mean(axis=1)
+            if rate != self._input_rate:
+                mono = resample_poly(mono, self._input_rate, rate).astype(np.float32)
+        return np.repeat(mono[:, None], self._channels, axis=1)
+
+    def _run(self):
+        audio = self._load()
+        block = self._block_size
+        period = block / self._input_rate
+        position = 0
+        next_block = time.monotonic()
+        while not self._stop.is_set():
+            if position + block > len(audio):
+                position = 0
+            now = time.monotonic()
+            # A real device would have overflowed its buffer by now
+            late = now - next_block > period
+            if late:
+                next_block = now
+            self._audio_callback(audio[position:position + block], block,
+                                 SimpleNamespace(currentTime=now, inputBufferAdcTime=now - period),
+                                 SimpleNamespace(input_overflow=late))
+            position += block
+            next_block += period
+            time.sleep(max(0.0, next_block - time.monotonic()))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="file-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+
+def run_single(args):
+    """Child side, single process: the bcd role and its connection on one event loop"""
+    from bcd import BCD
+    from client import ClientConnection, run_roles
+    from metrics import REGISTRY
+
+    connection = ClientConnection(args.server)
+    options = {'model_path': args.model} if args.model else {}
+    bcd = BCD(args.server, connection=connection, capture=FileCapture(args.audio), live=False,
+              backend=args.backend, **options)
+
+    async def main():
+        task = asyncio.create_task(run_roles(connection, [bcd]))
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    return {'overflows': REGISTRY.counter('lullgo_capture_overflows_total', "").fn(),
+            'hops_skipped': REGISTRY.counter('lullgo_bcd_hops_skipped_total', "").value}
+
+
+def run_multi(args):
+    """Child side, multiprocess pipeline"""
+    from pipeline import Supervisor
+
+    supervisor = Supervisor(args.server, roles=('bcd',), backend=args.backend, model_path=args.model,
+                            metrics_port=0, network_metrics_port=0, capture_factory=partial(FileCapture, args.audio))
+    supervisor.run()
+    return {key: value for key, value in supervisor.counters.items() if key != 'restarts'}
+
+
+async def collect(mode, args):
+    """Run one mode against a local server, return its figures"""
+    import websockets
+
+    latencies = []
+
+    async def handler(websocket):
+        async for message in websocket:
+            if isinstance(message, bytes):
+                continue
+            data = json.loads(message)
+            if data.get('type') == 'bcd' and data.get('trace', {}).get('captured') is not None:
+                # Same machine, same monotonic clock
+                latencies.append(time.monotonic() - data['trace']['captured'])
+            elif data.get('type') == 'clock_sync':
+                now = time.monotonic()
+                await websocket.send(json.dumps({'type': 'clock_sync', 't0': data['t0'], 't1': now, 't2': now}))
+
+    async with websockets.serve(handler, '127.0.0.1', args.port):
+        command = [sys.executable, os.path.abspath(__file__), '--run', mode, '--server', f'ws://127.0.0.1:{args.port}',
+                   '--backend', args.backend]
+        command += ['--model', args.model] if args.model else []
+        command += ['--audio', args.audio] if args.audio else []
+        process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        await asyncio.sleep(args.seconds)
+        process.send_signal(signal.SIGTERM)
+        # wait4 reports the CPU of the process and of the stage processes it waited for
+        _, _, usage = await asyncio.get_running_loop().run_in_executor(None, os.wait4, process.pid, 0)
+        counters = json.loads(process.stdout.read() or b'{}')
+
+    report = {'mode': mode, 'detections': len(latencies),
+              'cpu_percent': (usage.ru_utime + usage.ru_stime) / args.seconds * 100}
+    report.update(counters)
+    if latencies:
+        latencies = np.array(latencies) * 1000
+        report.update(latency_p50_ms=float(np.percentile(latencies, 50)),
+                      latency_p99_ms=float(np.percentile(latencies, 99)))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', help="audio file played in a loop (default: quiet noise, no detections)")
+    parser.add_argument('--seconds', type=float, default=60.0, help="duration of each run")
+    parser.add_argument('--model', default=None, help="model of the bcd role (default: BCD's)")
+    parser.add_argument('--backend', default='interpreter', choices=['interpreter', 'task', 'patch'])
+    parser.add_argument('--port', type=int, default=18766)
+    parser.add_argument('--modes', default='single,multi', help="comma separated modes out of single, multi")
+    parser.add_argument('--json', help="write the reports to this file")
+    parser.add_argument('--run', choices=['single', 'multi'], help=argparse.SUPPRESS)
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        from logsetup import setup_logging
+        setup_logging("child", "WARNING")
+        counters = run_single(args) if args.run == 'single' else run_multi(args)
+        print(json.dumps(counters))
+        return
+
+    reports = [asyncio.run(collect(mode.strip(), args)) for mode in args.modes.split(',')]
+    keys = sorted({key for report in reports for key in report if key != 'mode'})
+    print(f"{'':>16}" + ''.join(f"{report['mode']:>12}" for report in reports))
+    for key in keys:
+        values = [report.get(key) for report in reports]
+        print(f"{key:>16}" + ''.join(f"{value:12.1f}" if isinstance(value, float) else f"{str(value):>12}"
+                                     for value in values))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
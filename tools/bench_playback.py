@@ -0,0 +1,78 @@
+"""
+Playback benchmark
+Measures the time from an alert trigger until the first sample of the alert
+sound reaches the DAC, for the old read-from-disk + sd.play path and for the
+cached sounds fed into the persistent output stream of AudioPlayer
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import sounddevice as sd
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parent import AudioPlayer  # noqa: E402
+
+
+def legacy_latency(paths):
+    """sf.read from disk, then sd.play opening a fresh stream; first sample ~ start + output latency"""
+    trigger = time.monotonic()
+    data, sample_rate = sf.read(np.random.choice(paths), dtype='float32')
+    sd.play(data, sample_rate)
+    started = time.monotonic()
+    latency = started - trigger + sd.get_stream().latency
+    sd.stop()
+    return latency
+
+
+def cached_latency(player, timeout=2.0):
+    """AudioPlayer.play(), latency measured by the output callback on the first sample"""
+    player.last_start_latency = None
+    player.play()
+    deadline = time.monotonic() + timeout
+    while player.last_start_latency is None and time.monotonic() < deadline:
+        time.sleep(0.001)
+    latency = player.last_start_latency
+    player.stop()
+    return latency
+
+
+def report(name, latencies):
+    latencies = np.array([latency for latency in latencies if latency is not None]) * 1000
+    print(f"{name:>8}: median {np.median(latencies):7.1f} ms, p90 {np.percentile(latencies, 90):7.1f} ms, "
+          f"max {latencies.max():7.1f} ms over {len(latencies)} triggers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--drop-caches', action='store_true',
+                        help="drop the page cache before every legacy trigger (needs root), like a cold SD card read")
+    args = parser.parse_args()
+
+    player = AudioPlayer()
+    paths = player._audio_list
+
+    legacy = []
+    for _ in range(args.runs):
+        if args.drop_caches:
+            with open('/proc/sys/vm/drop_caches', 'w') as f:
+                f.write('3\n')
+        legacy.append(legacy_latency(paths))
+        time.sleep(0.2)
+
+    cached = []
+    for _ in range(args.runs):
+        cached.append(cached_latency(player))
+        time.sleep(0.2)
+    player.shutdown()
+
+    report('before', legacy)
+    report('after', cached)
+
+
+if __name__ == '__main__':
+    main()
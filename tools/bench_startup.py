@@ -0,0 +1,85 @@
+"""
+Startup benchmark
+Starts bcd.py the way systemd does (Type=notify) and measures the time until
+it reports READY=1, i.e. until the first inference has run
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASE_PATTERN = re.compile(r"startup: (.+) done after ([0-9.]+) s")
+
+
+def run_once(python, timeout):
+    """Start bcd.py once and return the time to READY=1 and the phases it logged"""
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, 'notify')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(address)
+        sock.settimeout(timeout)
+
+        env = dict(os.environ, NOTIFY_SOCKET=address)
+        start = time.monotonic()
+        process = subprocess.Popen([python, os.path.join(ROOT, 'bcd.py')], env=env, cwd=ROOT,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        phases = {}
+
+        def read_log():
+            for line in process.stderr:
+                match = PHASE_PATTERN.search(line)
+                if match:
+                    phases[match.group(1)] = float(match.group(2))
+
+        reader = threading.Thread(target=read_log, daemon=True)
+        reader.start()
+        try:
+            while True:
+                state = sock.recv(4096).decode()
+                if 'READY=1' in state.split('\n'):
+                    ready = time.monotonic() - start
+                    break
+        except socket.timeout:
+            ready = None
+        finally:
+            sock.close()
+            process.terminate()
+            process.wait()
+            reader.join(timeout=1.0)
+        return ready, phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=120.0, help="seconds to wait for READY=1")
+    parser.add_argument('--python', default=sys.executable, help="interpreter used to start bcd.py")
+    parser.add_argument('--json', help="write the results to this file to compare releases")
+    args = parser.parse_args()
+
+    results = []
+    for run in range(args.runs):
+        ready, phases = run_once(args.python, args.timeout)
+        results.append({'time_to_first_inference': ready, 'phases': phases})
+        print(f"run {run + 1}: time to first inference "
+              f"{'timeout' if ready is None else f'{ready:.3f} s'}, phases {phases}")
+
+    times = [result['time_to_first_inference'] for result in results if result['time_to_first_inference']]
+    if times:
+        print(f"median time to first inference: {np.median(times):.3f} s (min {min(times):.3f} s, max {max(times):.3f} s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Log-mel frontend check
+Checks that the streaming frontend gives the same patches as computing every
+window from scratch, against tf.signal when TensorFlow is installed, and that
+the patch model scores like the waveform model on the same windows
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from melfrontend import (FFT_LENGTH, LOG_OFFSET, MEL_BANDS, MEL_MAX_HZ, MEL_MIN_HZ, SAMPLE_RATE,  # noqa: E402
+                         STFT_HOP, STFT_WINDOW, LogMelFrontend, StreamingLogMel, mel_weight_matrix)
+
+
+def test_audio(seconds, seed=0):
+    """Noise, tones and silence, so every mel band sees some energy and the log offset matters"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.05 * rng.standard_normal(len(t)) + 0.3 * np.sin(2 * np.pi * (300 + 200 * t) * t)
+    audio[len(audio) // 3:len(audio) // 2] = 0.0
+    return audio.astype(np.float32)
+
+
+def check_streaming(audio, seed=0):
+    """Random hops, including skipped hops and a window moving back, against whole-window patches"""
+    rng = np.random.default_rng(seed)
+    streaming = StreamingLogMel()
+    reference = LogMelFrontend()
+    worst = 0.0
+    end = streaming.window_length
+    while end <= len(audio):
+        window = audio[end - streaming.window_length:end]
+        worst = max(worst, float(np.abs(streaming.patch_at(window, end) - reference.patch(window)).max()))
+        step = int(rng.choice([rng.integers(160, 4000), rng.integers(4000, 20000), -rng.integers(160, 2000)],
+                              p=[0.8, 0.15, 0.05]))
+        end = streaming.align(max(streaming.window_length, end + step))
+    print(f"streaming vs whole window: {streaming.patches} patches, max abs difference {worst:.3g}, "
+          f"{streaming.frames_computed / streaming.patches:.1f} frames computed per patch")
+    return worst
+
+
+def check_tensorflow(audio):
+    """The numpy port against YAMNet's tf.signal pipeline (models/research/audioset/yamnet/features.py)"""
+    try:
+        import tensorflow as tf
+    except ImportError:
+        print("tensorflow not installed, skipping the tf.signal comparison")
+        return 0.0
+    weights = tf.signal.linear_to_mel_weight_matrix(
+        num_mel_bins=MEL_BANDS, num_spectrogram_bins=FFT_LENGTH // 2 + 1, sample_rate=SAMPLE_RATE,
+        lower_edge_hertz=MEL_MIN_HZ, upper_edge_hertz=MEL_MAX_HZ).numpy()
+    window = audio[:LogMelFrontend().window_length]
+    magnitude = tf.abs(tf.signal.stft(window, frame_length=STFT_WINDOW, frame_step=STFT_HOP, fft_length=FFT_LENGTH))
+    expected = tf.math.log(tf.matmul(magnitude, weights) + LOG_OFFSET).numpy()
+    weights_difference = float(np.abs(mel_weight_matrix() - weights).max())
+    features_difference = float(np.abs(LogMelFrontend().patch(window) - expected).max())
+    print(f"tf.signal: mel matrix max abs difference {weights_difference:.3g}, "
+          f"log-mel max abs difference {features_difference:.3g}")
+    return max(weights_difference, features_difference)
+
+
+def check_models(audio, waveform_model, patch_model, windows):
+    """All class scores of the waveform model and of the patch model fed by the streaming frontend"""
+    from tflite_runtime.interpreter import Interpreter
+
+    def load(path):
+        interpreter = Interpreter(model_path=path)
+        interpreter.allocate_tensors()
+        return interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0]
+
+    waveform, waveform_input, waveform_output = load(waveform_model)
+    patches, patch_input, patch_output = load(patch_model)
+    streaming = StreamingLogMel()
+    hop = streaming.window_length // 4
+    worst = 0.0
+    end = streaming.window_length
+    for _ in range(windows):
+        end = streaming.align(end)
+        if end > len(audio):
+            break
+        window = audio[end - streaming.window_length:end]
+        waveform.set_tensor(waveform_input['index'], window.reshape(waveform_input['shape']))
+        waveform.invoke()
+        expected = waveform.get_tensor(waveform_output['index']).reshape(-1)
+        patch = streaming.patch_at(window, end)
+        patches.set_tensor(patch_input['index'], patch.reshape(patch_input['shape']))
+        patches.invoke()
+        scores = patches.get_tensor(patch_output['index']).reshape(-1)
+        worst = max(worst, float(np.abs(scores - expected).max()))
+        end += hop
+    print(f"patch model vs waveform model: max abs score difference {worst:.3g}")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=60.0, help="length of the test audio")
+    parser.add_argument('--waveform-model', help="YAMNet waveform model (e.g. /home/rpi/lullgo/models/yamnet.tflite)")
+    parser.add_argument('--patch-model', help="YAMNet patch model (tools/export_patch_model.py), compared with the "
+                                              "waveform model")
+    parser.add_argument('--windows', type=int, default=100, help="windows scored by both models")
+    parser.add_argument('--tolerance', type=float, default=1e-3, help="largest accepted difference")
+    args = parser.parse_args()
+    if bool(args.patch_model) != bool(args.waveform_model):
+        parser.error("--patch-model and --waveform-model are compared with each other, give both")
+
+    audio = test_audio(args.seconds)
+    failures = []
+    if check_streaming(audio) > args.tolerance:
+        failures.append("streaming")
+    if check_tensorflow(audio) > args.tolerance:
+        failures.append("tf.signal")
+    if args.patch_model:
+        if check_models(audio, args.waveform_model, args.patch_model, args.windows) > args.tolerance:
+            failures.append("models")
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
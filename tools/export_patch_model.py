@@ -0,0 +1,91 @@
+"""
+YAMNet patch model export
+Builds the tflite model of the patch backend: YAMNet without its waveform
+frontend, input [1, 96, 64] log-mel patches, output [1, 521] scores, with the
+label list of the waveform model packed in like yamnet.tflite. Runs on a
+desktop with TensorFlow and the YAMNet code of tensorflow/models:
+
+    git clone --depth 1 https://github.com/tensorflow/models.git
+    curl -O https://storage.googleapis.com/audioset/yamnet.h5
+    tools/export_patch_model.py --yamnet-dir models/research/audioset/yamnet --weights yamnet.h5 \\
+        --labels-from yamnet.tflite --output yamnet_patches.tflite
+    tools/check_melfrontend.py --waveform-model yamnet.tflite --patch-model yamnet_patches.tflite
+"""
+
+import argparse
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from melfrontend import MEL_BANDS, PATCH_FRAMES  # noqa: E402
+
+
+def read_labels(path):
+    """Label list of a model with its labels packed in (yamnet.tflite) or of a text file, one name per line"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as packed:
+            names = [name for name in packed.namelist() if name.endswith('.txt')]
+            if not names:
+                raise ValueError(f"No label file packed in {path}")
+            return names[0], packed.read(names[0]).decode()
+    with open(path) as f:
+        return 'yamnet_label_list.txt', f.read()
+
+
+def build_model(yamnet_dir, weights):
+    """Keras model from log-mel patches to scores, with the weights of the waveform model"""
+    import tensorflow as tf
+
+    sys.path.insert(0, yamnet_dir)
+    import params as yamnet_params
+    import yamnet as yamnet_lib
+
+    params = yamnet_params.Params()
+    if (params.patch_frames, params.patch_bands) != (PATCH_FRAMES, MEL_BANDS):
+        raise ValueError(f"YAMNet patches are {params.patch_frames}x{params.patch_bands}, "
+                         f"melfrontend.py computes {PATCH_FRAMES}x{MEL_BANDS}")
+    frames_model = yamnet_lib.yamnet_frames_model(params)
+    frames_model.load_weights(weights)
+
+    patches = tf.keras.layers.Input(batch_size=1, shape=(PATCH_FRAMES, MEL_BANDS), name='patches')
+    outputs = yamnet_lib.yamnet(patches, params)
+    # Older versions of yamnet.py return the predictions only, newer ones (predictions, embeddings)
+    predictions = outputs[0] if isinstance(outputs, (tuple, list)) else outputs
+    model = tf.keras.Model(inputs=patches, outputs=predictions)
+    # The layers are named in yamnet.py, the same names in both models
+    copied = 0
+    for layer in model.layers:
+        if layer.weights:
+            layer.set_weights(frames_model.get_layer(layer.name).get_weights())
+            copied += 1
+    if copied == 0:
+        raise ValueError("No YAMNet layer found in the patch model")
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--yamnet-dir', required=True, help="models/research/audioset/yamnet of tensorflow/models")
+    parser.add_argument('--weights', required=True, help="yamnet.h5")
+    parser.add_argument('--labels-from', required=True,
+                        help="waveform model with its labels packed in (yamnet.tflite) or a label file")
+    parser.add_argument('--output', default='yamnet_patches.tflite')
+    args = parser.parse_args()
+
+    import tensorflow as tf
+
+    label_name, labels = read_labels(args.labels_from)
+    model = build_model(args.yamnet_dir, args.weights)
+    flatbuffer = tf.lite.TFLiteConverter.from_keras_model(model).convert()
+    with open(args.output, 'wb') as f:
+        f.write(flatbuffer)
+    # Appended as a zip archive, the way the metadata writer packs yamnet.tflite's labels
+    with zipfile.ZipFile(args.output, 'a') as packed:
+        packed.writestr(label_name, labels)
+    count = len([line for line in labels.splitlines() if line.strip()])
+    print(f"{args.output}: input [1, {PATCH_FRAMES}, {MEL_BANDS}], {count} labels packed as {label_name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+Parent load generator
+Starts parent.py's WebsocketServer in a subprocess, with stand-ins for the
+LED, the sound device and the sound files so it runs on any Linux box, and
+drives it with N simulated nursery units sending heartbeats and cry
+detections at configurable rates and bursts. Reports throughput, ack RTT and
+alert latency percentiles, the server's event-loop lag, CPU and RSS.
+
+    tools/loadgen.py --clients 100 --duration 30
+    tools/loadgen.py --benchmark --json before.json
+    tools/loadgen.py --compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+# Scenarios of --benchmark: name -> options, run in this order with a fixed seed
+BENCHMARKS = {
+    'idle-10': {'clients': 10, 'heartbeat_interval': 2.0, 'bcd_interval': 0.0, 'burst_size': 0},
+    'steady-100': {'clients': 100, 'heartbeat_interval': 2.0, 'bcd_interval': 20.0, 'burst_size': 0},
+    'burst-100': {'clients': 100, 'heartbeat_interval': 2.0, 'bcd_interval': 5.0, 'burst_size': 20},
+    'heavy-300': {'clients': 300, 'heartbeat_interval': 0.5, 'bcd_interval': 10.0, 'burst_size': 0},
+}
+# Lower is better for every compared figure except the throughput
+HIGHER_IS_BETTER = ('throughput_per_s',)
+
+
+def install_stand_ins():
+    """Replace gpiozero, sounddevice and soundfile with in-process stand-ins (server side only)"""
+    gpiozero = types.ModuleType('gpiozero')
+
+    class LED:
+        def __init__(self, pin):
+            self.pin = pin
+
+        def on(self):
+            pass
+
+        def off(self):
+            pass
+
+        def blink(self, *args, **kwargs):
+            pass
+
+    gpiozero.LED = LED
+    sys.modules['gpiozero'] = gpiozero
+
+    sounddevice = types.ModuleType('sounddevice')
+
+    class Default:
+        def __init__(self):
+            self._device = (0, 0)
+            self.channels = 1
+
+        @property
+        def device(self):
+            return self._device
+
+        @device.setter
+        def device(self, value):
+            self._device = value if isinstance(value, (tuple, list)) else (value, value)
+
+    class TimeInfo:
+        def __init__(self, now, latency):
+            self.currentTime = now
+            self.outputBufferDacTime = now + latency
+
+    class OutputStream:
+        """Calls the callback from a thread at the pace of a real device"""
+
+        def __init__(self, samplerate, channels, dtype, callback, blocksize=1024):
+            self.samplerate = samplerate
+            self.latency = 0.01
+            self._channels = channels
+            self._callback = callback
+            self._blocksize = blocksize
+            self._stop = threading.Event()
+            self._thread = None
+
+        def _run(self):
+            out = np.zeros((self._blocksize, self._channels), dtype=np.float32)
+            period = self._blocksize / self.samplerate
+            next_block = time.monotonic()
+            while not self._stop.is_set():
+                self._callback(out, self._blocksize, TimeInfo(time.monotonic(), self.latency), None)
+                next_block += period
+                time.sleep(max(0.0, next_block - time.monotonic()))
+
+        def start(self):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+        def stop(self):
+            self._stop.set()
+
+        def close(self):
+            self._stop.set()
+
+    sounddevice.default = Default()
+    sounddevice.OutputStream = OutputStream
+    sounddevice.query_devices = lambda device=None, kind=None: {'default_samplerate': 48000.0}
+    sys.modules['sounddevice'] = sounddevice
+
+    soundfile = types.ModuleType('soundfile')
+
+    def read(path, dtype='float32', always_2d=False):
+        tone = (0.1 * np.sin(2 * np.pi * 440 * np.arange(24000) / 48000)).astype(dtype)
+        return (tone[:, None] if always_2d else tone), 48000
+
+    soundfile.read = read
+    sys.modules['soundfile'] = soundfile
+
+
+def percentiles(values, prefix):
+    """p50/p90/p99/max of a list of seconds, in milliseconds"""
+    if not values:
+        return {}
+    samples = np.array(values) * 1000
+    return {f'{prefix}_p50_ms': float(np.percentile(samples, 50)),
+            f'{prefix}_p90_ms': float(np.percentile(samples, 90)),
+            f'{prefix}_p99_ms': float(np.percentile(samples, 99)),
+            f'{prefix}_max_ms': float(samples.max())}
+
+
+async def monitor_loop_lag(interval, lags, stop):
+    """Measure how late the event loop wakes up from a sleep"""
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.monotonic() - start - interval))
+
+
+async def serve(port, stats_path):
+    """Server side: run the WebsocketServer until SIGTERM, then write the loop lag figures"""
+    install_stand_ins()
+    sys.path.insert(0, ROOT)
+    from logsetup import setup_logging
+    import parent
+
+    setup_logging("parent")
+    server = parent.WebsocketServer(host='127.0.0.1', port=port, metrics_port=None)
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    lags = []
+    monitor = asyncio.create_task(monitor_loop_lag(0.01, lags, stop))
+    task = asyncio.create_task(server.run())
+    await stop.wait()
+    task.cancel()
+    await monitor
+    with open(stats_path, 'w') as f:
+        json.dump(percentiles(lags, 'loop_lag'), f)
+
+
+class Results:
+    def __init__(self):
+        self.sent = 0
+        self.acks = 0
+        self.errors = 0
+        self.ack_rtts = []
+        self.alert_latencies = []
+        # Room -> monotonic time of its latest bcd message, alerts merged by the cooldown are not measured
+        self.pending_alerts = {}
+
+
+async def client(url, index, options, results, stop):
+    """One nursery unit: JSON heartbeats with acks, cry detections, synchronized bursts"""
+    import websockets
+
+    room = f"room{index:04d}"
+    name = f"{room}.loadgen"
+    pending = {}
+    rng = random.Random(options['seed'] + index)
+    await asyncio.sleep(rng.uniform(0, options['ramp']))
+    try:
+        async with websockets.connect(url, max_queue=None) as connection:
+            async def receive():
+                async for message in connection:
+                    data = json.loads(message)
+                    if data.get('type') == 'acknowledgement':
+                        sent = pending.pop(data.get('received_heartbeat'), None)
+                        if sent is not None:
+                            results.acks += 1
+                            results.ack_rtts.append(time.monotonic() - sent)
+
+            async def heartbeat(seq):
+                key = f"{index}-{seq}"
+                pending[key] = time.monotonic()
+                await connection.send(json.dumps({'type': 'heartbeat', 'client_name': name, 'timestamp': key}))
+                results.sent += 1
+
+            receiver = asyncio.create_task(receive())
+            seq = 0
+            start = time.monotonic()
+            next_heartbeat = start + rng.uniform(0, options['heartbeat_interval'])
+            next_bcd = start + rng.expovariate(1 / options['bcd_interval']) if options['bcd_interval'] else None
+            next_burst = start + options['burst_interval'] if options['burst_size'] else None
+            while not stop.is_set():
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    await heartbeat(seq)
+                    seq += 1
+                    next_heartbeat += options['heartbeat_interval']
+                if next_bcd is not None and now >= next_bcd:
+                    results.pending_alerts[room] = time.monotonic()
+                    await connection.send(json.dumps({'type': 'bcd', 'client_name': name, 'room': room,
+                                                      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}))
+                    results.sent += 1
+                    next_bcd = now + rng.expovariate(1 / options['bcd_interval'])
+                if next_burst is not None and now >= next_burst:
+                    # All clients burst at the same moments
+                    for _ in range(options['burst_size']):
+                        await heartbeat(seq)
+                        seq += 1
+                    next_burst += options['burst_interval']
+                wakeups = [t for t in (next_heartbeat, next_bcd, next_burst) if t is not None]
+                try:
+                    await asyncio.wait_for(stop.wait(), max(0.0, min(wakeups) - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+            # Give the last acks a moment
+            await asyncio.sleep(0.5)
+            receiver.cancel()
+    except Exception:
+        results.errors += 1
+
+
+async def alert_listener(url, results, ready, stop):
+    """Parent listener subscribed to every room, measuring bcd-to-alert latency"""
+    import websockets
+
+    async with websockets.connect(url, max_queue=None) as connection:
+        await connection.send(json.dumps({'type': 'subscribe', 'client_name': 'loadgen', 'rooms': ['*']}))
+        ready.set()
+        while not stop.is_set():
+            try:
+                data = json.loads(await asyncio.wait_for(connection.recv(), timeout=0.2))
+            except asyncio.TimeoutError:
+                continue
+            if data.get('type') == 'alert' and data.get('kind') != 'stale':
+                sent = results.pending_alerts.pop(data.get('room'), None)
+                if sent is not None:
+                    results.alert_latencies.append(time.monotonic() - sent)
+
+
+async def drive(url, options):
+    results = Results()
+    stop = asyncio.Event()
+    ready = asyncio.Event()
+    lags = []
+    listener = asyncio.create_task(alert_listener(url, results, ready, stop))
+    await asyncio.wait_for(ready.wait(), 10)
+    monitor = asyncio.create_task(monitor_loop_lag(0.01, lags, stop))
+    clients = [asyncio.create_task(client(url, index, options, results, stop)) for index in range(options['clients'])]
+    await asyncio.sleep(options['duration'])
+    stop.set()
+    await asyncio.gather(*clients, listener, monitor)
+    return results, lags
+
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    # utime and stime
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def run(options, python=sys.executable, port=18765):
+    """Start the server, drive it with the simulated clients and collect the figures"""
+    with tempfile.TemporaryDirectory() as directory:
+        stats_path = os.path.join(directory, 'server.json')
+        server = subprocess.Popen([python, os.path.abspath(__file__), '--serve', '--port', str(port),
+                                   '--stats', stats_path], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f"ws://127.0.0.1:{port}"
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("The server did not start")
+                    time.sleep(0.2)
+            cpu_start = cpu_seconds(server.pid)
+            results, client_lags = asyncio.run(drive(url, options))
+            cpu = cpu_seconds(server.pid) - cpu_start
+            rss = rss_kib(server.pid)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=10)
+        with open(stats_path) as f:
+            server_stats = json.load(f)
+
+    report = {
+        'clients': options['clients'],
+        'duration_s': options['duration'],
+        'messages_sent': results.sent,
+        'throughput_per_s': results.sent / options['duration'],
+        'acks': results.acks,
+        'errors': results.errors,
+        'server_cpu_percent': cpu / options['duration'] * 100,
+        'server_rss_mib': rss / 1024,
+    }
+    report.update(percentiles(results.ack_rtts, 'ack_rtt'))
+    report.update(percentiles(results.alert_latencies, 'alert'))
+    report.update(server_stats)
+    report.update({f'client_{key}': value for key, value in percentiles(client_lags, 'loop_lag').items()
+                   if key.endswith('p99_ms')})
+    return report
+
+
+def print_report(name, report):
+    print(f"== {name}")
+    for key, value in report.items():
+        print(f"{key:>28}: {value:.2f}" if isinstance(value, float) else f"{key:>28}: {value}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(before_path, after_path, tolerance):
+    """Print the figures of two benchmark files side by side, return False on a regression"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'':>40} {before['revision']:>12} {after['revision']:>12}   change")
+    ok = True
+    for scenario, figures in after['scenarios'].items():
+        old = before['scenarios'].get(scenario)
+        if old is None:
+            continue
+        print(f"== {scenario}")
+        for key, value in figures.items():
+            if key not in old or not isinstance(value, float) or not old[key]:
+                continue
+            change = (value - old[key]) / abs(old[key])
+            worse = -change if key in HIGHER_IS_BETTER else change
+            flag = ''
+            if worse > tolerance and (key.endswith('_ms') or key.startswith('server_') or key in HIGHER_IS_BETTER):
+                flag = '  <- regression'
+                ok = False
+            print(f"{key:>40} {old[key]:12.2f} {value:12.2f} {change * 100:+7.1f}%{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds of load")
+    parser.add_argument('--heartbeat-interval', type=float, default=2.0, help="seconds between heartbeats of a client")
+    parser.add_argument('--bcd-interval', type=float, default=20.0,
+                        help="mean seconds between cry detections of a client, 0 for none")
+    parser.add_argument('--burst-size', type=int, default=0, help="heartbeats every client sends at once in a burst")
+    parser.add_argument('--burst-interval', type=float, default=5.0, help="seconds between bursts")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds over which the clients connect")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--benchmark', action='store_true', help="run the fixed scenarios")
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="compare two benchmark files")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative change reported as a regression")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--stats', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.port, args.stats))
+        return
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.tolerance) else 1)
+
+    sys.path.insert(0, ROOT)
+    base = {'duration': args.duration, 'heartbeat_interval': args.heartbeat_interval,
+            'bcd_interval': args.bcd_interval, 'burst_size': args.burst_size, 'burst_interval': args.burst_interval,
+            'ramp': args.ramp, 'seed': args.seed, 'clients': args.clients}
+    scenarios = {name: dict(base, **options) for name, options in BENCHMARKS.items()} if args.benchmark \
+        else {'custom': base}
+
+    output = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'scenarios': {}}
+    for name, options in scenarios.items():
+        report = run(options, port=args.port)
+        output['scenarios'][name] = report
+        print_report(name, report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Simulated nursery units
+Connects dozens of concurrent children and a few parent listeners to a
+running parent server and checks that every heartbeat is acknowledged and
+that every room's alert reaches exactly the listeners subscribed to it, and
+that a child which stops sending is reported stale in time
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import websockets
+
+
+async def child(url, room, heartbeats, interval, results):
+    """One nursery unit: JSON heartbeats, then one cry detection"""
+    name = f"{room}.child"
+    async with websockets.connect(url) as connection:
+        acks = 0
+        for _ in range(heartbeats):
+            await connection.send(json.dumps({'type': 'heartbeat', 'client_name': name,
+                                              'timestamp': time.strftime('%H:%M:%S')}))
+            reply = json.loads(await asyncio.wait_for(connection.recv(), timeout=5))
+            acks += reply.get('type') == 'acknowledgement'
+            await asyncio.sleep(interval)
+        await connection.send(json.dumps({'type': 'bcd', 'client_name': name, 'room': room,
+                                          'timestamp': time.strftime('%H:%M:%S')}))
+        results['acks'] += acks
+
+
+async def silent_child(url, room, results):
+    """One nursery unit that hangs after its first heartbeat, its connection stays open"""
+    async with websockets.connect(url) as connection:
+        await connection.send(json.dumps({'type': 'heartbeat', 'client_name': f"{room}.child",
+                                          'timestamp': time.strftime('%H:%M:%S')}))
+        await asyncio.wait_for(connection.recv(), timeout=5)
+        results['silent_since'] = time.monotonic()
+        await results['stale'].wait()
+
+
+async def listener(url, name, rooms, ready, done, received, stale=None):
+    """One parent listener collecting the rooms it got cry alerts from, and the stale ones"""
+    async with websockets.connect(url) as connection:
+        await connection.send(json.dumps({'type': 'subscribe', 'client_name': name, 'rooms': rooms}))
+        ready.set()
+        while not done.is_set():
+            try:
+                message = json.loads(await asyncio.wait_for(connection.recv(), timeout=0.2))
+            except asyncio.TimeoutError:
+                continue
+            if message.get('type') != 'alert':
+                continue
+            if message.get('kind') != 'stale':
+                received[name].append(message['room'])
+            elif stale is not None and message['room'] == 'silent' and not stale.is_set():
+                stale.detected = time.monotonic()
+                stale.set()
+
+
+async def simulate(url, nof_children, heartbeats, interval, stale_timeout):
+    rooms = [f"room{i:02d}" for i in range(nof_children)]
+    subscriptions = {
+        'all': ['*'],
+        'even': rooms[0::2],
+        'first': rooms[:1],
+    }
+    received = {name: [] for name in subscriptions}
+    # The 'all' listener sets stale when the silent child is reported
+    results = {'acks': 0, 'stale': asyncio.Event()}
+    done = asyncio.Event()
+    readies = []
+    listeners = []
+    for name, subscribed in subscriptions.items():
+        ready = asyncio.Event()
+        readies.append(ready)
+        listeners.append(asyncio.create_task(listener(url, name, subscribed, ready, done, received,
+                                                      results['stale'] if subscribed == ['*'] else None)))
+    for ready in readies:
+        await ready.wait()
+
+    start = time.monotonic()
+    silent = asyncio.create_task(silent_child(url, 'silent', results))
+    await asyncio.gather(*(child(url, room, heartbeats, interval, results) for room in rooms))
+    await asyncio.sleep(1.0)
+    try:
+        await asyncio.wait_for(asyncio.shield(silent), stale_timeout)
+    except asyncio.TimeoutError:
+        silent.cancel()
+    done.set()
+    await asyncio.gather(*listeners)
+    elapsed = time.monotonic() - start
+
+    ok = results['acks'] == nof_children * heartbeats
+    print(f"{nof_children} children, {results['acks']}/{nof_children * heartbeats} heartbeats acknowledged "
+          f"in {elapsed:.1f} s")
+    for name, subscribed in subscriptions.items():
+        expected = sorted(rooms if subscribed == ['*'] else subscribed)
+        match = sorted(received[name]) == expected
+        ok = ok and match
+        print(f"listener {name:>5}: {len(received[name])}/{len(expected)} room alerts {'ok' if match else 'MISMATCH'}")
+    stale = results['stale']
+    if stale.is_set():
+        print(f"silent child reported stale after {stale.detected - results['silent_since']:.1f} s")
+    else:
+        print(f"silent child NOT reported stale within {stale_timeout} s")
+    return ok and stale.is_set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default="ws://localhost:8765")
+    parser.add_argument('--children', type=int, default=36)
+    parser.add_argument('--heartbeats', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.1, help="seconds between heartbeats of one child")
+    parser.add_argument('--stale-timeout', type=float, default=10.0,
+                        help="seconds the silent child may go unreported (the server's heartbeat_interval is 2)")
+    args = parser.parse_args()
+
+    ok = asyncio.run(simulate(args.url, args.children, args.heartbeats, args.interval, args.stale_timeout))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
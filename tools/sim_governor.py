@@ -0,0 +1,106 @@
+"""
+Inference governor simulation
+Plays a warm-nursery scenario through fake thermal and /proc/stat files and
+prints the governor's decisions, the resulting threads and rate cap, and the
+inference rate the scheduler would run at
+
+    tools/sim_governor.py --minutes 30 --ambient 30
+"""
+
+import argparse
+import math
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from governor import InferenceGovernor, SystemSource  # noqa: E402
+from metrics import Registry  # noqa: E402
+from scheduler import AdaptiveScheduler  # noqa: E402
+
+SAMPLE_RATE = 16000
+INPUT_LENGTH = 15600
+JIFFIES = 100  # per second and core
+
+
+class FakeSystem:
+    """Writes a thermal zone and a /proc/stat for a simulated SoC"""
+
+    def __init__(self, directory, cores=4, ambient=30.0):
+        self.thermal_path = os.path.join(directory, 'temp')
+        self.stat_path = os.path.join(directory, 'stat')
+        self.cores = cores
+        self.temperature = ambient + 15.0
+        self._ambient = ambient
+        self._busy = 0
+        self._total = 0
+
+    def step(self, seconds, load):
+        """Advance the simulation by seconds with load (fraction of all cores) and write the files"""
+        # First order heating: 40 C above ambient at full load, a two minute time constant
+        target = self._ambient + 10.0 + 40.0 * load
+        self.temperature += (target - self.temperature) * (1 - math.exp(-seconds / 120.0))
+        total = int(seconds * JIFFIES * self.cores)
+        self._busy += int(total * load)
+        self._total += total
+        idle = self._total - self._busy
+        with open(self.thermal_path, 'w') as f:
+            f.write(f"{int(self.temperature * 1000)}\n")
+        with open(self.stat_path, 'w') as f:
+            f.write(f"cpu  {self._busy} 0 0 {idle} 0 0 0 0 0 0\n")
+
+
+def inference_load(threads, rate, cores):
+    """CPU fraction of BCD: a 0.25 s inference on four threads, threads speed up sublinearly"""
+    seconds = 0.25 * 4 / threads ** 0.7
+    return min(1.0, rate * seconds * min(threads, cores) / 4 / cores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, default=30.0)
+    parser.add_argument('--ambient', type=float, default=30.0, help="room temperature in Celsius")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between two governor updates")
+    parser.add_argument('--recovery', type=float, default=60.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        system = FakeSystem(directory, ambient=args.ambient)
+
+        class Source(SystemSource):
+            def read(self):
+                reading = super().read()
+                # The fake /proc/stat holds the simulated BCD, not this process
+                reading['own'] = own
+                return reading
+
+        scheduler = AdaptiveScheduler(INPUT_LENGTH, SAMPLE_RATE, 0.5, quiet_overlap=0.0, active_overlap=0.75)
+        guaranteed = SAMPLE_RATE / INPUT_LENGTH
+        governor = InferenceGovernor(Source(system.thermal_path, system.stat_path), min_rate=guaranteed,
+                                     recovery=args.recovery, metrics=Registry())
+        own = None
+        lowest = float('inf')
+        steps = int(args.minutes * 60 / args.interval)
+        print(f"{'time':>6} {'temp C':>7} {'others':>7} {'threads':>8} {'cap':>6} {'rate':>6}  decision")
+        for step in range(steps):
+            now = step * args.interval
+            # A crying baby keeps the scheduler at its active overlap, another process runs from minute 10 to 15
+            crying = (now // 300) % 2 == 0
+            scheduler.update(1.0 if crying else 0.0, int(now * SAMPLE_RATE))
+            scheduler.set_max_rate(governor.max_rate)
+            rate = SAMPLE_RATE / scheduler.hop_length
+            lowest = min(lowest, rate)
+            own = inference_load(governor.threads, rate, system.cores)
+            others = 0.5 if 600 <= now < 900 else 0.05
+            system.step(args.interval, min(1.0, own + others))
+            decision = governor.update(now)
+            if decision is not None or step % 12 == 0:
+                print(f"{now:6.0f} {system.temperature:7.1f} {others:7.2f} {governor.threads:8d} "
+                      f"{governor.max_rate or 0.0:6.2f} {rate:6.2f}  {decision['reason'] if decision else ''}")
+        print(f"{len(governor.decisions)} decisions, lowest rate {lowest:.2f}/s, {guaranteed:.2f}/s guaranteed")
+        if lowest < guaranteed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Detection tracing
+Per-stage latency of a detection, from the child's microphone to the parent's
+speaker, with the child's timestamps mapped to the parent clock
+"""
+
+import logging
+import threading
+from collections import deque
+import numpy as np
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# capture -> classify done -> sent -> received by the parent -> first sample at the speaker
+STAGES = ('classify', 'send', 'network', 'playback', 'total')
+TRACE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class DetectionTrace:
+    """Stage latencies of one detection, completed when its alert starts playing"""
+
+    def __init__(self, breakdown, trace_id, client_name, stages, captured, received):
+        self._breakdown = breakdown
+        self.trace_id = trace_id
+        self.client_name = client_name
+        self.stages = stages
+        # Capture time on the parent clock, None if the child's clock offset is unknown
+        self._captured = captured
+        self._received = received
+
+    def playback_started(self, started):
+        """Called from the playback thread with the monotonic time the first sample reached the DAC"""
+        self.stages['playback'] = started - self._received
+        if self._captured is not None:
+            self.stages['total'] = started - self._captured
+        self._breakdown.complete(self)
+
+    def finish(self):
+        """Close a trace whose alert was not played"""
+        self._breakdown.complete(self)
+
+
+class LatencyBreakdown:
+    """Collects the detection traces and exposes the per-stage latencies as histograms"""
+
+    def __init__(self, metrics=None, size=256):
+        """
+        Initialize the breakdown
+
+        Args:
+            metrics (Registry): Registry of the stage histograms (default: the process registry)
+            size (int): Number of recent traces kept for summary()
+        """
+        metrics = metrics if metrics is not None else REGISTRY
+        self._histograms = {stage: metrics.histogram(f'lullgo_trace_{stage}_seconds',
+                                                     f"Detection latency of the {stage} stage", TRACE_BUCKETS)
+                            for stage in STAGES}
+        self._recent = deque(maxlen=size)
+        # Traces are completed from the event loop or from the playback thread
+        self._lock = threading.Lock()
+
+    def begin(self, data, received):
+        """
+        Start the trace of a bcd message
+
+        Args:
+            data (dict): bcd message, with its 'trace_id' and 'trace' timestamps
+            received (float): Monotonic time the message was received
+
+        Returns:
+            DetectionTrace: the trace, None if the message carries no trace
+        """
+        stamps = data.get('trace')
+        if not isinstance(stamps, dict):
+            return None
+        # Stamps that are not numbers are left out, a malformed trace must not cost the alert
+        stamps = {key: value for key, value in stamps.items()
+                  if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        stages = {}
+        captured, classified, sent = stamps.get('captured'), stamps.get('classified'), stamps.get('sent')
+        if captured is not None and classified is not None:
+            stages['classify'] = classified - captured
+        if classified is not None and sent is not None:
+            stages['send'] = sent - classified
+        offset = stamps.get('clock_offset')
+        if offset is not None and sent is not None:
+            stages['network'] = received - (sent + offset)
+        return DetectionTrace(self, data.get('trace_id'), data.get('client_name', 'Unknown'), stages,
+                              captured + offset if offset is not None and captured is not None else None, received)
+
+    def complete(self, trace):
+        """Record the stage latencies of a finished trace"""
+        with self._lock:
+            for stage, seconds in trace.stages.items():
+                # A clock offset error of up to half the sync round trip can make a stage slightly negative
+                self._histograms[stage].observe(max(0.0, seconds))
+            self._recent.append(trace.stages)
+        logger.info(f"Trace {trace.trace_id} from {trace.client_name}: " +
+                    ", ".join(f"{stage} {trace.stages[stage] * 1000:.1f} ms" for stage in STAGES
+                              if stage in trace.stages))
+
+    def summary(self):
+        """
+        Returns:
+            dict: stage -> (p50, p99) latency in milliseconds over the recent traces
+        """
+        with self._lock:
+            recent = list(self._recent)
+        result = {}
+        for stage in STAGES:
+            values = [stages[stage] for stages in recent if stage in stages]
+            if values:
+                samples = np.array(values) * 1000
+                result[stage] = (float(np.percentile(samples, 50)), float(np.percentile(samples, 99)))
+        return result
@@ -0,0 +1,111 @@
+"""
+Activity gate
+Cheap energy / spectral-flux / zero-crossing check that decides whether a
+window is worth running the YAMNet model on
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityGate:
+    """Vectorized pre-filter with an adaptive noise floor and a hangover period"""
+
+    def __init__(self, sample_rate=16000, frame_seconds=0.025, margin_db=6.0, flux_threshold_db=3.0,
+                 max_zero_crossing_rate=0.35, floor_db=-70.0, min_floor_db=-90.0,
+                 floor_fall=0.5, floor_rise=0.1, floor_rise_active=0.01, nof_bands=16, hangover=2):
+        """
+        Initialize the activity gate
+
+        Args:
+            sample_rate (int): Sample rate of the windows
+            frame_seconds (float): Length of the analysis frames inside a window
+            margin_db (float): Level above the noise floor that counts as activity
+            flux_threshold_db (float): Mean band-energy rise between two frames that marks an onset
+            max_zero_crossing_rate (float): Above this, moderately loud frames are treated as hiss unless there is an onset
+            floor_db (float): Initial noise floor
+            min_floor_db (float): Lowest value the noise floor can reach
+            floor_fall (float): Smoothing used when the level drops below the floor
+            floor_rise (float): Smoothing used when a quiet level is above the floor
+            floor_rise_active (float): Smoothing used while active, so steady noise is absorbed eventually
+            nof_bands (int): Frequency bands used for the spectral flux
+            hangover (int): Windows still classified after the last active one
+        """
+        self._frame_length = int(sample_rate * frame_seconds)
+        self._margin_db = margin_db
+        self._flux_threshold_db = flux_threshold_db
+        self._max_zcr = max_zero_crossing_rate
+        self._floor_db = floor_db
+        self._min_floor_db = min_floor_db
+        self._floor_fall = floor_fall
+        self._floor_rise = floor_rise
+        self._floor_rise_active = floor_rise_active
+        self._hangover = hangover
+        self._hangover_left = 0
+        self._window = np.hanning(self._frame_length).astype(np.float32)
+        nof_bins = self._frame_length // 2 + 1
+        self._band_edges = np.linspace(1, nof_bins, nof_bands + 1).astype(int)[:-1]
+        self.gated = 0
+        self.classified = 0
+
+    @property
+    def noise_floor_db(self):
+        return self._floor_db
+
+    def _features(self, window):
+        """Return the peak frame level (dB), median zero-crossing rate and peak spectral flux (dB)"""
+        nof_frames = len(window) // self._frame_length
+        frames = window[:nof_frames * self._frame_length].reshape(nof_frames, self._frame_length)
+
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        level_db = 20.0 * np.log10(rms.max() + 1e-10)
+
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(self._frame_length - 1)
+
+        # Band energies are far less noisy than single bins, so stationary
+        # noise stays well below the onset threshold
+        power = np.square(np.abs(np.fft.rfft(frames * self._window, axis=1)))
+        bands_db = 10.0 * np.log10(np.add.reduceat(power, self._band_edges, axis=1) + 1e-10)
+        flux = np.maximum(bands_db[1:] - bands_db[:-1], 0.0).mean(axis=1)
+
+        return level_db, float(np.median(zcr)), float(flux.max()) if len(flux) else 0.0
+
+    def is_active(self, window):
+        """
+        Decide whether the window has acoustic activity worth classifying
+
+        Args:
+            window (numpy.ndarray): float32 mono samples
+
+        Returns:
+            bool: True when the model should run on this window
+        """
+        level_db, zcr, flux = self._features(window)
+        above_floor = level_db - self._floor_db
+        loud = above_floor > self._margin_db
+        very_loud = above_floor > 3 * self._margin_db
+        onset = flux > self._flux_threshold_db and above_floor > self._margin_db / 2
+        active = onset or very_loud or (loud and zcr <= self._max_zcr)
+
+        if level_db < self._floor_db:
+            rate = self._floor_fall
+        elif active:
+            rate = self._floor_rise_active
+        else:
+            rate = self._floor_rise
+        self._floor_db = max(self._min_floor_db, self._floor_db + rate * (level_db - self._floor_db))
+
+        if active:
+            self._hangover_left = self._hangover
+        elif self._hangover_left > 0:
+            self._hangover_left -= 1
+            active = True
+
+        if active:
+            self.classified += 1
+        else:
+            self.gated += 1
+        return active